@@ -0,0 +1,218 @@
+"""Query budgets for the dashboard routes.
+
+Each route runs under a budget: a deadline shared by every statement of the
+request, an optional ceiling on the rows it may select and, for heavy
+routes, a slot from a small per-process semaphore so a few large exports
+cannot take every worker thread. While a statement runs a watchdog cancels
+it when the deadline passes or the client has disconnected, freeing the
+database session instead of finishing a result nobody will read.
+"""
+import os
+import time
+import select
+import socket
+import threading
+from functools import wraps
+from contextlib import contextmanager
+from flask import request, jsonify
+
+QUERY_TIMEOUT = float(os.getenv("QUERY_TIMEOUT_SECONDS", 30))
+EXPORT_TIMEOUT = float(os.getenv("EXPORT_TIMEOUT_SECONDS", 120))
+EXPORT_MAX_ROWS = int(os.getenv("EXPORT_MAX_ROWS", 1000000))
+PLATE_SCAN_MAX_ROWS = int(os.getenv("PLATE_SCAN_MAX_ROWS", 2000000))  # rows a %plate% search may scan
+HEAVY_CONCURRENCY = int(os.getenv("HEAVY_QUERY_CONCURRENCY", 2))  # per worker process
+ADMISSION_WAIT = float(os.getenv("ADMISSION_WAIT_SECONDS", 2))
+WATCH_INTERVAL = 0.5
+
+
+class QueryBudget:
+    __slots__ = ('name', 'timeout', 'max_rows', 'heavy')
+
+    def __init__(self, name, timeout=QUERY_TIMEOUT, max_rows=None, heavy=False):
+        self.name = name
+        self.timeout = timeout
+        self.max_rows = max_rows
+        self.heavy = heavy
+
+
+BUDGETS = {budget.name: budget for budget in (
+    QueryBudget('dashboard'),
+    QueryBudget('aggregates'),
+    QueryBudget('rows'),
+    QueryBudget('trends'),
+    QueryBudget('pivot', heavy=True),
+    QueryBudget('vehicles', heavy=True),
+    QueryBudget('export', EXPORT_TIMEOUT, EXPORT_MAX_ROWS, heavy=True),
+)}
+
+# The database drivers' own timeout backs up the watchdog
+STATEMENT_TIMEOUT = int(max(budget.timeout for budget in BUDGETS.values())) + 5
+
+
+class QueryRejected(Exception):
+    """A request refused or stopped by its budget; carries the HTTP status to answer with"""
+    status = 400
+    retry_after = None
+
+
+class TooExpensive(QueryRejected):
+    status = 413
+
+
+class Overloaded(QueryRejected):
+    status = 503
+    retry_after = 5
+
+
+class QueryTimeout(QueryRejected):
+    status = 504
+
+
+class ClientDisconnected(QueryRejected):
+    status = 499  # nginx's code for a request the client abandoned; never actually delivered
+
+
+class RequestBudget:
+    __slots__ = ('budget', 'deadline', 'socket', 'reason')
+
+    def __init__(self, budget, client_socket):
+        self.budget = budget
+        self.deadline = time.monotonic() + budget.timeout
+        self.socket = client_socket
+        self.reason = None
+
+    def remaining(self):
+        return self.deadline - time.monotonic()
+
+
+_local = threading.local()
+_heavy_slots = threading.BoundedSemaphore(HEAVY_CONCURRENCY)
+
+
+def current():
+    """State of the budgeted request running on this thread, or None outside budgeted views"""
+    return getattr(_local, 'request', None)
+
+
+def current_budget():
+    state = current()
+    return state.budget if state is not None else None
+
+
+def budgeted(name):
+    """Run a view under the budget called ``name``"""
+    budget = BUDGETS[name]
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if budget.heavy and not _heavy_slots.acquire(timeout=ADMISSION_WAIT):
+                raise Overloaded(f"Too many {name} requests are running; try again shortly")
+            _local.request = RequestBudget(budget, request.environ.get('gunicorn.socket'))
+            try:
+                return view(*args, **kwargs)
+            finally:
+                _local.request = None
+                if budget.heavy:
+                    _heavy_slots.release()
+        return wrapper
+    return decorator
+
+
+def check_rows(estimated, plate_search=False, row_limit=True):
+    """Refuse a request before running it when the row estimate exceeds its budget.
+
+    ``row_limit`` is False when the estimate leaves out a plate filter: it is
+    then only the number of rows scanned, not returned, so only the scan
+    bound applies.
+    """
+    state = current()
+    if state is None:
+        return
+    if plate_search and estimated > PLATE_SCAN_MAX_ROWS:
+        raise TooExpensive(
+            f"A vehicle search over {estimated:,} transactions is too broad; narrow the dates or other filters"
+        )
+    if row_limit and state.budget.max_rows and estimated > state.budget.max_rows:
+        raise TooExpensive(
+            f"{estimated:,} transactions exceed the {state.budget.name} limit of {state.budget.max_rows:,}; narrow the filters"
+        )
+
+
+def client_disconnected(client_socket):
+    """True once the peer has closed its end; pipelined request bytes do not count"""
+    if client_socket is None:
+        return False
+    try:
+        readable, _, _ = select.select([client_socket], [], [], 0)
+        return bool(readable) and client_socket.recv(1, socket.MSG_PEEK) == b''
+    except BlockingIOError:
+        return False
+    except (OSError, ValueError):
+        return True
+
+
+@contextmanager
+def guard(cancel):
+    """Run one statement under the current budget.
+
+    ``cancel`` is called from a watchdog thread if the deadline passes or the
+    client goes away, and the driver's resulting error is re-raised as
+    QueryTimeout or ClientDisconnected. Outside budgeted views this is a
+    no-op.
+    """
+    state = current()
+    if state is None:
+        yield
+        return
+    if state.remaining() <= 0:
+        raise QueryTimeout(f"The {state.budget.name} query budget of {state.budget.timeout:g}s was used up")
+
+    done = threading.Event()
+
+    def watch():
+        while not done.wait(min(WATCH_INTERVAL, max(state.remaining(), 0))):
+            if state.remaining() <= 0:
+                state.reason = 'timeout'
+            elif client_disconnected(state.socket):
+                state.reason = 'disconnect'
+            else:
+                continue
+            cancel()
+            return
+
+    watchdog = threading.Thread(target=watch, name='query-watchdog', daemon=True)
+    watchdog.start()
+    try:
+        yield
+    except QueryRejected:
+        raise
+    except Exception as e:
+        if state.reason == 'timeout':
+            raise QueryTimeout(f"The {state.budget.name} query took longer than {state.budget.timeout:g}s") from e
+        if state.reason == 'disconnect':
+            raise ClientDisconnected("The client disconnected") from e
+        raise
+    finally:
+        done.set()
+        watchdog.join()
+
+
+def cancel_statement(dbapi_connection):
+    """Ask SQL Server to abandon the statement running on a pymssql connection"""
+    try:
+        dbapi_connection._conn.cancel()
+    except Exception:
+        pass
+
+
+def rejected(error):
+    response = jsonify(error=str(error))
+    response.status_code = error.status
+    if error.retry_after:
+        response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+
+def init_admission(app):
+    app.register_error_handler(QueryRejected, rejected)
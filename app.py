@@ -1,207 +1,654 @@
-from flask import Flask, render_template, request, send_file, url_for
-import pandas as pd
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import seaborn as sns
+from flask import Flask, Response, render_template, request, send_file, url_for, jsonify
 import os
+import time
+import threading
 from io import BytesIO
+from tempfile import SpooledTemporaryFile
 from dotenv import load_dotenv
 from datetime import datetime
 from math import ceil
-from sqlalchemy import create_engine
-import pyodbc
+import snapshot
+from dimensions import DimensionCache
+from replica import ReplicaRouter
+from records import AggregateRow, TRANSACTION_COLUMNS, decode_transactions, totals_by
+from delivery import init_delivery, content_addressed_name, accepts_gzip, gzip_writer
+from charts import ChartSpec, render_charts
+from exports import EXPORT_BATCH_ROWS, EXPORT_FORMATS, write_export
+from events import EVENT_STREAM_LIMIT, DataVersion, version_stream
+from cache import RESULT_CACHE_DIR, MISS, ResultCache, ViewTracker, view_key
+from pivot import PIVOT_MEASURES, fold, grouping_query, parse_axis, pivot_table, validate_axes
+from sketches import estimate, merge_encoded
+from trends import BUCKETS, TREND_POINTS, build_series, choose_bucket, parse_date
+from admission import (EXPORT_MAX_ROWS, STATEMENT_TIMEOUT, Overloaded, QueryRejected, budgeted, cancel_statement,
+                       check_rows, current_budget, guard, init_admission)
+
+# SQLAlchemy is imported on first use so worker start-up only pays for Flask.
+# Plotting runs in the chart worker pool (charts.py), pandas is only needed by
+# the Excel export and pyarrow by the other export formats; request paths work
+# on tuples and slotted records.
 
 # Load environment variables
 load_dotenv()
 
-app = Flask(__name__)
-app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0  # Prevent caching of chart images
-
 # Database configuration
 # DB_CONFIG = f"mssql+pyodbc://{os.getenv('DB_USER')}:{os.getenv('DB_PASS')}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}?driver=ODBC+Driver+17+for+SQL+Server"
-# engine = create_engine(DB_CONFIG)
 
 DB_CONFIG = f"mssql+pymssql://{os.getenv('DB_USER')}:{os.getenv('DB_PASS')}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}"
-engine = create_engine(DB_CONFIG)
+
+# Optional read-only secondary for dashboard reads; on Azure SQL read scale-out
+# DB_READ_HOST may equal DB_HOST, the read-only intent selects the secondary.
+# Empty keys, as left in .env.example, fall back like unset ones.
+DB_READ_HOST = os.getenv('DB_READ_HOST') or None
+DB_READ_PORT = os.getenv('DB_READ_PORT') or os.getenv('DB_PORT')
+DB_READ_CONFIG = (
+    f"mssql+pymssql://{os.getenv('DB_USER')}:{os.getenv('DB_PASS')}@{DB_READ_HOST}:"
+    f"{DB_READ_PORT}/{os.getenv('DB_NAME')}"
+) if DB_READ_HOST else None
+
+_engine = None
+_replica_engine = None
+_engine_lock = threading.Lock()
+
+dimension_cache = DimensionCache()
+replica_router = ReplicaRouter()
+data_version = DataVersion()
+_event_streams = threading.BoundedSemaphore(EVENT_STREAM_LIMIT)
+
+# Shared result cache and popular-view tracker, enabled by RESULT_CACHE_DIR
+result_cache = ResultCache(RESULT_CACHE_DIR) if RESULT_CACHE_DIR else None
+view_tracker = ViewTracker(RESULT_CACHE_DIR) if RESULT_CACHE_DIR else None
+
+def get_engine():
+    """Create the SQLAlchemy engine for the primary on first use"""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                from sqlalchemy import create_engine
+                # pymssql's own query timeout backs up the per-route budgets in admission.py
+                _engine = create_engine(DB_CONFIG, connect_args={'timeout': STATEMENT_TIMEOUT})
+    return _engine
+
+def get_replica_engine():
+    """Engine for the read replica (ApplicationIntent=ReadOnly), or None when not configured"""
+    global _replica_engine
+    if _replica_engine is None and DB_READ_CONFIG:
+        with _engine_lock:
+            if _replica_engine is None:
+                from sqlalchemy import create_engine
+                _replica_engine = create_engine(
+                    DB_READ_CONFIG, connect_args={'timeout': STATEMENT_TIMEOUT, 'read_only': True}
+                )
+    return _replica_engine
+
+def get_read_engine():
+    """Engine for dashboard reads: the replica while it has caught up with the primary"""
+    return replica_router.choose(get_engine(), get_replica_engine())
+
+def reset_engine():
+    """Drop pooled connections inherited from a parent process after fork"""
+    for engine in (_engine, _replica_engine):
+        if engine is not None:
+            engine.dispose(close=False)
 
 # Constants
 ITEMS_PER_PAGE = 20  # Number of items per page for pagination
+ALL_TRANSACTIONS_VIEW = 'fuel_transactions_all'  # hot table UNION ALL columnstore archive, see script.py
+ROWS_API_LIMIT = 200  # Largest slice the scrolling grid may request
+TREND_POINTS_LIMIT = 2000  # Largest point budget a trends request may ask for
+CHART_RETENTION_SECONDS = 24 * 3600  # Content-addressed charts older than this are pruned
+CHART_PRUNE_INTERVAL = 600
+EXPORT_SPOOL_BYTES = 64 * 1024 * 1024  # exports larger than this spill from memory to a temp file
+
+_last_chart_prune = 0.0
+
+def fetch_rows(sql, params=()):
+    """Run sql on a pooled DBAPI cursor and return the raw tuples.
+
+    The statement runs under the request's query budget; a connection whose
+    statement was cancelled is discarded rather than returned to the pool.
+    """
+    with get_read_engine().connect() as conn:
+        dbapi_connection = conn.connection
+        try:
+            cursor = dbapi_connection.cursor()
+            try:
+                with guard(lambda: cancel_statement(dbapi_connection)):
+                    cursor.execute(sql, tuple(params) or None)
+                    return cursor.fetchall()
+            finally:
+                cursor.close()
+        except QueryRejected:
+            conn.invalidate()
+            raise
+
+def fetch_batches(sql, params=(), size=EXPORT_BATCH_ROWS):
+    """Like fetch_rows, but yield the result in lists of at most ``size`` tuples"""
+    with get_read_engine().connect() as conn:
+        dbapi_connection = conn.connection
+        try:
+            cursor = dbapi_connection.cursor()
+            try:
+                with guard(lambda: cancel_statement(dbapi_connection)):
+                    cursor.execute(sql, tuple(params) or None)
+                    while True:
+                        batch = cursor.fetchmany(size)
+                        if not batch:
+                            break
+                        yield batch
+            finally:
+                cursor.close()
+        except QueryRejected:
+            conn.invalidate()
+            raise
+
+def cached(namespace, key, compute, generation=None):
+    """Serve compute() through the shared result cache when one is configured"""
+    if result_cache is None:
+        return compute()
+    value = result_cache.get(namespace, key, generation)
+    if value is MISS:
+        value = compute()
+        result_cache.set(namespace, key, value, generation)
+    return value
 
 def get_dropdown_options():
-    """Fetch all dropdown options from the database"""
-    with engine.connect() as conn:
-        departments = pd.read_sql("SELECT id, name FROM departments ORDER BY name", conn)
-        stations = pd.read_sql("SELECT id, name, region FROM service_stations ORDER BY name", conn)
-        regions = pd.read_sql("SELECT DISTINCT region FROM service_stations WHERE region IS NOT NULL ORDER BY region", conn)
-        products = pd.read_sql("SELECT DISTINCT product FROM fuel_transactions WHERE product IS NOT NULL ORDER BY product", conn)
+    """Fetch all dropdown options from the dimension cache"""
+    dims = dimension_cache.get(get_read_engine())
     
     return {
-        'departments': departments.to_dict('records'),
-        'stations': stations.to_dict('records'),
-        'regions': regions['region'].tolist(),
-        'products': products['product'].tolist()
+        'departments': dims.departments,
+        'stations': dims.stations,
+        'regions': dims.regions,
+        'products': dims.products
     }
 
-def get_fuel_data(filters, page=1, per_page=ITEMS_PER_PAGE):
-    """Get filtered fuel data with pagination"""
-    base_query = """
-    SELECT 
-        ft.date, ft.vehicle_registration, d.name AS department,
-        s.name AS service_station, s.region, ft.product, ft.quantity,
-        ft.customer_amount, ft.terminal_price
-    FROM fuel_transactions ft
-    LEFT JOIN departments d ON ft.department_id = d.id
-    LEFT JOIN service_stations s ON ft.service_station_id = s.id
-    WHERE 1=1
-    """
-    
-    count_query = """
-    SELECT COUNT(*) as total
-    FROM fuel_transactions ft
-    LEFT JOIN departments d ON ft.department_id = d.id
-    LEFT JOIN service_stations s ON ft.service_station_id = s.id
-    WHERE 1=1
+# Column each filter applies to, on the live tables and on the snapshot
+# A region of None means the filter is translated to station ids, a product
+# of None that the product name is translated to its product_id key
+LIVE_FILTER_COLUMNS = {
+    'vehicle_reg': 'ft.vehicle_registration',
+    'department': 'ft.department_id',
+    'service_station': 'ft.service_station_id',
+    'region': None,
+    'product': None,
+    'product_id': 'ft.product_id',
+    'date': 'ft.date',
+}
+
+SNAPSHOT_FILTER_COLUMNS = {
+    'vehicle_reg': 'vehicle_registration',
+    'department': 'department_id',
+    'service_station': 'service_station_id',
+    'region': 'region',
+    'product': 'product',
+    'product_id': None,
+    'date': 'date',
+}
+
+# The vehicle sketches are keyed by date, department and station only
+SKETCH_FILTER_COLUMNS = {
+    'vehicle_reg': None,
+    'department': 'department_id',
+    'service_station': 'service_station_id',
+    'region': None,
+    'product': None,
+    'product_id': None,
+    'date': 'date',
+}
+
+# How distinct vehicles can be grouped, on the live tables and on the snapshot
+LIVE_VEHICLE_GROUPS = {
+    'department': 'ft.department_id',
+    'station': 'ft.service_station_id',
+    'region': 's.region',
+}
+
+SNAPSHOT_VEHICLE_GROUPS = {
+    'department': 'department',
+    'station': 'service_station',
+    'region': 'region',
+}
+
+def transactions_table(filters, dims):
+    """Live relation for the filters, aliased ft.
+
+    The view over the hot table and the columnstore archive, unless nothing
+    has been archived or the filters start on or after the archive cutoff,
+    when the hot table alone has every matching row.
     """
-    
+    cutoff = parse_date(dims.archive_cutoff)
+    start = parse_date(filters.get('start_date'))
+    if cutoff is None or (start is not None and start >= cutoff):
+        return 'fuel_transactions ft'
+    return f'{ALL_TRANSACTIONS_VIEW} ft'
+
+def build_conditions(filters, columns=LIVE_FILTER_COLUMNS, placeholder='%s', dims=None):
+    """Translate dashboard filters into SQL conditions and their parameters"""
     params = []
     conditions = []
     
     if filters.get('vehicle_reg'):
-        conditions.append("ft.vehicle_registration LIKE %s")
+        conditions.append(f"{columns['vehicle_reg']} LIKE {placeholder}")
         params.append(f"%{filters['vehicle_reg']}%")
     
     if filters.get('department'):
-        conditions.append("d.id = %s")
-        params.append(filters['department'])
+        conditions.append(f"{columns['department']} = {placeholder}")
+        params.append(int(filters['department']))
     
     if filters.get('service_station'):
-        conditions.append("s.id = %s")
-        params.append(filters['service_station'])
+        conditions.append(f"{columns['service_station']} = {placeholder}")
+        params.append(int(filters['service_station']))
     
-    if filters.get('region'):
-        conditions.append("s.region = %s")
+    if filters.get('region') and columns['region'] is None:
+        station_ids = dims.station_ids_for_region(filters['region'])
+        if station_ids:
+            conditions.append(f"{columns['service_station']} IN ({', '.join(str(int(i)) for i in station_ids)})")
+        else:
+            conditions.append("1=0")
+    elif filters.get('region'):
+        conditions.append(f"{columns['region']} = {placeholder}")
         params.append(filters['region'])
     
-    if filters.get('product'):
-        conditions.append("ft.product = %s")
+    if filters.get('product') and columns['product'] is None:
+        product_id = dims.product_ids.get(filters['product'])
+        conditions.append(f"{columns['product_id']} = {int(product_id)}" if product_id is not None else "1=0")
+    elif filters.get('product'):
+        conditions.append(f"{columns['product']} = {placeholder}")
         params.append(filters['product'])
     
+    # Open-ended ranges still bound the date so monthly partitions are eliminated
     if filters.get('start_date') and filters.get('end_date'):
-        conditions.append("ft.date BETWEEN %s AND %s")
+        conditions.append(f"{columns['date']} BETWEEN {placeholder} AND {placeholder}")
         params.extend([filters['start_date'], filters['end_date']])
+    elif filters.get('start_date'):
+        conditions.append(f"{columns['date']} >= {placeholder}")
+        params.append(filters['start_date'])
+    elif filters.get('end_date'):
+        conditions.append(f"{columns['date']} <= {placeholder}")
+        params.append(filters['end_date'])
+    
+    return conditions, params
+
+TRANSACTION_QUERY = """
+    SELECT
+        ft.date, ft.vehicle_registration, ft.department_id,
+        ft.service_station_id, ft.product_id,
+        CAST(ft.quantity AS FLOAT), CAST(ft.customer_amount AS FLOAT),
+        CAST(ft.terminal_price AS FLOAT)
+    FROM {table}
+    WHERE 1=1
+    """
+
+def get_fuel_data(filters, page=1, per_page=ITEMS_PER_PAGE, offset=None, with_total=True):
+    """Get filtered fuel data with pagination as a list of TransactionRows.
+
+    ``offset`` overrides ``page`` for slice-based callers such as the
+    scrolling grid, which skip the count once they know the total.
+    """
+    dims = dimension_cache.get(get_read_engine())
+    table = transactions_table(filters, dims)
+
+    base_query = TRANSACTION_QUERY.format(table=table)
+
+    count_query = f"""
+    SELECT COUNT(*) as total
+    FROM {table}
+    WHERE 1=1
+    """
+
+    conditions, params = build_conditions(filters, dims=dims)
     
     if conditions:
         base_query += " AND " + " AND ".join(conditions)
         count_query += " AND " + " AND ".join(conditions)
     
     # Get total count for pagination
-    with engine.connect() as conn:
-        total = pd.read_sql(count_query, conn, params=params).iloc[0]['total']
+    total = fetch_rows(count_query, params)[0][0] if with_total else None
     
     # Add pagination
-    base_query += " ORDER BY ft.date DESC"
-    base_query += f" OFFSET {(page-1)*per_page} ROWS FETCH NEXT {per_page} ROWS ONLY"
+    # Matches the (date, id) clustering key of the partitioned table
+    if offset is None:
+        offset = (page - 1) * per_page
+    base_query += " ORDER BY ft.date DESC, ft.id DESC"
+    base_query += f" OFFSET {int(offset)} ROWS FETCH NEXT {int(per_page)} ROWS ONLY"
     
-    with engine.connect() as conn:
-        df = pd.read_sql(base_query, conn, params=params)
+    rows = decode_transactions(fetch_rows(base_query, params), dims)
     
-    return df, total
+    return rows, total
 
-def generate_charts(df, chart_dir='static/charts'):
-    """Generate and save charts"""
-    os.makedirs(chart_dir, exist_ok=True)
+def stream_fuel_data(filters, dims, limit=EXPORT_MAX_ROWS):
+    """The rows get_fuel_data would return for one page of ``limit``, as batches of raw tuples"""
+    query = TRANSACTION_QUERY.format(table=transactions_table(filters, dims))
+    conditions, params = build_conditions(filters, dims=dims)
+    if conditions:
+        query += " AND " + " AND ".join(conditions)
+    query += f" ORDER BY ft.date DESC, ft.id DESC OFFSET 0 ROWS FETCH NEXT {int(limit)} ROWS ONLY"
+    return fetch_batches(query, params)
+
+def estimate_rows(filters):
+    """Transactions matching every filter except the plate search.
+
+    That is the number of rows a ``%plate%`` LIKE has to scan and an upper
+    bound on what any of the filtered queries return.
+    """
+    seekable = dict(filters, vehicle_reg=None)
+    if snapshot.is_available():
+        run, query = snapshot.query, "SELECT COUNT(*) FROM fuel"
+        conditions, params = build_conditions(seekable, SNAPSHOT_FILTER_COLUMNS, '?')
+    else:
+        dims = dimension_cache.get(get_read_engine())
+        run, query = fetch_rows, f"SELECT COUNT(*) FROM {transactions_table(seekable, dims)}"
+        conditions, params = build_conditions(seekable, dims=dims)
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    return run(query, params)[0][0]
+
+def check_query_cost(filters):
+    """Refuse filters whose row estimate exceeds the current route's budget.
+
+    Plate searches are only bounded on the live tables; the snapshot scans
+    them quickly. The estimate leaves out the plate filter, so with one it
+    is checked against PLATE_SCAN_MAX_ROWS only and not against the route's
+    row limit; an export still stops at EXPORT_MAX_ROWS rows.
+    """
+    budget = current_budget()
+    plate_filter = bool(filters.get('vehicle_reg'))
+    plate_search = plate_filter and not snapshot.is_available()
+    row_limit = bool(budget and budget.max_rows) and not plate_filter
+    if budget is None or not (plate_search or row_limit):
+        return
+    estimated = cached('estimate', view_key(dict(filters, vehicle_reg=None)), lambda: estimate_rows(filters))
+    check_rows(estimated, plate_search, row_limit)
+
+def get_aggregates(filters):
+    """Get totals grouped by department, region and product as AggregateRows.
+
+    Answered from the DuckDB snapshot when one is available, otherwise from
+    the live tables. The result is small and feeds the summary and charts.
+    """
+    if snapshot.is_available():
+        query = """
+        SELECT department, region, product, COUNT(*) AS transactions,
+            SUM(quantity) AS quantity, SUM(customer_amount) AS customer_amount
+        FROM fuel
+        WHERE 1=1
+        """
+        conditions, params = build_conditions(filters, SNAPSHOT_FILTER_COLUMNS, '?')
+        if conditions:
+            query += " AND " + " AND ".join(conditions)
+        query += " GROUP BY department, region, product"
+        return [AggregateRow(*row) for row in snapshot.query(query, params)]
+    
+    dims = dimension_cache.get(get_read_engine())
+    query = f"""
+    SELECT ft.department_id, ft.service_station_id, ft.product_id, COUNT(*) AS transactions,
+        CAST(SUM(ft.quantity) AS FLOAT) AS quantity,
+        CAST(SUM(ft.customer_amount) AS FLOAT) AS customer_amount
+    FROM {transactions_table(filters, dims)}
+    WHERE 1=1
+    """
+    conditions, params = build_conditions(filters, dims=dims)
+    if conditions:
+        query += " AND " + " AND ".join(conditions)
+    query += " GROUP BY ft.department_id, ft.service_station_id, ft.product_id"
+    
+    # Stations fold into their region once the ids are decoded
+    grouped = {}
+    for department_id, station_id, product_id, transactions, quantity, revenue in fetch_rows(query, params):
+        key = (
+            dims.department_names.get(department_id), dims.station_regions.get(station_id),
+            dims.product_names.get(product_id)
+        )
+        row = grouped.get(key)
+        if row is None:
+            grouped[key] = AggregateRow(*key, transactions, quantity or 0.0, revenue or 0.0)
+        else:
+            row.transactions += transactions
+            row.quantity += quantity or 0.0
+            row.customer_amount += revenue or 0.0
+    return list(grouped.values())
+
+def get_trends(filters, requested=None, points=TREND_POINTS):
+    """Quantity and spend over time, bucketed in SQL and downsampled to ``points``.
+
+    Returns the bucket name used and the series from trends.build_series.
+    """
+    if snapshot.is_available():
+        run, table, date_column, sums = snapshot.query, 'fuel', 'date', "SUM(quantity), SUM(customer_amount)"
+        conditions, params = build_conditions(filters, SNAPSHOT_FILTER_COLUMNS, '?')
+        bucket_column = 3
+    else:
+        dims = dimension_cache.get(get_read_engine())
+        run, table, date_column = fetch_rows, transactions_table(filters, dims), 'ft.date'
+        sums = "CAST(SUM(ft.quantity) AS FLOAT), CAST(SUM(ft.customer_amount) AS FLOAT)"
+        conditions, params = build_conditions(filters, dims=dims)
+        bucket_column = 2
+    where = " WHERE " + " AND ".join(conditions) if conditions else ""
+    
+    # Open-ended ranges take their span from the data to pick the bucket size
+    start, end = parse_date(filters.get('start_date')), parse_date(filters.get('end_date'))
+    if requested is None and not (start and end):
+        low, high = run(f"SELECT MIN({date_column}), MAX({date_column}) FROM {table}{where}", params)[0]
+        start, end = start or parse_date(low), end or parse_date(high)
     
-    # Clear old charts
+    bucket = choose_bucket(start, end, requested)
+    expression = bucket[bucket_column]
+    query = f"SELECT {expression}, {sums} FROM {table}{where} GROUP BY {expression} ORDER BY 1"
+    return bucket[0], build_series(run(query, params), points)
+
+def get_pivot(filters, rows, cols):
+    """Folded pivot sums for the row and column dimensions, see pivot.fold"""
+    dims = dimension_cache.get(get_read_engine())
+    live = not snapshot.is_available()
+    if live:
+        run, table = fetch_rows, transactions_table(filters, dims)
+        sums = "COUNT(*), CAST(SUM(ft.quantity) AS FLOAT), CAST(SUM(ft.customer_amount) AS FLOAT)"
+        conditions, params = build_conditions(filters, dims=dims)
+    else:
+        run, table = snapshot.query, 'fuel'
+        sums = "COUNT(*), SUM(quantity), SUM(customer_amount)"
+        conditions, params = build_conditions(filters, SNAPSHOT_FILTER_COLUMNS, '?')
+    where = " WHERE " + " AND ".join(conditions) if conditions else ""
+    
+    query = grouping_query(rows, cols, live, table, where, sums)
+    return fold(run(query, params), rows, cols, dims, live)
+
+def vehicle_group_label(group, department_id, station_id, dims):
+    if group == 'department':
+        return dims.department_names.get(department_id)
+    if group == 'station':
+        return dims.station_names.get(station_id)
+    return dims.station_regions.get(station_id)
+
+def count_distinct_vehicles(filters, group, dims):
+    """Exact distinct vehicles, for filters the sketches do not cover"""
+    live = not snapshot.is_available()
+    if not live:
+        run, table, groups = snapshot.query, 'fuel', SNAPSHOT_VEHICLE_GROUPS
+        conditions, params = build_conditions(filters, SNAPSHOT_FILTER_COLUMNS, '?')
+        vehicle_column = 'vehicle_registration'
+    else:
+        run, groups = fetch_rows, LIVE_VEHICLE_GROUPS
+        table = f'{transactions_table(filters, dims)} LEFT JOIN service_stations s ON ft.service_station_id = s.id'
+        conditions, params = build_conditions(filters, dims=dims)
+        vehicle_column = 'ft.vehicle_registration'
+    where = " WHERE " + " AND ".join(conditions) if conditions else ""
+    
+    total = run(f"SELECT COUNT(DISTINCT {vehicle_column}) FROM {table}{where}", params)[0][0]
+    counts = []
+    if group:
+        column = groups[group]
+        counts = run(f"SELECT {column}, COUNT(DISTINCT {vehicle_column}) FROM {table}{where} GROUP BY {column}", params)
+        # Live rows carry department and station ids
+        if live and group != 'region':
+            names = dims.department_names if group == 'department' else dims.station_names
+            counts = [(names.get(key), count) for key, count in counts]
+    return total, sorted(counts, key=lambda item: item[1], reverse=True)
+
+def get_distinct_vehicles(filters, group=None):
+    """Distinct vehicles for the filters, overall and per ``group``.
+
+    Returns (total, [(label, vehicles), ...], estimated). Counts are merged
+    from the HyperLogLog sketches in vehicle_sketches; vehicle and product
+    filters are not sketched and fall back to an exact count.
+    """
+    dims = dimension_cache.get(get_read_engine())
+    if filters.get('vehicle_reg') or filters.get('product'):
+        return count_distinct_vehicles(filters, group, dims) + (False,)
+    
+    query = "SELECT department_id, service_station_id, registers FROM vehicle_sketches"
+    conditions, params = build_conditions(filters, SKETCH_FILTER_COLUMNS, dims=dims)
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    rows = fetch_rows(query, params)
+    
+    total = estimate(merge_encoded(registers for _, _, registers in rows))
+    counts = []
+    if group:
+        grouped = {}
+        for department_id, station_id, registers in rows:
+            grouped.setdefault(vehicle_group_label(group, department_id, station_id, dims), []).append(registers)
+        counts = sorted(
+            ((label, estimate(merge_encoded(blobs))) for label, blobs in grouped.items()),
+            key=lambda item: item[1], reverse=True
+        )
+    return total, counts, True
+
+def summarize(aggregates, total):
+    """Format the summary cards from the aggregate rows"""
+    quantity = sum(row.quantity or 0.0 for row in aggregates)
+    revenue = sum(row.customer_amount or 0.0 for row in aggregates)
+    return {
+        'transactions': "{:,}".format(total),
+        'total_quantity': f"{quantity:,.2f} L",
+        'total_revenue': f"KES {revenue:,.2f}",
+        'avg_price': f"KES {revenue / quantity:,.2f}" if quantity else "KES 0.00",
+    }
+
+def prune_charts(chart_dir):
+    """Delete charts nobody has regenerated recently, at most every few minutes"""
+    global _last_chart_prune
+    now = time.time()
+    if now - _last_chart_prune < CHART_PRUNE_INTERVAL:
+        return
+    _last_chart_prune = now
     for f in os.listdir(chart_dir):
-        os.remove(os.path.join(chart_dir, f))
+        path = os.path.join(chart_dir, f)
+        try:
+            if now - os.path.getmtime(path) > CHART_RETENTION_SECONDS:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def save_chart(name, data, chart_dir):
+    """Save rendered PNG bytes under a content-addressed name and return its URL.
+
+    Identical charts map to the same file, which is served with immutable
+    cache headers, so browsers only download a chart when it changes.
+    """
+    filename = content_addressed_name(name, data, '.png')
+    path = os.path.join(chart_dir, filename)
+    if os.path.exists(path):
+        os.utime(path)  # keep it clear of pruning
+    else:
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    return url_for('static', filename=f'charts/{filename}')
+
+# Chart name, title, palette and how to rank the aggregate rows
+CHART_DEFINITIONS = [
+    ('dept_qty', 'Top 10 Departments by Fuel Quantity', 'Blues_r', 'department', 'quantity', 10),
+    ('dept_rev', 'Top 10 Departments by Revenue', 'Greens_r', 'department', 'customer_amount', 10),
+    ('region_qty', 'Fuel Consumption by Region', 'Reds_r', 'region', 'quantity', None),
+    ('product_qty', 'Top 10 Products by Volume', 'Purples_r', 'product', 'quantity', 10),
+]
+
+def render_chart_images(aggregates):
+    """Render the dashboard charts for the aggregate rows; returns {name: PNG bytes}"""
+    specs = []
+    for name, title, palette, key, measure, limit in CHART_DEFINITIONS:
+        ranked = totals_by(aggregates, key, measure, limit)
+        if ranked:
+            labels, values = zip(*ranked)
+            specs.append(ChartSpec(name, title, labels, values, palette))
     
+    return render_charts(specs)
+
+def store_charts(images, chart_dir='static/charts'):
+    """Write rendered charts to the static folder and return their URLs"""
+    os.makedirs(chart_dir, exist_ok=True)
+    prune_charts(chart_dir)
+    return {name: save_chart(name, data, chart_dir) for name, data in images.items()}
+
+def generate_charts(aggregates, chart_dir='static/charts'):
+    """Render charts for the aggregate rows in the chart pool and return their URLs"""
     # Only generate charts if we have data
-    if df.empty:
+    if not aggregates:
         return None
+    return store_charts(render_chart_images(aggregates), chart_dir)
+
+def load_dashboard_view(filters, page=1, generation=None):
+    """Everything the dashboard shows for one filter set, through the result cache.
+
+    Returns (rows, total, aggregates, options, charts). ``generation`` targets
+    a staging cache generation while warming.
+    """
+    key = view_key(filters)
+    rows, total = cached('page', (key, page, ITEMS_PER_PAGE), lambda: get_fuel_data(filters, page), generation)
+    aggregates = cached('aggregates', key, lambda: get_aggregates(filters), generation)
+    options = get_dropdown_options()
     
-    charts = {}
-    
-    # Quantity by Department
-    if 'department' in df.columns and not df['department'].isnull().all():
-        plt.figure(figsize=(12, 6))
-        dept_qty = df.groupby('department')['quantity'].sum().nlargest(10)
-        if not dept_qty.empty:
-            ax = sns.barplot(x=dept_qty.index, y=dept_qty.values, palette='Blues_r')
-            plt.title('Top 10 Departments by Fuel Quantity')
-            plt.xticks(rotation=45)
-            plt.tight_layout()
-            plt.savefig(os.path.join(chart_dir, 'dept_qty.png'), bbox_inches='tight')
-            plt.close()
-            charts['dept_qty'] = url_for('static', filename='charts/dept_qty.png')
-    
-    # Revenue by Department
-    if 'department' in df.columns and not df['department'].isnull().all():
-        plt.figure(figsize=(12, 6))
-        dept_rev = df.groupby('department')['customer_amount'].sum().nlargest(10)
-        if not dept_rev.empty:
-            ax = sns.barplot(x=dept_rev.index, y=dept_rev.values, palette='Greens_r')
-            plt.title('Top 10 Departments by Revenue')
-            plt.xticks(rotation=45)
-            plt.tight_layout()
-            plt.savefig(os.path.join(chart_dir, 'dept_rev.png'), bbox_inches='tight')
-            plt.close()
-            charts['dept_rev'] = url_for('static', filename='charts/dept_rev.png')
-    
-    # Fuel by Region
-    if 'region' in df.columns and not df['region'].isnull().all():
-        plt.figure(figsize=(12, 6))
-        region_qty = df.groupby('region')['quantity'].sum().sort_values(ascending=False)
-        if not region_qty.empty:
-            ax = sns.barplot(x=region_qty.index, y=region_qty.values, palette='Reds_r')
-            plt.title('Fuel Consumption by Region')
-            plt.xticks(rotation=45)
-            plt.tight_layout()
-            plt.savefig(os.path.join(chart_dir, 'region_qty.png'), bbox_inches='tight')
-            plt.close()
-            charts['region_qty'] = url_for('static', filename='charts/region_qty.png')
-    
-    # Products by Volume
-    if 'product' in df.columns and not df['product'].isnull().all():
-        plt.figure(figsize=(12, 6))
-        product_qty = df.groupby('product')['quantity'].sum().nlargest(10)
-        if not product_qty.empty:
-            ax = sns.barplot(x=product_qty.index, y=product_qty.values, palette='Purples_r')
-            plt.title('Top 10 Products by Volume')
-            plt.xticks(rotation=45)
-            plt.tight_layout()
-            plt.savefig(os.path.join(chart_dir, 'product_qty.png'), bbox_inches='tight')
-            plt.close()
-            charts['product_qty'] = url_for('static', filename='charts/product_qty.png')
-    
-    return charts
-
-@app.route('/', methods=['GET', 'POST'])
-def dashboard():
-    page = request.args.get('page', 1, type=int)
-    
-    filters = {
-        'vehicle_reg': request.values.get('vehicle_reg', ''),
-        'department': request.values.get('department', ''),
-        'service_station': request.values.get('service_station', ''),
-        'region': request.values.get('region', ''),
-        'product': request.values.get('product', ''),
-        'start_date': request.values.get('start_date', ''),
-        'end_date': request.values.get('end_date', '')
+    # Chart bytes are cached rather than URLs so a pruned file is simply rewritten
+    images = cached('charts', key, lambda: render_chart_images(aggregates), generation) if aggregates else None
+    charts = store_charts(images) if images else None
+    
+    return rows, total, aggregates, options, charts
+
+def pager_window(page, total_pages, radius=2):
+    """Page numbers to link: first, last and a window around the current page.
+
+    ``None`` marks a gap. The list has at most ``2 * radius + 5`` entries
+    whatever the number of pages.
+    """
+    if total_pages <= 0:
+        return []
+    start = max(1, page - radius)
+    end = min(total_pages, page + radius)
+    window = list(range(start, end + 1))
+    # A gap of a single page shows that page rather than an ellipsis
+    if start > 1:
+        window = [1] + ([None] if start > 3 else list(range(2, start))) + window
+    if end < total_pages:
+        window = window + ([None] if end < total_pages - 2 else list(range(end + 1, total_pages))) + [total_pages]
+    return window
+
+def filters_from_request(default=''):
+    return {
+        'vehicle_reg': request.values.get('vehicle_reg', default),
+        'department': request.values.get('department', default),
+        'service_station': request.values.get('service_station', default),
+        'region': request.values.get('region', default),
+        'product': request.values.get('product', default),
+        'start_date': request.values.get('start_date', default),
+        'end_date': request.values.get('end_date', default)
     }
+
+def dashboard():
+    page = max(request.args.get('page', 1, type=int), 1)
+    
+    filters = filters_from_request()
+    check_query_cost(filters)
+    if view_tracker is not None and page == 1:
+        view_tracker.record(filters)
     
     # Get filtered data
-    df, total = get_fuel_data(filters, page)
-    options = get_dropdown_options()
+    rows, total, aggregates, options, charts = load_dashboard_view(filters, page)
     
     # Generate summary
-    summary = {
-        'transactions': "{:,}".format(total),
-        'total_quantity': f"{df['quantity'].sum():,.2f} L" if not df.empty else "0.00 L",
-        'total_revenue': f"KES {df['customer_amount'].sum():,.2f}" if not df.empty else "KES 0.00",
-    }
-    
-    charts = generate_charts(df) if not df.empty else None
+    summary = summarize(aggregates, total)
 
     # Calculate pagination
     total_pages = ceil(total / ITEMS_PER_PAGE)
@@ -209,47 +656,196 @@ def dashboard():
         'page': page,
         'per_page': ITEMS_PER_PAGE,
         'total': total,
-        'total_pages': total_pages
+        'total_pages': total_pages,
+        'window': pager_window(page, total_pages)
     }
 
     return render_template(
         'dashboard.html',
-        data=df.to_dict('records'),
+        data=rows,
         filters=filters,
         options=options,
         summary=summary,
         charts=charts,
-        pagination=pagination  # Pass pagination to template
+        pagination=pagination,  # Pass pagination to template
+        data_version=data_version.current(get_read_engine())
+    )
+
+def aggregates_api():
+    filters = filters_from_request(default=None)
+    check_query_cost(filters)
+    
+    aggregates = get_aggregates(filters)
+    total = sum(row.transactions for row in aggregates)
+    vehicles, _, _ = cached('vehicles', (view_key(filters), None), lambda: get_distinct_vehicles(filters))
+    
+    # Chart URLs on request, for dashboards refreshing after a data change
+    charts = None
+    if request.args.get('charts', 0, type=int) == 1 and aggregates:
+        charts = store_charts(cached('charts', view_key(filters), lambda: render_chart_images(aggregates)))
+    
+    return jsonify(
+        summary=summarize(aggregates, total),
+        active_vehicles=vehicles,
+        rows=[row.as_dict() for row in aggregates],
+        charts=charts,
+        source='snapshot' if snapshot.is_available() else 'live'
+    )
+
+def rows_api():
+    """One slice of transactions for the scrolling grid"""
+    filters = filters_from_request(default=None)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', ROWS_API_LIMIT, type=int), 1), ROWS_API_LIMIT)
+    with_total = request.args.get('total', 0, type=int) == 1
+    check_query_cost(filters)
+    
+    rows, total = get_fuel_data(filters, per_page=limit, offset=offset, with_total=with_total)
+    
+    return jsonify(
+        offset=offset,
+        total=total,
+        rows=[
+            [row.date.isoformat() if row.date else None, row.vehicle_registration, row.department,
+             row.service_station, row.region, row.product, row.quantity, row.customer_amount]
+            for row in rows
+        ]
+    )
+
+def trends_api():
+    """Downsampled quantity and spend series for the trends tab"""
+    filters = filters_from_request(default=None)
+    requested = request.args.get('bucket')
+    if requested not in {bucket[0] for bucket in BUCKETS}:
+        requested = None  # auto
+    points = min(max(request.args.get('points', TREND_POINTS, type=int), 3), TREND_POINTS_LIMIT)
+    check_query_cost(filters)
+    
+    bucket, series = cached(
+        'trends', (view_key(filters), requested, points),
+        lambda: get_trends(filters, requested, points)
+    )
+    
+    return jsonify(bucket=bucket, points=points, series=series)
+
+def pivot_api():
+    """Cross-tab of a measure over row and column dimensions, with totals"""
+    filters = filters_from_request(default=None)
+    measure = request.args.get('measure', 'customer_amount')
+    try:
+        rows = parse_axis(request.args.get('rows'))
+        cols = parse_axis(request.args.get('cols'))
+        validate_axes(rows, cols)
+        if measure not in PIVOT_MEASURES:
+            raise ValueError(f"Unknown measure: {measure}")
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    check_query_cost(filters)
+    
+    # Sums are cached independently of the measure, which is derived from them
+    cells, headers = cached('pivot', (view_key(filters), rows, cols), lambda: get_pivot(filters, rows, cols))
+    
+    return jsonify(pivot_table(cells, headers, rows, cols, measure))
+
+def vehicles_api():
+    """Distinct vehicles for the filters, optionally per department, station or region"""
+    filters = filters_from_request(default=None)
+    group = request.args.get('group') or None
+    if group is not None and group not in LIVE_VEHICLE_GROUPS:
+        return jsonify(error=f"Unknown group: {group}"), 400
+    check_query_cost(filters)
+    
+    total, counts, estimated = cached(
+        'vehicles', (view_key(filters), group),
+        lambda: get_distinct_vehicles(filters, group)
+    )
+    
+    return jsonify(
+        active_vehicles=total,
+        estimated=estimated,
+        groups=[{'label': label, 'vehicles': count} for label, count in counts]
     )
 
-@app.route('/export')
 def export_data():
-    filters = {
-        'vehicle_reg': request.args.get('vehicle_reg'),
-        'department': request.args.get('department'),
-        'service_station': request.args.get('service_station'),
-        'region': request.args.get('region'),
-        'product': request.args.get('product'),
-        'start_date': request.args.get('start_date'),
-        'end_date': request.args.get('end_date')
-    }
+    export_format = request.args.get('format', 'xlsx')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify(error=f"Unknown export format: {export_format}"), 400
     
-    # Get all data for export
-    df, _ = get_fuel_data(filters, page=1, per_page=1000000)
-    output = BytesIO()
+    filters = filters_from_request(default=None)
+    check_query_cost(filters)
+    # CSV is the text format worth compressing; send_file bypasses delivery's
+    # compression, so it is gzipped while it is written
+    encoding = 'gzip' if export_format == 'csv' and accepts_gzip() else None
     
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        df.to_excel(writer, index=False, sheet_name='Fuel Data')
+    if export_format == 'xlsx':
+        import pandas as pd
+        
+        # Get all data for export
+        rows, _ = get_fuel_data(filters, page=1, per_page=EXPORT_MAX_ROWS, with_total=False)
+        df = pd.DataFrame.from_records([row.as_tuple() for row in rows], columns=TRANSACTION_COLUMNS)
+        output = BytesIO()
+        
+        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
+            df.to_excel(writer, index=False, sheet_name='Fuel Data')
+    else:
+        # Written batch by batch inside the request so the export budget still
+        # bounds the query; only the file is sent after the view returns
+        dims = dimension_cache.get(get_read_engine())
+        output = SpooledTemporaryFile(max_size=EXPORT_SPOOL_BYTES)
+        if encoding:
+            with gzip_writer(output) as compressed:
+                write_export(export_format, stream_fuel_data(filters, dims), dims, compressed)
+        else:
+            write_export(export_format, stream_fuel_data(filters, dims), dims, output)
     
     output.seek(0)
-    filename = f"fuel_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+    mimetype, extension = EXPORT_FORMATS[export_format]
+    filename = f"fuel_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
     
-    return send_file(
+    response = send_file(
         output,
         as_attachment=True,
         download_name=filename,
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        mimetype=mimetype
     )
+    if export_format == 'csv':
+        response.vary.add('Accept-Encoding')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+def events_stream():
+    """Server-Sent Events announcing new data versions to an open dashboard"""
+    if not _event_streams.acquire(blocking=False):
+        raise Overloaded("Too many open event streams; try again shortly")
+    # EventSource sends the id of the last event it received when it reconnects
+    since = request.headers.get('Last-Event-ID') or request.args.get('since')
+    since = int(since) if since and since.isdigit() else None
+    
+    response = Response(version_stream(data_version, get_read_engine, since), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.call_on_close(_event_streams.release)
+    return response
+
+def create_app():
+    """Application factory used by wsgi.py and gunicorn"""
+    app = Flask(__name__)
+    init_delivery(app)
+    init_admission(app)
+    
+    # Every route runs under its query budget from admission.BUDGETS
+    app.add_url_rule('/', 'dashboard', budgeted('dashboard')(dashboard), methods=['GET', 'POST'])
+    app.add_url_rule('/api/aggregates', 'aggregates_api', budgeted('aggregates')(aggregates_api))
+    app.add_url_rule('/api/rows', 'rows_api', budgeted('rows')(rows_api))
+    app.add_url_rule('/api/trends', 'trends_api', budgeted('trends')(trends_api))
+    app.add_url_rule('/api/pivot', 'pivot_api', budgeted('pivot')(pivot_api))
+    app.add_url_rule('/api/vehicles', 'vehicles_api', budgeted('vehicles')(vehicles_api))
+    app.add_url_rule('/export', 'export_data', budgeted('export')(export_data))
+    # Long-lived and query-free apart from the shared version poll, so unbudgeted
+    app.add_url_rule('/api/events', 'events_stream', events_stream)
+    
+    return app
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5001, debug=True)
+    create_app().run(host='0.0.0.0', port=5001, debug=True)
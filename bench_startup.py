@@ -0,0 +1,38 @@
+"""Measure cold start of the WSGI app in fresh interpreters.
+
+Usage: python bench_startup.py [runs]
+"""
+import sys
+import json
+import statistics
+import subprocess
+
+HEAVY_MODULES = ['pandas', 'matplotlib', 'seaborn', 'sqlalchemy', 'pyodbc', 'pymssql', 'duckdb']
+
+PROBE = f"""
+import sys, time, json
+started = time.perf_counter()
+import wsgi
+elapsed = time.perf_counter() - started
+print(json.dumps({{'seconds': elapsed, 'loaded': [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))
+"""
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    timings = []
+    loaded = set()
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, '-c', PROBE], capture_output=True, text=True, check=True)
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        timings.append(result['seconds'])
+        loaded.update(result['loaded'])
+
+    print(f"import wsgi over {runs} runs: "
+          f"median {statistics.median(timings) * 1000:.1f} ms, "
+          f"min {min(timings) * 1000:.1f} ms, max {max(timings) * 1000:.1f} ms")
+    print(f"Heavy modules loaded at import: {sorted(loaded) or 'none'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""Shared on-disk result cache with atomically published generations.
+
+Every cached value lives in a generation directory under ``RESULT_CACHE_DIR``.
+The ``CURRENT`` file names the generation readers use. A warm run fills a
+staging generation, then publishes it with a single rename, so readers see
+either the old set or the fully warmed new one and never a mix. Publishing
+a generation is also how the cache is invalidated after an ingest.
+"""
+import os
+import json
+import time
+import fcntl
+import pickle
+import shutil
+import hashlib
+import threading
+from collections import Counter
+from dotenv import load_dotenv
+
+load_dotenv()
+
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR")
+CURRENT_FILE = "CURRENT"
+POPULAR_FILE = "popular.json"
+STAGING_PREFIX = ".staging-"
+POINTER_CHECK_SECONDS = 1.0
+KEEP_GENERATIONS = 2
+STALE_STAGING_SECONDS = 3600
+TRACKER_FLUSH_EVERY = 50
+
+MISS = object()
+
+
+def cache_key(namespace, key):
+    digest = hashlib.sha1(repr(key).encode()).hexdigest()
+    return f"{namespace}-{digest}.pkl"
+
+
+def view_key(filters):
+    """Hashable, order-independent form of a filter set, ignoring empty filters"""
+    return tuple(sorted((k, str(v)) for k, v in filters.items() if v))
+
+
+class ResultCache:
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._current = None
+        self._checked_at = 0.0
+        os.makedirs(directory, exist_ok=True)
+
+    def current_generation(self):
+        if self._current is not None and time.monotonic() - self._checked_at < POINTER_CHECK_SECONDS:
+            return self._current
+        with self._lock:
+            try:
+                with open(os.path.join(self.directory, CURRENT_FILE)) as f:
+                    self._current = f.read().strip()
+            except FileNotFoundError:
+                # Nothing published yet: start with an empty generation
+                self._current = self.publish(self.begin_generation())
+            self._checked_at = time.monotonic()
+            return self._current
+
+    def _path(self, namespace, key, generation):
+        return os.path.join(self.directory, generation, cache_key(namespace, key))
+
+    def get(self, namespace, key, generation=None):
+        path = self._path(namespace, key, generation or self.current_generation())
+        try:
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return MISS
+
+    def set(self, namespace, key, value, generation=None):
+        path = self._path(namespace, key, generation or self.current_generation())
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except FileNotFoundError:
+            # The generation was pruned while this value was being computed
+            pass
+
+    def begin_generation(self):
+        """Create an empty staging generation and return its directory name"""
+        name = f"{STAGING_PREFIX}{time.time_ns()}-{os.getpid()}"
+        os.makedirs(os.path.join(self.directory, name))
+        return name
+
+    def publish(self, staging):
+        """Make a staging generation current in one atomic step"""
+        generation = staging[len(STAGING_PREFIX):]
+        os.rename(os.path.join(self.directory, staging), os.path.join(self.directory, generation))
+        tmp_path = os.path.join(self.directory, f"{CURRENT_FILE}.{os.getpid()}.tmp")
+        with open(tmp_path, 'w') as f:
+            f.write(generation)
+        os.replace(tmp_path, os.path.join(self.directory, CURRENT_FILE))
+        self._current = generation
+        self._checked_at = time.monotonic()
+        self.prune()
+        return generation
+
+    def prune(self):
+        """Keep the newest generations, which in-flight readers may still use"""
+        entries = [e for e in os.scandir(self.directory) if e.is_dir()]
+        generations = sorted(
+            (e for e in entries if not e.name.startswith(STAGING_PREFIX)),
+            key=lambda e: int(e.name.split('-')[0]),
+            reverse=True
+        )
+        for entry in generations[KEEP_GENERATIONS:]:
+            shutil.rmtree(entry.path, ignore_errors=True)
+        for entry in entries:
+            if entry.name.startswith(STAGING_PREFIX) and time.time() - entry.stat().st_mtime > STALE_STAGING_SECONDS:
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+
+class ViewTracker:
+    """Counts dashboard filter sets and periodically merges them into popular.json"""
+
+    def __init__(self, directory, flush_every=TRACKER_FLUSH_EVERY):
+        self.path = os.path.join(directory, POPULAR_FILE)
+        self.flush_every = flush_every
+        self._lock = threading.Lock()
+        self._counts = Counter()
+        self._pending = 0
+
+    def record(self, filters):
+        with self._lock:
+            self._counts[view_key(filters)] += 1
+            self._pending += 1
+            if self._pending < self.flush_every:
+                return
+            counts, self._counts, self._pending = self._counts, Counter(), 0
+        self._merge(counts)
+
+    def _merge(self, counts):
+        with open(self.path + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            merged = Counter(dict(load_popular_counts(self.path)))
+            merged.update(counts)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump([[list(map(list, k)), n] for k, n in merged.most_common()], f)
+            os.replace(tmp_path, self.path)
+
+
+def load_popular_counts(path):
+    try:
+        with open(path) as f:
+            return [(tuple(map(tuple, k)), n) for k, n in json.load(f)]
+    except FileNotFoundError:
+        return []
+
+
+def popular_views(directory, limit):
+    """Most viewed filter sets as filter dicts, most popular first"""
+    return [dict(key) for key, _ in load_popular_counts(os.path.join(directory, POPULAR_FILE))[:limit]]
@@ -0,0 +1,141 @@
+"""Chart rendering in a pool of warmed worker processes.
+
+Renders use the object-oriented ``Figure`` API, never pyplot's global
+state. Inputs are compact chart specs (title, labels, values, palette) and
+outputs are encoded image bytes, so the web workers can run threaded while
+charts draw in parallel on other cores. Set ``CHART_WORKERS=0`` to render
+in-process instead.
+"""
+import os
+import time
+import threading
+import multiprocessing
+from io import BytesIO
+
+CHART_WORKERS = int(os.getenv("CHART_WORKERS", 2))
+CHART_RENDER_TIMEOUT = float(os.getenv("CHART_RENDER_TIMEOUT", 20))
+CHART_TASKS_PER_WORKER = 500  # recycle workers to cap matplotlib cache growth
+
+_pool = None
+_pool_lock = threading.Lock()
+_in_flight = {}  # pool -> render_charts calls using it; retired pools stop at zero
+
+class ChartSpec:
+    __slots__ = ('name', 'title', 'labels', 'values', 'palette', 'format')
+
+    def __init__(self, name, title, labels, values, palette, format='png'):
+        self.name = name
+        self.title = title
+        self.labels = list(labels)
+        self.values = list(values)
+        self.palette = palette
+        self.format = format
+
+    def __getstate__(self):
+        return tuple(getattr(self, slot) for slot in self.__slots__)
+
+    def __setstate__(self, state):
+        for slot, value in zip(self.__slots__, state):
+            setattr(self, slot, value)
+
+
+def warm_worker():
+    """Import the plotting stack and load fonts once per worker"""
+    import matplotlib
+    matplotlib.use('Agg')
+    import seaborn  # noqa: F401
+    from matplotlib import font_manager
+    font_manager.findfont(font_manager.FontProperties())
+    render_chart(ChartSpec('warmup', 'warmup', ['a'], [1.0], 'Blues_r'))
+
+
+def render_chart(spec):
+    """Draw one bar chart and return the encoded image bytes"""
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib.figure import Figure
+    import seaborn as sns
+
+    fig = Figure(figsize=(12, 6))
+    ax = fig.subplots()
+    sns.barplot(x=spec.labels, y=spec.values, hue=spec.labels, palette=spec.palette, legend=False, ax=ax)
+    ax.set_title(spec.title)
+    ax.tick_params(axis='x', labelrotation=45)
+    fig.tight_layout()
+
+    buffer = BytesIO()
+    fig.savefig(buffer, format=spec.format, bbox_inches='tight')
+    return buffer.getvalue()
+
+
+def _checkout():
+    """The current pool, counted as in use until ``_checkin``"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            context = multiprocessing.get_context('spawn')
+            _pool = context.Pool(
+                CHART_WORKERS,
+                initializer=warm_worker,
+                maxtasksperchild=CHART_TASKS_PER_WORKER
+            )
+        _in_flight[_pool] = _in_flight.get(_pool, 0) + 1
+        return _pool
+
+
+def _checkin(pool, retire=False):
+    """Stop using ``pool``; a retired pool is terminated once no call uses it"""
+    global _pool
+    with _pool_lock:
+        if retire and _pool is pool:
+            _pool = None
+        _in_flight[pool] -= 1
+        idle = _pool is not pool and not _in_flight[pool]
+        if idle:
+            del _in_flight[pool]
+    if idle:
+        pool.terminate()
+
+
+def shutdown():
+    """Stop the worker pools, for example when a gunicorn worker exits"""
+    global _pool
+    with _pool_lock:
+        pools = set(_in_flight)
+        if _pool is not None:
+            pools.add(_pool)
+        _pool = None
+        _in_flight.clear()
+    for pool in pools:
+        pool.terminate()
+        pool.join()
+
+
+def render_charts(specs, timeout=CHART_RENDER_TIMEOUT):
+    """Render specs in parallel; returns {name: bytes} for the charts that finished.
+
+    A chart that misses the timeout is dropped and the pool is retired, since
+    the worker drawing it may be stuck: new requests get a fresh pool, and
+    the old one is terminated once the renders other requests have in flight
+    on it are collected.
+    """
+    if not specs:
+        return {}
+    if CHART_WORKERS <= 0:
+        return {spec.name: render_chart(spec) for spec in specs}
+
+    pool = _checkout()
+    timed_out = False
+    try:
+        pending = [(spec.name, pool.apply_async(render_chart, (spec,))) for spec in specs]
+        deadline = time.monotonic() + timeout
+        rendered = {}
+        for name, result in pending:
+            try:
+                rendered[name] = result.get(timeout=max(deadline - time.monotonic(), 0))
+            except multiprocessing.TimeoutError:
+                print(f"⚠️ Chart '{name}' did not render within {timeout}s")
+                timed_out = True
+    finally:
+        _checkin(pool, retire=timed_out)
+    return rendered
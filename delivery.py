@@ -0,0 +1,112 @@
+"""HTTP delivery: compression, conditional responses and immutable asset URLs.
+
+Responses from ``send_file`` pass through untouched, so file downloads
+that should be compressed (the CSV export) are gzipped while they are
+written, with ``gzip_writer``, and carry their own Content-Encoding.
+"""
+import os
+import gzip
+import hashlib
+import threading
+from flask import request, url_for, current_app
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+COMPRESS_MIMETYPES = {
+    'text/html', 'text/csv', 'text/css', 'text/plain',
+    'application/json', 'application/javascript', 'image/svg+xml'
+}
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", 1024))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+IMMUTABLE_STATIC_DIRS = ('charts/',)  # file names there are content hashes
+
+_fingerprints = {}
+_fingerprints_lock = threading.Lock()
+
+
+def fingerprint(path):
+    """Short content hash of a file, recomputed only when it changes"""
+    stat = os.stat(path)
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    digest = _fingerprints.get(key)
+    if digest is None:
+        with open(path, 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()[:16]
+        with _fingerprints_lock:
+            _fingerprints[key] = digest
+    return digest
+
+
+def asset_url(filename):
+    """URL of a static file with its content hash, safe to cache forever"""
+    path = os.path.join(current_app.static_folder, filename)
+    return url_for('static', filename=filename, v=fingerprint(path))
+
+
+def content_addressed_name(stem, data, suffix):
+    return f"{stem}-{hashlib.sha256(data).hexdigest()[:16]}{suffix}"
+
+
+def _is_immutable_static():
+    if request.endpoint != 'static':
+        return False
+    filename = (request.view_args or {}).get('filename', '')
+    return 'v' in request.args or filename.startswith(IMMUTABLE_STATIC_DIRS)
+
+
+def _compress(response):
+    encoding = request.accept_encodings.best_match(['br', 'gzip'] if brotli else ['gzip'])
+    if encoding is None:
+        return
+    data = response.get_data()
+    if encoding == 'br':
+        response.set_data(brotli.compress(data, quality=BROTLI_QUALITY))
+    else:
+        response.set_data(gzip.compress(data, compresslevel=GZIP_LEVEL))
+    response.headers['Content-Encoding'] = encoding
+
+
+def accepts_gzip():
+    return request.accept_encodings['gzip'] > 0
+
+
+def gzip_writer(fileobj):
+    """Writable gzip stream into ``fileobj``; closing it leaves ``fileobj`` open"""
+    return gzip.GzipFile(fileobj=fileobj, mode='wb', compresslevel=GZIP_LEVEL)
+
+
+def after_request(response):
+    if _is_immutable_static():
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+        return response
+
+    if (response.direct_passthrough or response.is_streamed
+            or response.status_code != 200
+            or response.mimetype not in COMPRESS_MIMETYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    if request.method in ('GET', 'HEAD'):
+        # Weak, so the tag stays valid whichever encoding is sent
+        response.add_etag(weak=True)
+        response.cache_control.no_cache = True
+        response.make_conditional(request)
+        if response.status_code == 304:
+            return response
+
+    if 'Content-Encoding' not in response.headers and response.content_length >= COMPRESS_MIN_SIZE:
+        _compress(response)
+    return response
+
+
+def init_delivery(app):
+    app.after_request(after_request)
+    app.add_template_global(asset_url)
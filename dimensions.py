@@ -0,0 +1,117 @@
+"""Versioned in-process cache of the department, service station and product tables.
+
+Page and export queries select only ``department_id``,
+``service_station_id`` and ``product_id`` and decode them here, so the hot
+path never joins the dimension tables. The version also carries the latest
+archive cutoff, which tells queries whether they need the archived history.
+The cache re-checks the version at most every ``DIMENSION_CHECK_SECONDS``
+and reloads only when an ingest or archive run changed it.
+"""
+import os
+import time
+import threading
+
+DIMENSION_CHECK_SECONDS = int(os.getenv("DIMENSION_CHECK_SECONDS", 30))
+
+VERSION_QUERY = """
+SELECT
+    (SELECT COALESCE(MAX(id), 0) FROM ingest_watermarks),
+    (SELECT COALESCE(MAX(id), 0) FROM departments),
+    (SELECT COALESCE(MAX(id), 0) FROM service_stations),
+    (SELECT COALESCE(MAX(id), 0) FROM products),
+    (SELECT MAX(cutoff) FROM archive_runs)
+"""
+
+
+class Department:
+    __slots__ = ('id', 'name')
+
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+
+
+class Station:
+    __slots__ = ('id', 'name', 'region')
+
+    def __init__(self, id, name, region):
+        self.id = id
+        self.name = name
+        self.region = region
+
+
+class Dimensions:
+    """Immutable view of the dimension tables at one version"""
+    __slots__ = (
+        'version', 'departments', 'stations', 'regions', 'products',
+        'department_names', 'station_names', 'station_regions', 'region_station_ids',
+        'product_names', 'product_ids', 'archive_cutoff'
+    )
+
+    def __init__(self, version, departments, stations, products=()):
+        self.version = version
+        # Sorted by name, ready for the dropdowns
+        self.departments = sorted(departments, key=lambda d: d.name)
+        self.stations = sorted(stations, key=lambda s: s.name)
+        self.department_names = {d.id: d.name for d in departments}
+        self.station_names = {s.id: s.name for s in stations}
+        self.station_regions = {s.id: s.region for s in stations}
+        self.product_names = dict(products)
+        self.product_ids = {name: id_ for id_, name in products}
+        self.products = sorted(self.product_ids)
+        # Transactions dated before this are in the columnstore archive
+        self.archive_cutoff = version[4]
+
+        region_station_ids = {}
+        for s in stations:
+            if s.region is not None:
+                region_station_ids.setdefault(s.region, []).append(s.id)
+        self.region_station_ids = {r: tuple(sorted(ids)) for r, ids in region_station_ids.items()}
+        self.regions = sorted(self.region_station_ids)
+
+    def station_ids_for_region(self, region):
+        return self.region_station_ids.get(region, ())
+
+
+def load_dimensions(conn, version):
+    departments = [
+        Department(id_, name)
+        for id_, name in conn.exec_driver_sql("SELECT id, name FROM departments").fetchall()
+    ]
+    stations = [
+        Station(id_, name, region)
+        for id_, name, region in conn.exec_driver_sql(
+            "SELECT id, name, region FROM service_stations"
+        ).fetchall()
+    ]
+    products = conn.exec_driver_sql("SELECT id, name FROM products").fetchall()
+    return Dimensions(version, departments, stations, [tuple(row) for row in products])
+
+
+class DimensionCache:
+    """Thread-safe holder of the current ``Dimensions``"""
+
+    def __init__(self, check_seconds=DIMENSION_CHECK_SECONDS):
+        self.check_seconds = check_seconds
+        self._lock = threading.Lock()
+        self._dimensions = None
+        self._checked_at = 0.0
+
+    def get(self, engine):
+        dimensions = self._dimensions
+        if dimensions is not None and time.monotonic() - self._checked_at < self.check_seconds:
+            return dimensions
+
+        with self._lock:
+            if self._dimensions is not None and time.monotonic() - self._checked_at < self.check_seconds:
+                return self._dimensions
+            with engine.connect() as conn:
+                version = tuple(conn.exec_driver_sql(VERSION_QUERY).fetchone())
+                if self._dimensions is None or self._dimensions.version != version:
+                    self._dimensions = load_dimensions(conn, version)
+            self._checked_at = time.monotonic()
+            return self._dimensions
+
+    def invalidate(self):
+        """Force a version check on the next ``get``"""
+        self._checked_at = 0.0
@@ -0,0 +1,122 @@
+"""Server-Sent Events telling open dashboards that new data has landed.
+
+Loads publish a row in ``data_versions`` once the transactions, snapshot
+and caches are all up to date (see ``script.publish_data_version``). Each
+web worker process reads the latest rows at most every
+``DATA_VERSION_POLL_SECONDS`` however many dashboards are listening, and
+sends each stream the dates and departments that changed since the version
+it last saw, so a dashboard only refreshes the panels its filters can see
+new rows in.
+
+A stream holds a worker thread, so streams end after
+``EVENT_STREAM_SECONDS`` and the browser reconnects with the last version it
+received, and each process serves at most ``EVENT_STREAM_LIMIT`` at once.
+"""
+import os
+import json
+import time
+import threading
+
+DATA_VERSION_POLL_SECONDS = float(os.getenv("DATA_VERSION_POLL_SECONDS", 5))
+EVENT_STREAM_SECONDS = float(os.getenv("EVENT_STREAM_SECONDS", 300))
+EVENT_STREAM_LIMIT = int(os.getenv("EVENT_STREAM_LIMIT", 4))  # per worker process
+EVENT_RETRY_MS = 5000
+KEEPALIVE_SECONDS = 20
+VERSION_HISTORY = 32
+
+VERSIONS_QUERY = f"""
+SELECT TOP {VERSION_HISTORY} id, first_date, last_date, department_ids
+FROM data_versions
+ORDER BY id DESC
+"""
+
+
+class VersionRow:
+    __slots__ = ('version', 'first_date', 'last_date', 'department_ids')
+
+    def __init__(self, version, first_date, last_date, department_ids):
+        self.version = version
+        self.first_date = first_date
+        self.last_date = last_date
+        self.department_ids = department_ids
+
+
+class DataVersion:
+    """Thread-safe view of the latest published data versions"""
+
+    def __init__(self, poll_seconds=DATA_VERSION_POLL_SECONDS):
+        self.poll_seconds = poll_seconds
+        self._lock = threading.Lock()
+        self._rows = []  # newest first
+        self._checked_at = 0.0
+        self._failing = False
+
+    def current(self, engine):
+        """Latest version number, 0 before anything was published"""
+        if time.monotonic() - self._checked_at >= self.poll_seconds:
+            with self._lock:
+                if time.monotonic() - self._checked_at >= self.poll_seconds:
+                    self._refresh(engine)
+                    self._checked_at = time.monotonic()
+        return self._rows[0].version if self._rows else 0
+
+    def _refresh(self, engine):
+        try:
+            with engine.connect() as conn:
+                rows = conn.exec_driver_sql(VERSIONS_QUERY).fetchall()
+        except Exception as e:
+            # Keep the last known versions; before the first load there is no table
+            if not self._failing:
+                print(f"⚠️ Could not read data versions: {e}")
+            self._failing = True
+            return
+        self._failing = False
+        self._rows = [
+            VersionRow(version, first_date, last_date, json.loads(department_ids) if department_ids else None)
+            for version, first_date, last_date, department_ids in rows
+        ]
+
+    def changes_since(self, since):
+        """What changed after version ``since``: dates and department ids, or None for unknown"""
+        rows = [row for row in self._rows if row.version > since]
+        if not rows:
+            return None
+        change = {'version': rows[0].version, 'first_date': None, 'last_date': None, 'departments': None}
+        # Older than the history kept here: describe it as a change to everything
+        if rows[-1].version > since + 1:
+            return change
+        change['first_date'] = str(min(row.first_date for row in rows))
+        change['last_date'] = str(max(row.last_date for row in rows))
+        if all(row.department_ids is not None for row in rows):
+            change['departments'] = sorted({i for row in rows for i in row.department_ids})
+        return change
+
+
+def event(name, data, event_id=None):
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    lines += [f"event: {name}", f"data: {json.dumps(data)}"]
+    return '\n'.join(lines) + '\n\n'
+
+
+def version_stream(data_version, get_engine, since=None, duration=EVENT_STREAM_SECONDS):
+    """Yield SSE messages announcing each version after ``since``, for ``duration`` seconds"""
+    yield f"retry: {EVENT_RETRY_MS}\n\n"
+    deadline = time.monotonic() + duration
+    last_sent = time.monotonic()
+    while time.monotonic() < deadline:
+        version = data_version.current(get_engine())
+        if since is None:
+            since = version
+            yield event('data-version', {'version': version}, version)
+            last_sent = time.monotonic()
+        elif version > since:
+            yield event('data-change', data_version.changes_since(since) or {'version': version}, version)
+            since = version
+            last_sent = time.monotonic()
+        elif version < since:
+            since = version  # the versions were reset, e.g. by a database restore
+        elif time.monotonic() - last_sent >= KEEPALIVE_SECONDS:
+            # Also how a closed connection is noticed: the write fails
+            yield ": keepalive\n\n"
+            last_sent = time.monotonic()
+        time.sleep(data_version.poll_seconds)
@@ -0,0 +1,82 @@
+"""Parquet, Arrow and CSV exports of transaction rows.
+
+Rows come from the database in batches of raw id tuples. Each batch is
+decoded column by column into an Arrow record batch and written straight
+to the output as a Parquet row group, an Arrow IPC stream message or CSV
+lines, so an export holds one batch in memory however many rows it has.
+pyarrow is imported on first use, like pandas for the Excel export.
+"""
+import os
+
+EXPORT_BATCH_ROWS = int(os.getenv("EXPORT_BATCH_ROWS", 65536))
+
+# Format: (MIME type, file extension)
+EXPORT_FORMATS = {
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrows'),
+    'csv': ('text/csv', 'csv'),
+}
+
+
+def transaction_schema():
+    import pyarrow as pa
+
+    return pa.schema([
+        ('date', pa.date32()),
+        ('vehicle_registration', pa.string()),
+        ('department', pa.string()),
+        ('service_station', pa.string()),
+        ('region', pa.string()),
+        ('product', pa.string()),
+        ('quantity', pa.float64()),
+        ('customer_amount', pa.float64()),
+        ('terminal_price', pa.float64()),
+    ])
+
+
+def record_batch(records, dims, schema):
+    """Arrow batch from (date, vehicle, department_id, station_id, product_id, quantity, amount, price) tuples"""
+    import pyarrow as pa
+
+    dates, vehicles, department_ids, station_ids, product_ids, quantities, amounts, prices = zip(*records)
+    department_names = dims.department_names
+    station_names = dims.station_names
+    station_regions = dims.station_regions
+    product_names = dims.product_names
+    columns = (
+        dates, vehicles,
+        [department_names.get(i) for i in department_ids],
+        [station_names.get(i) for i in station_ids],
+        [station_regions.get(i) for i in station_ids],
+        [product_names.get(i) for i in product_ids],
+        quantities, amounts, prices,
+    )
+    return pa.RecordBatch.from_arrays(
+        [pa.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema
+    )
+
+
+def write_export(export_format, batches, dims, output):
+    """Write batches of raw transaction tuples to ``output`` as parquet, arrow or csv; returns the row count"""
+    schema = transaction_schema()
+    if export_format == 'parquet':
+        import pyarrow.parquet as pq
+        writer = pq.ParquetWriter(output, schema, compression='zstd')
+    elif export_format == 'arrow':
+        import pyarrow as pa
+        writer = pa.ipc.new_stream(output, schema)
+    elif export_format == 'csv':
+        import pyarrow.csv as pcsv
+        writer = pcsv.CSVWriter(output, schema)
+    else:
+        raise ValueError(f"Unknown export format: {export_format}")
+
+    rows = 0
+    with writer:
+        for records in batches:
+            if records:
+                # Each batch becomes one Parquet row group or IPC message
+                writer.write_batch(record_batch(records, dims, schema))
+                rows += len(records)
+    return rows
@@ -0,0 +1,21 @@
+# Gunicorn settings shared by the Docker image and the Azure startup command.
+# The app is imported once in the master and forked; the database engine and
+# the chart rendering pool are created lazily inside each worker.
+import os
+
+preload_app = True
+
+# Charts render in a separate process pool, so request threads only wait on I/O
+worker_class = 'gthread'
+workers = int(os.getenv("GUNICORN_WORKERS", 2))
+threads = int(os.getenv("GUNICORN_THREADS", 8))
+
+
+def post_fork(server, worker):
+    from app import reset_engine
+    reset_engine()
+
+
+def worker_exit(server, worker):
+    import charts
+    charts.shutdown()
@@ -0,0 +1,156 @@
+"""Watch-folder ingestion service.
+
+Polls ``INGEST_DROP_DIR`` for Excel workbooks and loads every one whose
+checksum has no completed load in the ``ingest_loads`` journal, through the
+same prepare, reference and transaction phases as ``script.py``. A load
+that stopped part-way resumes from its last committed chunk. After a poll
+that loaded anything the analytics snapshot is refreshed, the caches are
+warmed and a new data version is published once, which open dashboards
+receive over ``/api/events``.
+
+Loads are incremental per path: the journal records how many rows of the
+workbook each load covered, so when a workbook is appended to in place
+only the rows after the last completed load are inserted. Edits to rows
+that were already loaded are not picked up, and a workbook rewritten with
+fewer rows is refused; drop corrected exports under a new name.
+"""
+import os
+import time
+import argparse
+from dotenv import load_dotenv
+
+load_dotenv()
+
+INGEST_DROP_DIR = os.getenv("INGEST_DROP_DIR", "incoming")
+INGEST_POLL_SECONDS = float(os.getenv("INGEST_POLL_SECONDS", 30))
+INGEST_SETTLE_SECONDS = float(os.getenv("INGEST_SETTLE_SECONDS", 10))  # skip files still being copied
+INGEST_RETRY_SECONDS = float(os.getenv("INGEST_RETRY_SECONDS", 300))
+WORKBOOK_EXTENSIONS = ('.xlsx', '.xls')
+
+
+def is_loaded(checksum):
+    """True when a load of this exact file content has completed"""
+    import script
+
+    conn = script.connect_to_sql()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT OBJECT_ID('ingest_loads')")
+        if cursor.fetchone()[0] is None:
+            return False  # first load into a new database; it creates the journal
+        cursor.execute(
+            "SELECT TOP 1 1 FROM ingest_loads WHERE checksum = ? AND status = 'complete'", checksum
+        )
+        return cursor.fetchone() is not None
+    finally:
+        conn.close()
+
+
+class DropFolder:
+    """Workbooks in the drop directory that are new or changed since they were last seen"""
+
+    def __init__(self, path=INGEST_DROP_DIR, settle_seconds=INGEST_SETTLE_SECONDS,
+                 retry_seconds=INGEST_RETRY_SECONDS):
+        self.path = path
+        self.settle_seconds = settle_seconds
+        self.retry_seconds = retry_seconds
+        self._seen = {}  # path -> (size, mtime) of the content already handled
+        self._failed = {}  # path -> (size, mtime, time of the failure)
+        self.unpublished = False  # loaded rows not yet announced to dashboards
+
+    def workbooks(self):
+        """Paths of settled workbooks, oldest first"""
+        now = time.time()
+        found = []
+        for entry in os.scandir(self.path):
+            # ~$ files are Excel's lock files next to an open workbook
+            if not entry.is_file() or entry.name.startswith('~$'):
+                continue
+            if not entry.name.lower().endswith(WORKBOOK_EXTENSIONS):
+                continue
+            stat = entry.stat()
+            if now - stat.st_mtime >= self.settle_seconds:
+                found.append((stat.st_mtime, entry.path, (stat.st_size, stat.st_mtime)))
+        return [(path, signature) for _, path, signature in sorted(found)]
+
+    def pending(self):
+        """(path, signature) of workbooks whose size or mtime changed since they were handled"""
+        now = time.time()
+        for path, signature in self.workbooks():
+            if self._seen.get(path) == signature:
+                continue
+            failed = self._failed.get(path)
+            if failed and failed[:2] == signature and now - failed[2] < self.retry_seconds:
+                continue
+            yield path, signature
+
+    def handled(self, path, signature):
+        self._seen[path] = signature
+        self._failed.pop(path, None)
+
+    def failed(self, path, signature):
+        self._failed[path] = signature + (time.time(),)
+
+
+def poll(folder):
+    """Load every new or changed workbook once; returns the number of workbooks loaded"""
+    import script
+
+    loaded = 0
+    for path, signature in folder.pending():
+        try:
+            checksum = script.file_checksum(path)
+            if is_loaded(checksum):
+                folder.handled(path, signature)
+                continue
+            print(f"\n📥 Loading {path}")
+            rows = script.load_workbook(path, checksum=checksum, resume=True, incremental=True)
+            folder.handled(path, signature)
+            if rows:
+                loaded += 1
+        except Exception as e:
+            folder.failed(path, signature)
+            print(f"❌ Could not load {path}, retrying in {folder.retry_seconds:g}s if unchanged: {e}")
+
+    if loaded:
+        folder.unpublished = True
+        print(f"✅ Loaded {loaded} workbook(s) from {folder.path}")
+    # Retried on later polls if the publish fails
+    if folder.unpublished:
+        script.refresh_analytics_snapshot()
+        script.warm_dashboard_caches()
+        script.publish_data_version()
+        folder.unpublished = False
+    return loaded
+
+
+def run(path=INGEST_DROP_DIR, poll_seconds=INGEST_POLL_SECONDS, once=False):
+    os.makedirs(path, exist_ok=True)
+    folder = DropFolder(path)
+    print(f"👀 Watching {path} for workbooks every {poll_seconds:g}s")
+    while True:
+        started = time.monotonic()
+        try:
+            poll(folder)
+        except Exception as e:
+            # The database may be briefly unreachable; the next poll tries again
+            print(f"⚠️ Poll of {path} failed: {e}")
+        if once:
+            return
+        time.sleep(max(0.0, poll_seconds - (time.monotonic() - started)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load workbooks dropped into a folder as they arrive")
+    parser.add_argument('--drop-dir', default=INGEST_DROP_DIR,
+                        help="Directory to watch for .xlsx/.xls workbooks")
+    parser.add_argument('--interval', type=float, default=INGEST_POLL_SECONDS,
+                        help="Seconds between polls")
+    parser.add_argument('--once', action='store_true',
+                        help="Poll a single time and exit")
+    args = parser.parse_args()
+    run(args.drop_dir, args.interval, args.once)
+
+
+if __name__ == "__main__":
+    main()
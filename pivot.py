@@ -0,0 +1,163 @@
+"""Cross-tabs of fuel transactions by department, station, region, product and time.
+
+One GROUPING SETS query returns the cells together with the row totals,
+column totals and grand total. Results are kept as additive sums
+(transactions, quantity, amount) so stations fold into regions and the
+average price is derived after folding. Each header carries the dashboard
+filters that select it, which is how clients drill down: add the header's
+filters and swap the dimension for its ``drill`` dimension.
+"""
+import calendar
+from trends import parse_date
+
+PIVOT_MEASURES = ('quantity', 'customer_amount', 'avg_price', 'transactions')
+PIVOT_MAX_DIMENSIONS = 3
+
+
+class PivotDimension:
+    __slots__ = ('name', 'live_expression', 'snapshot_expression', 'drill')
+
+    def __init__(self, name, live_expression, snapshot_expression, drill=None):
+        self.name = name
+        self.live_expression = live_expression
+        self.snapshot_expression = snapshot_expression
+        self.drill = drill
+
+
+# Regions are grouped by station on the live tables and folded once decoded;
+# products are grouped by their dictionary key there
+PIVOT_DIMENSIONS = {dimension.name: dimension for dimension in (
+    PivotDimension('department', 'ft.department_id', 'department_id', 'station'),
+    PivotDimension('station', 'ft.service_station_id', 'service_station_id'),
+    PivotDimension('region', 'ft.service_station_id', 'region', 'station'),
+    PivotDimension('product', 'ft.product_id', 'product', 'department'),
+    PivotDimension('month', "DATEFROMPARTS(YEAR(ft.date), MONTH(ft.date), 1)",
+                   "CAST(date_trunc('month', date) AS DATE)", 'day'),
+    PivotDimension('day', "CAST(ft.date AS DATE)", "CAST(date AS DATE)"),
+)}
+
+
+def parse_axis(value):
+    """Dimension names from a comma-separated request argument"""
+    names = [name.strip() for name in (value or '').split(',') if name.strip()]
+    unknown = [name for name in names if name not in PIVOT_DIMENSIONS]
+    if unknown:
+        raise ValueError(f"Unknown pivot dimension: {', '.join(unknown)}")
+    return tuple(names)
+
+
+def validate_axes(rows, cols):
+    names = rows + cols
+    if not rows:
+        raise ValueError("At least one row dimension is required")
+    if len(names) > PIVOT_MAX_DIMENSIONS:
+        raise ValueError(f"At most {PIVOT_MAX_DIMENSIONS} dimensions can be combined")
+    if len(set(names)) != len(names):
+        raise ValueError("A dimension can only be used once")
+    if 'region' in names and 'station' in names:
+        raise ValueError("Region and station cannot be combined; drill from region into station instead")
+
+
+def grouping_query(rows, cols, live, table, where, sums):
+    """SELECT with one column and one GROUPING() flag per dimension, then the sums"""
+    expressions = [
+        PIVOT_DIMENSIONS[name].live_expression if live else PIVOT_DIMENSIONS[name].snapshot_expression
+        for name in rows + cols
+    ]
+    sets = [f"({', '.join(expressions)})", "()"]
+    if cols:
+        sets[1:1] = [f"({', '.join(expressions[:len(rows)])})", f"({', '.join(expressions[len(rows):])})"]
+    return (
+        f"SELECT {', '.join(expressions)}, "
+        f"{', '.join(f'GROUPING({e})' for e in expressions)}, {sums} "
+        f"FROM {table}{where} GROUP BY GROUPING SETS ({', '.join(sets)})"
+    )
+
+
+def member(name, raw, dims, live):
+    """Label and drill-down filters of one dimension value"""
+    if raw is None:
+        return None, None
+    if name == 'department':
+        return dims.department_names.get(raw), {'department': str(raw)}
+    if name == 'station':
+        return dims.station_names.get(raw), {'service_station': str(raw)}
+    if name == 'region':
+        region = dims.station_regions.get(raw) if live else raw
+        return region, {'region': region} if region else None
+    if name == 'product':
+        product = dims.product_names.get(raw) if live else raw
+        return product, {'product': product} if product else None
+    day = parse_date(raw)
+    if name == 'month':
+        last = calendar.monthrange(day.year, day.month)[1]
+        return day.strftime('%Y-%m'), {
+            'start_date': day.replace(day=1).isoformat(),
+            'end_date': day.replace(day=last).isoformat()
+        }
+    return day.isoformat(), {'start_date': day.isoformat(), 'end_date': day.isoformat()}
+
+
+def fold(records, rows, cols, dims, live):
+    """Sum GROUPING SETS output into {(row_key, col_key): [transactions, quantity, amount]}.
+
+    A key of ``None`` marks the total over that axis. Also returns the
+    filters of every row and column label.
+    """
+    names = rows + cols
+    width = len(names)
+    cells = {}
+    headers = ({}, {})
+    for record in records:
+        values, flags, sums = record[:width], record[width:2 * width], record[2 * width:]
+        keys = []
+        for axis, (start, stop) in enumerate(((0, len(rows)), (len(rows), width))):
+            if start == stop or flags[start]:
+                keys.append(None)
+                continue
+            labels = []
+            filters = {}
+            for name, raw in zip(names[start:stop], values[start:stop]):
+                label, member_filters = member(name, raw, dims, live)
+                labels.append(label)
+                filters.update(member_filters or {})
+            keys.append(tuple(labels))
+            headers[axis][keys[-1]] = filters
+        totals = cells.setdefault(tuple(keys), [0, 0.0, 0.0])
+        totals[0] += sums[0] or 0
+        totals[1] += float(sums[1] or 0.0)
+        totals[2] += float(sums[2] or 0.0)
+    return cells, headers
+
+
+def measure_value(totals, measure):
+    if totals is None:
+        return None
+    transactions, quantity, amount = totals
+    if measure == 'transactions':
+        return transactions
+    if measure == 'avg_price':
+        return round(amount / quantity, 2) if quantity else None
+    return round(quantity if measure == 'quantity' else amount, 2)
+
+
+def _sort_key(labels):
+    return tuple((label is None, label or '') for label in labels)
+
+
+def pivot_table(cells, headers, rows, cols, measure):
+    """Lay the folded sums out as a matrix of ``measure`` with totals and drill hints"""
+    row_keys = sorted(headers[0], key=_sort_key)
+    col_keys = sorted(headers[1], key=_sort_key) if cols else [None]
+    return {
+        'rows': list(rows),
+        'cols': list(cols),
+        'measure': measure,
+        'row_headers': [{'labels': list(key), 'filters': headers[0][key]} for key in row_keys],
+        'col_headers': [{'labels': list(key), 'filters': headers[1][key]} for key in col_keys if key is not None],
+        'cells': [[measure_value(cells.get((r, c)), measure) for c in col_keys] for r in row_keys],
+        'row_totals': [measure_value(cells.get((r, None)), measure) for r in row_keys],
+        'col_totals': [measure_value(cells.get((None, c)), measure) for c in col_keys] if cols else [],
+        'grand_total': measure_value(cells.get((None, None)), measure),
+        'drill': {name: PIVOT_DIMENSIONS[name].drill for name in rows + cols},
+    }
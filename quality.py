@@ -0,0 +1,116 @@
+"""Data-quality rules for prepared fuel transactions.
+
+Each rule is a vectorized check over whole columns that marks the rows it
+fails. Rows failing any rejecting rule are kept out of ``fuel_transactions``
+and loaded into ``fuel_transactions_rejected`` with the codes of every rule
+they failed, so they can be corrected and reloaded.
+
+Rules listed in ``QUALITY_WARN_RULES`` only flag rows in the report and
+still load them. By default that is BAD_PLATE and OVER_TANK_CAPACITY: fuel
+drawn for generators, garages or fire engines has no number plate and
+tank capacities are often wrong, but the spend is real and belongs in the
+totals. Only rows that are actually corrupt are quarantined.
+
+Checks take the frame and the load's reference date, the "today" that
+future dates are judged against, so a resumed load accepts the same rows
+as the run that started it.
+"""
+import os
+from datetime import date
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+
+load_dotenv()
+
+AMOUNT_TOLERANCE = float(os.getenv("QUALITY_AMOUNT_TOLERANCE", 0.05))  # relative to the amount
+AMOUNT_TOLERANCE_MIN = 5.0  # KES, so rounding on small amounts is not flagged
+MIN_DATE = pd.Timestamp(os.getenv("QUALITY_MIN_DATE", "2000-01-01"))
+MAX_DAYS_AHEAD = 1
+PLATE_PATTERN = os.getenv("QUALITY_PLATE_PATTERN", r"K[A-Z]{2,3} ?\d{3}[A-Z]?")
+WARN_RULES = {
+    code.strip() for code in os.getenv("QUALITY_WARN_RULES", "BAD_PLATE,OVER_TANK_CAPACITY").split(',') if code.strip()
+}
+
+
+class QualityRule:
+    __slots__ = ('code', 'description', 'columns', 'check')
+
+    def __init__(self, code, description, columns, check):
+        self.code = code
+        self.description = description
+        self.columns = columns
+        self.check = check
+
+
+def _amount_mismatch(df, reference_date):
+    expected = df['quantity'] * df['terminal_price']
+    allowed = np.maximum(df['customer_amount'].abs() * AMOUNT_TOLERANCE, AMOUNT_TOLERANCE_MIN)
+    return (df['customer_amount'] - expected).abs() > allowed
+
+
+def _date_out_of_range(df, reference_date):
+    latest = pd.Timestamp(reference_date) + pd.Timedelta(days=MAX_DAYS_AHEAD)
+    return df['date'].isna() | (df['date'] < MIN_DATE) | (df['date'] > latest)
+
+
+def _bad_plate(df, reference_date):
+    # Plates repeat heavily, so each distinct plate is matched once
+    codes, plates = pd.factorize(df['vehicle_registration'])
+    valid = pd.Series(plates, dtype='string').str.fullmatch(PLATE_PATTERN, case=False).fillna(False).to_numpy(bool)
+    return ~np.append(valid, False)[codes]  # code -1 is a missing plate
+
+
+QUALITY_RULES = (
+    QualityRule('NEGATIVE_QUANTITY', "Quantity is negative",
+                ('quantity',), lambda df, reference_date: df['quantity'] < 0),
+    QualityRule('OVER_TANK_CAPACITY', "Quantity exceeds the full tank capacity",
+                ('quantity', 'full_tank_capacity'),
+                lambda df, reference_date: df['quantity'] > df['full_tank_capacity']),
+    QualityRule('AMOUNT_MISMATCH', "Customer amount differs from quantity × terminal price",
+                ('quantity', 'terminal_price', 'customer_amount'), _amount_mismatch),
+    QualityRule('DATE_OUT_OF_RANGE', "Date is missing or outside the accepted range",
+                ('date',), _date_out_of_range),
+    QualityRule('BAD_PLATE', "Vehicle registration does not look like a number plate",
+                ('vehicle_registration',), _bad_plate),
+)
+
+
+def evaluate(df, reference_date=None, rules=QUALITY_RULES, warn_rules=WARN_RULES):
+    """Apply the rules to every row at once, judging dates against ``reference_date`` (default today).
+
+    Returns a boolean array of rejected rows, the comma-separated reason
+    codes of each rejected row in order, and the number of rows each rule
+    failed. Rules in ``warn_rules`` are counted but reject nothing.
+    """
+    reference_date = reference_date or date.today()
+    failures = np.zeros(len(df), dtype=np.uint32)
+    rejecting = np.uint32(0)
+    counts = {}
+    active = [rule for rule in rules if all(column in df.columns for column in rule.columns)]
+    for bit, rule in enumerate(active):
+        failed = np.asarray(rule.check(df, reference_date), dtype=bool)
+        counts[rule.code] = int(failed.sum())
+        failures |= failed.astype(np.uint32) << bit
+        if rule.code not in warn_rules:
+            rejecting |= np.uint32(1 << bit)
+
+    rejected = (failures & rejecting) != 0
+    # Reason strings are built once per distinct combination of failed rules
+    combinations, inverse = np.unique(failures[rejected], return_inverse=True)
+    labels = [
+        ','.join(rule.code for bit, rule in enumerate(active) if combination >> bit & 1)
+        for combination in combinations
+    ]
+    reasons = [labels[i] for i in inverse]
+    return rejected, reasons, counts
+
+
+def print_report(rejected, counts, rules=QUALITY_RULES, warn_rules=WARN_RULES):
+    total = len(rejected)
+    print("\nData quality report:")
+    for rule in rules:
+        if rule.code in counts:
+            action = "flagged, loaded" if rule.code in warn_rules else "rejected"
+            print(f"  {rule.code:<20}{counts[rule.code]:>8} rows  {rule.description} ({action})")
+    print(f"  {int(rejected.sum())} of {total} rows rejected to quarantine, {total - int(rejected.sum())} accepted")
@@ -0,0 +1,75 @@
+"""Slotted row types passed from the query layer straight to templates and JSON."""
+
+TRANSACTION_COLUMNS = (
+    'date', 'vehicle_registration', 'department', 'service_station', 'region',
+    'product', 'quantity', 'customer_amount', 'terminal_price'
+)
+
+AGGREGATE_COLUMNS = (
+    'department', 'region', 'product', 'transactions', 'quantity', 'customer_amount'
+)
+
+
+class TransactionRow:
+    __slots__ = TRANSACTION_COLUMNS
+
+    def __init__(self, date, vehicle_registration, department, service_station, region,
+                 product, quantity, customer_amount, terminal_price):
+        self.date = date
+        self.vehicle_registration = vehicle_registration
+        self.department = department
+        self.service_station = service_station
+        self.region = region
+        self.product = product
+        self.quantity = quantity
+        self.customer_amount = customer_amount
+        self.terminal_price = terminal_price
+
+    def as_tuple(self):
+        return tuple(getattr(self, name) for name in TRANSACTION_COLUMNS)
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in TRANSACTION_COLUMNS}
+
+
+class AggregateRow:
+    __slots__ = AGGREGATE_COLUMNS
+
+    def __init__(self, department, region, product, transactions, quantity, customer_amount):
+        self.department = department
+        self.region = region
+        self.product = product
+        self.transactions = transactions
+        self.quantity = quantity
+        self.customer_amount = customer_amount
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in AGGREGATE_COLUMNS}
+
+
+def decode_transactions(records, dims):
+    """Build TransactionRows from (date, vehicle, department_id, station_id, product_id, quantity, amount, price) tuples"""
+    department_names = dims.department_names
+    station_names = dims.station_names
+    station_regions = dims.station_regions
+    product_names = dims.product_names
+    return [
+        TransactionRow(
+            date, vehicle, department_names.get(department_id),
+            station_names.get(station_id), station_regions.get(station_id),
+            product_names.get(product_id), quantity, customer_amount, terminal_price
+        )
+        for date, vehicle, department_id, station_id, product_id, quantity, customer_amount, terminal_price in records
+    ]
+
+
+def totals_by(aggregates, key, measure, limit=None):
+    """Sum ``measure`` per ``key`` over aggregate rows, largest first"""
+    totals = {}
+    for row in aggregates:
+        label = getattr(row, key)
+        if label is None:
+            continue
+        totals[label] = totals.get(label, 0.0) + (getattr(row, measure) or 0.0)
+    ranked = sorted(totals.items(), key=lambda item: item[1], reverse=True)
+    return ranked[:limit] if limit else ranked
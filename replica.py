@@ -0,0 +1,73 @@
+"""Routing of dashboard reads to a read-only secondary.
+
+When ``DB_READ_HOST`` is set the dashboard reads from that endpoint with
+read-only application intent, leaving the primary (``DB_HOST``) to the
+loads in ``script.py``. The router compares the ingest watermark of the
+secondary with the primary's at most every ``REPLICA_CHECK_SECONDS`` and
+sends reads to the primary while the secondary has been behind for longer
+than ``REPLICA_MAX_LAG_SECONDS``, or cannot be reached.
+"""
+import os
+import time
+import threading
+
+REPLICA_CHECK_SECONDS = int(os.getenv("REPLICA_CHECK_SECONDS", 10))
+REPLICA_MAX_LAG_SECONDS = int(os.getenv("REPLICA_MAX_LAG_SECONDS", 0))
+
+WATERMARK_QUERY = "SELECT COALESCE(MAX(max_transaction_id), 0) FROM ingest_watermarks"
+
+
+def watermark(engine):
+    with engine.connect() as conn:
+        return conn.exec_driver_sql(WATERMARK_QUERY).scalar()
+
+
+class ReplicaRouter:
+    """Thread-safe choice between the primary and the read replica engines"""
+
+    def __init__(self, check_seconds=REPLICA_CHECK_SECONDS, max_lag_seconds=REPLICA_MAX_LAG_SECONDS):
+        self.check_seconds = check_seconds
+        self.max_lag_seconds = max_lag_seconds
+        self._lock = threading.Lock()
+        self._use_replica = False
+        self._checked_at = 0.0
+        self._behind_since = None
+
+    def choose(self, primary, replica):
+        """Engine for the next read: ``replica`` while it is fresh enough, else ``primary``"""
+        if replica is None:
+            return primary
+        if time.monotonic() - self._checked_at >= self.check_seconds:
+            with self._lock:
+                if time.monotonic() - self._checked_at >= self.check_seconds:
+                    self._use_replica = self._is_fresh(primary, replica)
+                    self._checked_at = time.monotonic()
+        return replica if self._use_replica else primary
+
+    def _is_fresh(self, primary, replica):
+        try:
+            replica_watermark = watermark(replica)
+        except Exception as e:
+            print(f"⚠️ Read replica unavailable, reading from the primary: {e}")
+            return False
+        try:
+            primary_watermark = watermark(primary)
+        except Exception:
+            return True  # the replica is all there is
+
+        if replica_watermark >= primary_watermark:
+            self._behind_since = None
+            return True
+        now = time.monotonic()
+        if self._behind_since is None:
+            self._behind_since = now
+            print(f"⚠️ Read replica is at watermark {replica_watermark}, primary at {primary_watermark}")
+        return now - self._behind_since < self.max_lag_seconds
+
+    def invalidate(self):
+        """Force a freshness check on the next ``choose``"""
+        self._checked_at = 0.0
+
+    @property
+    def using_replica(self):
+        return self._use_replica
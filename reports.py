@@ -0,0 +1,229 @@
+"""Monthly fuel reports for every department.
+
+Reads the month's transactions for all departments in one set-based query,
+ordered by department, and splits them in memory. Each department's
+summary, top vehicles, charts, Excel workbook and HTML page are then built
+in a pool of worker processes and written under
+``REPORT_DIR/<YYYY-MM>/<department>/``, with an index page for the month.
+"""
+import os
+import re
+import argparse
+import multiprocessing
+from datetime import date, timedelta
+from itertools import groupby
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dotenv import load_dotenv
+
+load_dotenv()
+
+REPORT_DIR = os.getenv("REPORT_DIR", "reports")
+REPORT_WORKERS = int(os.getenv("REPORT_WORKERS") or os.cpu_count() or 2)  # empty: one per core
+REPORT_TOP_VEHICLES = int(os.getenv("REPORT_TOP_VEHICLES", 10))
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+
+# The department charts of the dashboard are a single bar for one department
+REPORT_CHART_KEYS = ('region', 'product')
+
+REPORT_QUERY = """
+SELECT
+    ft.date, ft.vehicle_registration, ft.department_id,
+    ft.service_station_id, ft.product_id,
+    CAST(ft.quantity AS FLOAT), CAST(ft.customer_amount AS FLOAT),
+    CAST(ft.terminal_price AS FLOAT)
+FROM {table}
+WHERE {conditions}
+ORDER BY ft.department_id, ft.date, ft.id
+"""
+
+
+def parse_month(value):
+    """First day of a YYYY-MM month"""
+    year, month = value.split('-')
+    return date(int(year), int(month), 1)
+
+
+def previous_month(today=None):
+    first = (today or date.today()).replace(day=1)
+    return (first - timedelta(days=1)).replace(day=1)
+
+
+def month_end(first):
+    return (first.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+
+
+def slugify(name):
+    return re.sub(r'[^a-z0-9]+', '-', (name or 'unknown').lower()).strip('-') or 'unknown'
+
+
+def fetch_month(first, department_ids=None):
+    """Every transaction of the month as (department_id, name, rows), one entry per department.
+
+    Rows are TransactionRow tuples, decoded once here so the workers need no
+    database connection or dimension cache.
+    """
+    from app import build_conditions, dimension_cache, fetch_rows, get_read_engine, transactions_table
+    from records import decode_transactions
+
+    filters = {'start_date': first.isoformat(), 'end_date': month_end(first).isoformat()}
+    dims = dimension_cache.get(get_read_engine())
+    conditions, params = build_conditions(filters, dims=dims)
+    if department_ids:
+        conditions.append(f"ft.department_id IN ({', '.join(str(int(i)) for i in department_ids)})")
+    query = REPORT_QUERY.format(table=transactions_table(filters, dims), conditions=' AND '.join(conditions))
+
+    departments = []
+    for department_id, records in groupby(fetch_rows(query, params), key=lambda record: record[2]):
+        rows = [row.as_tuple() for row in decode_transactions(records, dims)]
+        departments.append((department_id, dims.department_names.get(department_id), rows))
+    return departments
+
+
+def aggregate(rows):
+    """AggregateRows by department, region and product for TransactionRow tuples"""
+    from records import AggregateRow
+
+    grouped = {}
+    for _, _, department, _, region, product, quantity, revenue, _ in rows:
+        row = grouped.get((department, region, product))
+        if row is None:
+            row = grouped[(department, region, product)] = AggregateRow(department, region, product, 0, 0.0, 0.0)
+        row.transactions += 1
+        row.quantity += quantity or 0.0
+        row.customer_amount += revenue or 0.0
+    return list(grouped.values())
+
+
+def top_vehicles(rows, limit=REPORT_TOP_VEHICLES):
+    """(vehicle, transactions, quantity, amount) for the vehicles that drew the most fuel"""
+    totals = {}
+    for _, vehicle, _, _, _, _, quantity, revenue, _ in rows:
+        if not vehicle:
+            continue
+        count, litres, amount = totals.get(vehicle, (0, 0.0, 0.0))
+        totals[vehicle] = (count + 1, litres + (quantity or 0.0), amount + (revenue or 0.0))
+    ranked = sorted(totals.items(), key=lambda item: item[1][1], reverse=True)[:limit]
+    return [(vehicle, count, litres, amount) for vehicle, (count, litres, amount) in ranked]
+
+
+def chart_specs(aggregates, vehicles):
+    from app import CHART_DEFINITIONS
+    from charts import ChartSpec
+    from records import totals_by
+
+    specs = []
+    for name, title, palette, key, measure, limit in CHART_DEFINITIONS:
+        if key not in REPORT_CHART_KEYS:
+            continue
+        ranked = totals_by(aggregates, key, measure, limit)
+        if ranked:
+            labels, values = zip(*ranked)
+            specs.append(ChartSpec(name, title, labels, values, palette))
+    if vehicles:
+        specs.append(ChartSpec(
+            'vehicle_qty', f'Top {len(vehicles)} Vehicles by Fuel Quantity',
+            [vehicle for vehicle, _, _, _ in vehicles], [litres for _, _, litres, _ in vehicles], 'Oranges_r'
+        ))
+    return specs
+
+
+def write_workbook(path, summary, vehicles, rows):
+    import pandas as pd
+    from records import TRANSACTION_COLUMNS
+
+    with pd.ExcelWriter(path, engine='xlsxwriter') as writer:
+        pd.DataFrame(list(summary.items()), columns=['measure', 'value']).to_excel(
+            writer, index=False, sheet_name='Summary')
+        pd.DataFrame.from_records(vehicles, columns=['vehicle_registration', 'transactions', 'quantity', 'customer_amount']).to_excel(
+            writer, index=False, sheet_name='Top Vehicles')
+        pd.DataFrame.from_records(rows, columns=TRANSACTION_COLUMNS).to_excel(
+            writer, index=False, sheet_name='Transactions')
+
+
+def render_html(template, path, **context):
+    from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+    environment = Environment(loader=FileSystemLoader(TEMPLATE_DIR), autoescape=select_autoescape())
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(environment.get_template(template).render(**context))
+
+
+def write_department_report(month, department_id, department, rows, output_dir):
+    """Build one department's report in a worker; returns (department, folder, summary)"""
+    from app import summarize
+    from charts import render_chart
+
+    # Prefixed with the id: resolved names are unique, raw legacy ones need not be
+    folder = f'{department_id}-{slugify(department)}'
+    target = os.path.join(output_dir, folder)
+    os.makedirs(os.path.join(target, 'charts'), exist_ok=True)
+
+    aggregates = aggregate(rows)
+    summary = summarize(aggregates, len(rows))
+    vehicles = top_vehicles(rows)
+
+    charts = {}
+    for spec in chart_specs(aggregates, vehicles):
+        filename = f'charts/{spec.name}.{spec.format}'
+        with open(os.path.join(target, filename), 'wb') as f:
+            f.write(render_chart(spec))
+        charts[spec.name] = filename
+
+    write_workbook(os.path.join(target, f'fuel_{folder}_{month}.xlsx'), summary, vehicles, rows)
+    render_html(
+        'department_report.html', os.path.join(target, 'index.html'),
+        month=month, department=department, summary=summary, vehicles=vehicles,
+        charts=charts, workbook=f'fuel_{folder}_{month}.xlsx'
+    )
+    return department, folder, summary
+
+
+def generate_reports(first, output_root=REPORT_DIR, workers=REPORT_WORKERS, department_ids=None):
+    """Write every department's report for the month starting ``first``; returns the number written"""
+    from charts import warm_worker
+
+    month = first.strftime('%Y-%m')
+    output_dir = os.path.join(output_root, month)
+    os.makedirs(output_dir, exist_ok=True)
+
+    print(f"⏳ Loading transactions for {month}...")
+    departments = fetch_month(first, department_ids)
+    print(f"📊 Building reports for {len(departments)} departments with {workers} workers...")
+
+    written = []
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=warm_worker) as pool:
+        futures = {
+            pool.submit(
+                write_department_report, month, department_id, name or f'Department {department_id}', rows, output_dir
+            ): name or department_id
+            for department_id, name, rows in departments
+        }
+        for future in as_completed(futures):
+            try:
+                written.append(future.result())
+            except Exception as e:
+                print(f"⚠️ Could not build the report for {futures[future]}: {e}")
+
+    written.sort(key=lambda report: report[0] or '')
+    render_html('reports_index.html', os.path.join(output_dir, 'index.html'), month=month, reports=written)
+    print(f"✅ Wrote {len(written)} department reports to {output_dir}")
+    return len(written)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate the monthly report of every department")
+    parser.add_argument('--month', type=parse_month, default=previous_month(),
+                        help="Month to report as YYYY-MM (default: last month)")
+    parser.add_argument('--output', default=REPORT_DIR,
+                        help="Directory that receives a folder per month")
+    parser.add_argument('--workers', type=int, default=REPORT_WORKERS,
+                        help="Departments rendered in parallel")
+    parser.add_argument('--department', type=int, action='append', dest='department_ids', metavar='ID',
+                        help="Only report this department id; may be repeated")
+    args = parser.parse_args()
+    generate_reports(args.month, args.output, args.workers, args.department_ids)
+
+
+if __name__ == "__main__":
+    main()
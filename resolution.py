@@ -0,0 +1,144 @@
+"""Entity resolution for department and service station names.
+
+Names are reduced to a key of their distinctive tokens: uppercased,
+punctuation removed, abbreviations expanded and generic words such as
+SERVICE STATION dropped, so "Kisumu Stn", "KISUMU STATION" and
+"Kisumu  Station." share the key ``KISUMU``. Brand words stay in the key:
+"Shell Kabati" and "Kabati" are different stations of different providers. Names whose keys differ are
+compared by edit distance, but only against candidates that share a token
+or a token prefix with them (blocking), which keeps a batch far from
+quadratic. Only the tokens two keys do not share are compared, so
+"MAKUYU INBOUND" does not match "KIKUYU INBOUND" on the strength of the
+common word.
+"""
+import os
+import re
+from collections import defaultdict
+
+RESOLUTION_THRESHOLD = float(os.getenv("RESOLUTION_THRESHOLD", 0.85))
+MAX_BLOCK_SIZE = 50  # tokens shared by more names than this are too common to block on
+PREFIX_LENGTH = 3
+
+ABBREVIATIONS = {
+    'STN': 'STATION', 'STA': 'STATION', 'SVC': 'SERVICE', 'SERV': 'SERVICE',
+    'DEPT': 'DEPARTMENT', 'DEP': 'DEPARTMENT', 'RD': 'ROAD', 'JUNC': 'JUNCTION',
+    'JCT': 'JUNCTION', 'MAINT': 'MAINTENANCE', 'MGMT': 'MANAGEMENT', 'ADMN': 'ADMIN',
+    'TOTALENERGIES': 'TOTAL',
+}
+
+# Words that do not tell two stations or departments apart. Brands such as
+# SHELL, TOTAL or RUBIS do, and are kept
+GENERIC_TOKENS = {
+    'SERVICE', 'STATION', 'FILLING', 'PETROL', 'ENERGY', 'ENERGIES', 'DEPARTMENT', 'THE', 'AND', 'OF',
+}
+
+
+def name_tokens(name):
+    text = re.sub(r'[^\w\s]', ' ', str(name)).upper()
+    return [ABBREVIATIONS.get(token, token) for token in text.split()]
+
+
+def name_key(name):
+    """Distinctive tokens of a name in a fixed order; names with the same key are the same entity"""
+    tokens = name_tokens(name)
+    distinctive = [token for token in tokens if token not in GENERIC_TOKENS]
+    return ' '.join(sorted(set(distinctive or tokens)))
+
+
+def key_similarity(a, b, minimum=0.0):
+    """Similarity of two name keys, judged on the tokens they do not share.
+
+    An extra distinctive token on one side (KISII vs KISII EXIT) means a
+    different entity; otherwise the differing tokens must be near-identical.
+    """
+    tokens_a, tokens_b = set(a.split()), set(b.split())
+    rest_a, rest_b = tokens_a - tokens_b, tokens_b - tokens_a
+    if not rest_a and not rest_b:
+        return 1.0
+    if not rest_a or not rest_b:
+        return 0.0
+    return similarity(' '.join(sorted(rest_a)), ' '.join(sorted(rest_b)), minimum)
+
+
+def similarity(a, b, minimum=0.0):
+    """Levenshtein similarity in [0, 1]; 0.0 as soon as it cannot reach ``minimum``"""
+    if a == b:
+        return 1.0
+    if not a or not b:
+        return 0.0
+    if len(a) < len(b):
+        a, b = b, a
+    budget = int((1.0 - minimum) * len(a))  # most edits that still score ``minimum``
+    if len(a) - len(b) > budget:
+        return 0.0
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, start=1):
+        current = [i]
+        for j, cb in enumerate(b, start=1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > budget:
+            return 0.0
+        previous = current
+    return 1.0 - previous[-1] / len(a)
+
+
+class NameIndex:
+    """Known entities by name key, with token and prefix blocks for fuzzy lookups"""
+
+    def __init__(self):
+        self.by_key = {}
+        self.keys = []
+        self.ids = []
+        self.blocks = defaultdict(list)
+
+    def add(self, entity_id, name):
+        key = name_key(name)
+        if not key or key in self.by_key:
+            return
+        self.by_key[key] = entity_id
+        position = len(self.keys)
+        self.keys.append(key)
+        self.ids.append(entity_id)
+        for block in self._block_keys(key):
+            self.blocks[block].append(position)
+
+    @staticmethod
+    def _block_keys(key):
+        tokens = key.split()
+        return {f"T:{token}" for token in tokens} | {f"P:{token[:PREFIX_LENGTH]}" for token in tokens}
+
+    def match(self, name):
+        """Best known entity for ``name``: (entity_id, score), or (None, 0.0) below the threshold"""
+        key = name_key(name)
+        if not key:
+            return None, 0.0
+        if key in self.by_key:
+            return self.by_key[key], 1.0
+
+        blocks = [self.blocks[block] for block in self._block_keys(key) if block in self.blocks]
+        usable = [block for block in blocks if len(block) <= MAX_BLOCK_SIZE]
+        if not usable and blocks:
+            usable = [min(blocks, key=len)]
+        candidates = {position for block in usable for position in block}
+
+        best_id, best_score = None, 0.0
+        for position in candidates:
+            score = key_similarity(key, self.keys[position], max(best_score, RESOLUTION_THRESHOLD))
+            if score > best_score:
+                best_id, best_score = self.ids[position], score
+        if best_score >= RESOLUTION_THRESHOLD:
+            return best_id, best_score
+        return None, 0.0
+
+
+def cluster_names(names):
+    """Group unresolved names into entities; returns {name: representative name}"""
+    index = NameIndex()
+    representatives = {}
+    for name in sorted(names):
+        match, _ = index.match(name)
+        if match is None:
+            index.add(name, name)
+            match = name
+        representatives[name] = match
+    return representatives
@@ -3,11 +3,21 @@ import pyodbc
 import os
 from dotenv import load_dotenv
 from time import time
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
-import decimal
+from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type, retry_if_exception
+from concurrent.futures import ThreadPoolExecutor
+import tracemalloc
+from contextlib import contextmanager
 import numpy as np
 import warnings
 import re
+import argparse
+import hashlib
+import json
+from datetime import date
+import snapshot
+import sketches
+import quality
+import resolution
 
 # Suppress warnings
 warnings.filterwarnings('ignore')
@@ -16,8 +26,60 @@ warnings.filterwarnings('ignore')
 load_dotenv()
 CHUNK_SIZE = 400
 RETRY_ATTEMPTS = 5
+LOAD_CONNECTIONS = int(os.getenv("LOAD_CONNECTIONS", 4))
+DEADLOCK_ERROR = 1205
+LOCK_TIMEOUT_ERROR = 1222
 MAX_STRING_LENGTH = 255
 MAX_DECIMAL_PRECISION = 10
+SOURCE_FILE = "main.xlsx"
+PARTITION_BY_MONTH = os.getenv("PARTITION_BY_MONTH", "false").lower() == "true"
+PARTITION_START = date.fromisoformat(os.getenv("PARTITION_START", "2020-01-01"))
+PARTITION_MONTHS_AHEAD = 12
+PARTITION_FUNCTION = "pf_fuel_month"
+PARTITION_SCHEME = "ps_fuel_month"
+SWITCH_TABLE = "fuel_transactions_switch"
+
+TRANSACTION_INDEXES = [
+    ('idx_vehicle_reg', 'vehicle_registration'),
+    ('idx_department_id', 'department_id'),
+    ('idx_service_station_id', 'service_station_id'),
+    ('idx_date', 'date'),
+    ('idx_product_id', 'product_id')
+]
+
+# Repeated text columns stored as small-int keys into their own dimension
+# tables: name column -> dimension table, with the key in <name column>_id
+DICTIONARY_COLUMNS = {
+    'product': 'products',
+    'truck_model': 'truck_models',
+    'service_provider': 'service_providers',
+}
+# Text columns the narrow layout no longer keeps on fuel_transactions; the
+# region is read from service_stations
+LEGACY_TEXT_COLUMNS = ('product', 'truck_model', 'service_provider', 'region')
+TABLE_COMPRESSION = os.getenv("TABLE_COMPRESSION", "PAGE")  # PAGE, ROW or NONE
+MIGRATION_BATCH_ROWS = 200000
+
+# Load journal columns added after ingest_loads was first created
+INGEST_LOAD_COLUMNS = (
+    ('accepted_rows', 'INT'),
+    ('accepted_hash', 'CHAR(64)'),
+    ('reference_date', 'DATE'),
+    ('first_source_row', 'INT'),
+    ('source_rows', 'INT'),
+)
+
+# Cold history lives in a clustered columnstore table; the view is the one
+# logical table over both
+ARCHIVE_TABLE = "fuel_transactions_archive"
+ALL_TRANSACTIONS_VIEW = "fuel_transactions_all"
+ARCHIVE_AFTER_MONTHS = int(os.getenv("ARCHIVE_AFTER_MONTHS", 6))
+ARCHIVE_BATCH_ROWS = 1048576  # one full columnstore rowgroup
+TRANSACTION_COLUMNS = [
+    'id', 'date', 'time', 'vehicle_registration', 'department_id', 'truck_model_id',
+    'service_provider_id', 'service_station_id', 'product_id', 'quantity',
+    'full_tank_capacity', 'terminal_price', 'customer_amount'
+]
 
 DB_CONFIG = {
     'driver': os.getenv("DB_DRIVER", "ODBC Driver 17 for SQL Server"),
@@ -52,30 +114,35 @@ def connect_to_sql():
     conn_str = get_connection_string(DB_CONFIG)
     return pyodbc.connect(conn_str)
 
-def validate_and_convert_value(value, col_type):
-    if pd.isna(value) or value is None:
-        return None
-    
-    try:
-        if col_type == 'string':
-            str_val = str(value).strip()[:MAX_STRING_LENGTH]
-            return str_val if str_val else None
-        elif col_type == 'decimal':
-            str_val = f"{float(value):.{MAX_DECIMAL_PRECISION-2}f}"
-            return decimal.Decimal(str_val).quantize(
-                decimal.Decimal(f"1.{'0' * (MAX_DECIMAL_PRECISION-2)}"),
-                rounding=decimal.ROUND_HALF_UP
-            )
-        elif col_type == 'date':
-            dt = pd.to_datetime(value, errors='coerce')
-            return dt.date() if pd.notna(dt) else None
-        elif col_type == 'time':
-            dt = pd.to_datetime(value, errors='coerce')
-            return dt.time() if pd.notna(dt) else None
-        else:
-            return str(value)[:MAX_STRING_LENGTH] if value else None
-    except (ValueError, TypeError, decimal.InvalidOperation):
-        return None
+# Repeated names are stored once per frame as categoricals
+CATEGORY_COLUMNS = {'department', 'service_station', 'product', 'service_provider', 'truck_model', 'region'}
+
+def convert_column(values, col_type, name):
+    """Convert one raw workbook column to its compact dtype; missing values become NA"""
+    if col_type == 'string':
+        text = values.astype('string').str.strip().str.slice(0, MAX_STRING_LENGTH)
+        text = text.mask(text == '')
+        return text.astype('category') if name in CATEGORY_COLUMNS else text
+    if col_type == 'decimal':
+        return pd.to_numeric(values, errors='coerce').astype('float64')
+    if col_type == 'date':
+        # Text dates may mix formats; each value is parsed on its own like the time column
+        return pd.to_datetime(values, format='mixed', errors='coerce').dt.normalize()
+    if col_type == 'time':
+        # Time of day as an offset from midnight
+        times = pd.to_datetime(values.astype('string'), format='mixed', errors='coerce')
+        return times - times.dt.normalize()
+    return values.astype('string').str.slice(0, MAX_STRING_LENGTH)
+
+def column_values(series):
+    """Python values of a column for the driver, with None for missing values"""
+    if pd.api.types.is_datetime64_any_dtype(series):
+        values = series.dt.date
+    elif pd.api.types.is_timedelta64_dtype(series):
+        values = (pd.Timestamp(0) + series).dt.time
+    else:
+        values = series.astype(object)
+    return values.where(series.notna(), None).tolist()
 
 def prepare_data(df):
     df.columns = df.columns.str.strip().str.lower().str.replace(" ", "_").str.replace(r"[()]", "", regex=True)
@@ -96,26 +163,47 @@ def prepare_data(df):
         "region": ("region", 'string')
     }
     
-    processed_df = pd.DataFrame()
+    # Columns are converted one at a time and the raw column dropped, so
+    # only one raw column is alive next to the compact frame
+    processed = {}
     for old_name, (new_name, col_type) in column_specs.items():
         if old_name in df.columns:
-            processed_df[new_name] = df[old_name].apply(lambda x: validate_and_convert_value(x, col_type))
+            processed[new_name] = convert_column(df.pop(old_name), col_type, new_name)
         else:
             print(f"⚠️ Column '{old_name}' not found in DataFrame")
+    processed_df = pd.DataFrame(processed, copy=False)
     
     # Data quality checks
     if 'department' in processed_df.columns:
         null_depts = processed_df['department'].isna().sum()
         if null_depts > 0:
-            print(f"⚠️ Warning: {null_depts} null department values after processing")
-        empty_depts = processed_df['department'].apply(lambda x: x is not None and str(x).strip() == '').sum()
-        if empty_depts > 0:
-            print(f"⚠️ Warning: {empty_depts} empty department strings after processing")
+            print(f"⚠️ Warning: {null_depts} null or empty department values after processing")
     
-    return processed_df.replace({np.nan: None})
+    return processed_df
+
+@contextmanager
+def memory_phase(report, name):
+    """Record the traced memory at the end of a phase and its peak, when tracing"""
+    if not tracemalloc.is_tracing():
+        yield
+        return
+    tracemalloc.reset_peak()
+    try:
+        yield
+    finally:
+        current, peak = tracemalloc.get_traced_memory()
+        report.append((name, current, peak))
+
+def print_memory_report(report):
+    if not report:
+        return
+    print("\nMemory by phase (MiB):")
+    print(f"{'phase':<28}{'retained':>10}{'peak':>10}")
+    for name, current, peak in report:
+        print(f"{name:<28}{current / 2**20:>10.1f}{peak / 2**20:>10.1f}")
 
 def create_tables(cursor, conn):
-    cursor.execute("""
+    cursor.execute(f"""
     IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='departments' AND xtype='U')
         CREATE TABLE departments (
             id INT IDENTITY(1,1) PRIMARY KEY,
@@ -129,6 +217,24 @@ def create_tables(cursor, conn):
             region NVARCHAR(255)
         );
     
+    IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='products' AND xtype='U')
+        CREATE TABLE products (
+            id SMALLINT IDENTITY(1,1) PRIMARY KEY,
+            name NVARCHAR(255) UNIQUE NOT NULL
+        );
+    
+    IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='truck_models' AND xtype='U')
+        CREATE TABLE truck_models (
+            id SMALLINT IDENTITY(1,1) PRIMARY KEY,
+            name NVARCHAR(255) UNIQUE NOT NULL
+        );
+    
+    IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='service_providers' AND xtype='U')
+        CREATE TABLE service_providers (
+            id SMALLINT IDENTITY(1,1) PRIMARY KEY,
+            name NVARCHAR(255) UNIQUE NOT NULL
+        );
+    
     IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='fuel_transactions' AND xtype='U')
         CREATE TABLE fuel_transactions (
             id INT IDENTITY(1,1) PRIMARY KEY,
@@ -136,38 +242,444 @@ def create_tables(cursor, conn):
             time TIME,
             vehicle_registration NVARCHAR(255),
             department_id INT FOREIGN KEY REFERENCES departments(id),
+            truck_model_id SMALLINT FOREIGN KEY REFERENCES truck_models(id),
+            service_provider_id SMALLINT FOREIGN KEY REFERENCES service_providers(id),
+            service_station_id INT FOREIGN KEY REFERENCES service_stations(id),
+            product_id SMALLINT FOREIGN KEY REFERENCES products(id),
+            quantity DECIMAL(10,2),
+            full_tank_capacity DECIMAL(10,2),
+            terminal_price DECIMAL(10,2),
+            customer_amount DECIMAL(12,2)
+        ) WITH (DATA_COMPRESSION = {TABLE_COMPRESSION});
+    
+    IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='ingest_watermarks' AND xtype='U')
+        CREATE TABLE ingest_watermarks (
+            id INT IDENTITY(1,1) PRIMARY KEY,
+            source NVARCHAR(255),
+            max_transaction_id INT,
+            rows_loaded INT,
+            loaded_at DATETIME2 DEFAULT SYSUTCDATETIME()
+        );
+    
+    IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='data_versions' AND xtype='U')
+        CREATE TABLE data_versions (
+            id INT IDENTITY(1,1) PRIMARY KEY,
+            max_transaction_id INT NOT NULL,
+            first_date DATE,
+            last_date DATE,
+            department_ids NVARCHAR(MAX),
+            published_at DATETIME2 DEFAULT SYSUTCDATETIME()
+        );
+    
+    IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='name_aliases' AND xtype='U')
+        CREATE TABLE name_aliases (
+            entity_table NVARCHAR(50) NOT NULL,
+            alias NVARCHAR(255) NOT NULL,
+            canonical_id INT NOT NULL,
+            score FLOAT,
+            created_at DATETIME2 DEFAULT SYSUTCDATETIME(),
+            PRIMARY KEY (entity_table, alias)
+        );
+    
+    IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='fuel_transactions_rejected' AND xtype='U')
+        CREATE TABLE fuel_transactions_rejected (
+            id INT IDENTITY(1,1) PRIMARY KEY,
+            load_id INT,
+            reason_codes NVARCHAR(255) NOT NULL,
+            date DATE,
+            time TIME,
+            vehicle_registration NVARCHAR(255),
+            department NVARCHAR(255),
             truck_model NVARCHAR(255),
             service_provider NVARCHAR(255),
-            service_station_id INT FOREIGN KEY REFERENCES service_stations(id),
+            service_station NVARCHAR(255),
             product NVARCHAR(255),
             quantity DECIMAL(10,2),
             full_tank_capacity DECIMAL(10,2),
             terminal_price DECIMAL(10,2),
             customer_amount DECIMAL(12,2),
-            region NVARCHAR(255)
+            region NVARCHAR(255),
+            rejected_at DATETIME2 DEFAULT SYSUTCDATETIME()
+        );
+    
+    IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='ingest_loads' AND xtype='U')
+        CREATE TABLE ingest_loads (
+            id INT IDENTITY(1,1) PRIMARY KEY,
+            source NVARCHAR(255),
+            checksum CHAR(64),
+            total_rows INT,
+            chunk_size INT,
+            accepted_rows INT,
+            accepted_hash CHAR(64),
+            reference_date DATE,
+            first_source_row INT,
+            source_rows INT,
+            status NVARCHAR(20) DEFAULT 'running',
+            started_at DATETIME2 DEFAULT SYSUTCDATETIME(),
+            finished_at DATETIME2 NULL
+        );
+    
+    IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='ingest_load_chunks' AND xtype='U')
+        CREATE TABLE ingest_load_chunks (
+            load_id INT NOT NULL FOREIGN KEY REFERENCES ingest_loads(id),
+            chunk_index INT NOT NULL,
+            first_row INT,
+            last_row INT,
+            rows_committed INT,
+            committed_at DATETIME2 DEFAULT SYSUTCDATETIME(),
+            PRIMARY KEY (load_id, chunk_index)
+        );
+    
+    IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='{ARCHIVE_TABLE}' AND xtype='U')
+    BEGIN
+        CREATE TABLE {ARCHIVE_TABLE} (
+            id INT NOT NULL,
+            date DATE,
+            time TIME,
+            vehicle_registration NVARCHAR(255),
+            department_id INT,
+            truck_model_id SMALLINT,
+            service_provider_id SMALLINT,
+            service_station_id INT,
+            product_id SMALLINT,
+            quantity DECIMAL(10,2),
+            full_tank_capacity DECIMAL(10,2),
+            terminal_price DECIMAL(10,2),
+            customer_amount DECIMAL(12,2)
+        );
+        CREATE CLUSTERED COLUMNSTORE INDEX cci_{ARCHIVE_TABLE} ON {ARCHIVE_TABLE};
+    END
+
+    IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='archive_runs' AND xtype='U')
+        CREATE TABLE archive_runs (
+            id INT IDENTITY(1,1) PRIMARY KEY,
+            cutoff DATE NOT NULL,
+            rows_moved INT,
+            moved_at DATETIME2 DEFAULT SYSUTCDATETIME()
+        );
+
+    IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='vehicle_sketches' AND xtype='U')
+        CREATE TABLE vehicle_sketches (
+            date DATE NOT NULL,
+            department_id INT NOT NULL,
+            service_station_id INT NOT NULL,
+            registers VARBINARY(MAX) NOT NULL,
+            PRIMARY KEY (date, department_id, service_station_id)
         );
     """)
 
-    indexes = [
-        ('idx_vehicle_reg', 'vehicle_registration'),
-        ('idx_department_id', 'department_id'),
-        ('idx_service_station_id', 'service_station_id'),
-        ('idx_date', 'date'),
-        ('idx_product', 'product')
-    ]
+    conn.commit()
     
-    for idx_name, col in indexes:
+    # Journals created before these columns existed
+    journal_columns = table_columns(cursor, 'ingest_loads')
+    for column, definition in INGEST_LOAD_COLUMNS:
+        if column not in journal_columns:
+            cursor.execute(f"ALTER TABLE ingest_loads ADD {column} {definition} NULL")
+    conn.commit()
+    
+    migrate_to_narrow_layout(cursor, conn)
+    
+    # Created after the migration so the view selects the narrow columns
+    columns = ', '.join(TRANSACTION_COLUMNS)
+    cursor.execute(f"""
+    CREATE OR ALTER VIEW {ALL_TRANSACTIONS_VIEW} AS
+    SELECT {columns} FROM fuel_transactions
+    UNION ALL
+    SELECT {columns} FROM {ARCHIVE_TABLE}
+    """)
+    conn.commit()
+    
+    if PARTITION_BY_MONTH:
+        migrate_to_partitioned(cursor, conn)
+    
+    # Partitioned tables keep their secondary indexes aligned so months can be switched out
+    storage = f" ON {PARTITION_SCHEME}(date)" if is_partitioned(cursor) else ""
+    for idx_name, col in TRANSACTION_INDEXES:
         cursor.execute(f"""
         IF NOT EXISTS (
             SELECT * FROM sys.indexes 
             WHERE name=? AND object_id = OBJECT_ID('fuel_transactions')
         )
         CREATE INDEX {idx_name} ON fuel_transactions({col})
+        WITH (DATA_COMPRESSION = {TABLE_COMPRESSION}){storage}
         """, idx_name)
     
     conn.commit()
     print("✅ Tables and indexes created successfully")
 
+def month_starts(first, last):
+    """First day of every month from first's month through last's month"""
+    current = first.replace(day=1)
+    months = []
+    while current <= last:
+        months.append(current)
+        current = date(current.year + current.month // 12, current.month % 12 + 1, 1)
+    return months
+
+def add_months(day, months):
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+def is_partitioned(cursor):
+    cursor.execute("""
+    SELECT COUNT(*) FROM sys.indexes i
+    JOIN sys.partition_schemes ps ON i.data_space_id = ps.data_space_id
+    WHERE i.object_id = OBJECT_ID('fuel_transactions') AND i.index_id IN (0, 1)
+    """)
+    return cursor.fetchone()[0] > 0
+
+def get_partition_boundaries(cursor):
+    cursor.execute("""
+    SELECT CAST(v.value AS DATE)
+    FROM sys.partition_range_values v
+    JOIN sys.partition_functions f ON v.function_id = f.function_id
+    WHERE f.name = ?
+    """, PARTITION_FUNCTION)
+    return {row[0] for row in cursor.fetchall()}
+
+def ensure_partition_scheme(cursor):
+    """Create the monthly partition function and scheme if they are missing"""
+    cursor.execute("SELECT COUNT(*) FROM sys.partition_functions WHERE name = ?", PARTITION_FUNCTION)
+    if cursor.fetchone()[0] == 0:
+        last = add_months(date.today(), PARTITION_MONTHS_AHEAD)
+        boundaries = ", ".join(f"'{m.isoformat()}'" for m in month_starts(PARTITION_START, last))
+        cursor.execute(f"""
+        CREATE PARTITION FUNCTION {PARTITION_FUNCTION} (DATE)
+        AS RANGE RIGHT FOR VALUES ({boundaries})
+        """)
+        print(f"✅ Created partition function {PARTITION_FUNCTION}")
+    
+    cursor.execute("SELECT COUNT(*) FROM sys.partition_schemes WHERE name = ?", PARTITION_SCHEME)
+    if cursor.fetchone()[0] == 0:
+        cursor.execute(f"CREATE PARTITION SCHEME {PARTITION_SCHEME} AS PARTITION {PARTITION_FUNCTION} ALL TO ([PRIMARY])")
+        print(f"✅ Created partition scheme {PARTITION_SCHEME}")
+
+def ensure_partitions(cursor, first, last):
+    """Split in monthly boundaries so every month in [first, last] has its own partition"""
+    existing = get_partition_boundaries(cursor)
+    missing = [m for m in month_starts(first, last) if m not in existing]
+    for month in missing:
+        cursor.execute(f"ALTER PARTITION SCHEME {PARTITION_SCHEME} NEXT USED [PRIMARY]")
+        cursor.execute(f"ALTER PARTITION FUNCTION {PARTITION_FUNCTION}() SPLIT RANGE ('{month.isoformat()}')")
+    if missing:
+        cursor.connection.commit()
+        print(f"✅ Added {len(missing)} monthly partitions")
+
+def table_columns(cursor, table):
+    cursor.execute("SELECT name FROM sys.columns WHERE object_id = OBJECT_ID(?)", table)
+    return {row[0] for row in cursor.fetchall()}
+
+def migrate_to_narrow_layout(cursor, conn):
+    """Replace the repeated text columns of fuel_transactions by dimension keys.
+
+    Distinct product, truck model and service provider names are copied
+    into their dimension tables and the key columns are filled in id ranges
+    of MIGRATION_BATCH_ROWS, so the log stays bounded and an interrupted
+    run can simply be repeated. The text columns and the region copy are
+    then dropped, and the rebuild with TABLE_COMPRESSION reclaims their space.
+    """
+    columns = table_columns(cursor, 'fuel_transactions')
+    legacy = [column for column in LEGACY_TEXT_COLUMNS if column in columns]
+    if not legacy:
+        return
+
+    print("⏳ Migrating fuel_transactions to dictionary-encoded columns...")
+    present = [column for column in DICTIONARY_COLUMNS if column in columns]
+    for column, table in DICTIONARY_COLUMNS.items():
+        if f"{column}_id" not in columns:
+            cursor.execute(
+                f"ALTER TABLE fuel_transactions ADD {column}_id SMALLINT NULL FOREIGN KEY REFERENCES {table}(id)"
+            )
+    for column in present:
+        table = DICTIONARY_COLUMNS[column]
+        cursor.execute(f"""
+        INSERT INTO {table} (name)
+        SELECT DISTINCT LTRIM(RTRIM(ft.{column})) FROM fuel_transactions ft
+        WHERE NULLIF(LTRIM(RTRIM(ft.{column})), '') IS NOT NULL
+          AND NOT EXISTS (SELECT 1 FROM {table} d WHERE d.name = LTRIM(RTRIM(ft.{column})))
+        """)
+    conn.commit()
+
+    cursor.execute("SELECT MIN(id), MAX(id) FROM fuel_transactions")
+    low, high = cursor.fetchone()
+    if present and low is not None:
+        assignments = ", ".join(f"{column}_id = d{i}.id" for i, column in enumerate(present))
+        joins = "".join(
+            f" LEFT JOIN {DICTIONARY_COLUMNS[column]} d{i} ON d{i}.name = LTRIM(RTRIM(ft.{column}))"
+            for i, column in enumerate(present)
+        )
+        for start in range(low, high + 1, MIGRATION_BATCH_ROWS):
+            cursor.execute(
+                f"UPDATE ft SET {assignments} FROM fuel_transactions ft{joins} WHERE ft.id BETWEEN ? AND ?",
+                start, start + MIGRATION_BATCH_ROWS - 1
+            )
+            conn.commit()
+            print(f"  keys filled up to id {min(start + MIGRATION_BATCH_ROWS - 1, high)} of {high}")
+
+    # Indexes on the text columns have to go before the columns can
+    placeholders = ','.join(['?'] * len(legacy))
+    cursor.execute(f"""
+    SELECT DISTINCT i.name FROM sys.indexes i
+    JOIN sys.index_columns ic ON ic.object_id = i.object_id AND ic.index_id = i.index_id
+    JOIN sys.columns c ON c.object_id = ic.object_id AND c.column_id = ic.column_id
+    WHERE i.object_id = OBJECT_ID('fuel_transactions') AND c.name IN ({placeholders})
+    """, legacy)
+    for (index_name,) in cursor.fetchall():
+        cursor.execute(f"DROP INDEX {index_name} ON fuel_transactions")
+    cursor.execute(f"ALTER TABLE fuel_transactions DROP COLUMN {', '.join(legacy)}")
+    conn.commit()
+
+    print(f"⏳ Rebuilding fuel_transactions with {TABLE_COMPRESSION} compression...")
+    cursor.execute(
+        f"ALTER INDEX ALL ON fuel_transactions REBUILD PARTITION = ALL WITH (DATA_COMPRESSION = {TABLE_COMPRESSION})"
+    )
+    conn.commit()
+    print(f"✅ fuel_transactions now stores {', '.join(present)} as keys and no longer copies region")
+
+def migrate_to_partitioned(cursor, conn):
+    """Rebuild fuel_transactions on the monthly partition scheme.
+
+    The clustered primary key on id is replaced by a clustered index on
+    (date, id) and a unique index on (id, date), and the secondary indexes
+    are rebuilt aligned with the scheme. Existing data moves in place.
+    """
+    ensure_partition_scheme(cursor)
+    conn.commit()
+    if is_partitioned(cursor):
+        return
+    
+    print("⏳ Converting fuel_transactions to monthly partitions...")
+    cursor.execute("SELECT MIN(date), MAX(date) FROM fuel_transactions")
+    first, last = cursor.fetchone()
+    if first and last:
+        ensure_partitions(cursor, first, last)
+    
+    cursor.execute("""
+    SELECT name FROM sys.key_constraints
+    WHERE parent_object_id = OBJECT_ID('fuel_transactions') AND type = 'PK'
+    """)
+    pk = cursor.fetchone()
+    if pk:
+        cursor.execute(f"ALTER TABLE fuel_transactions DROP CONSTRAINT {pk[0]}")
+    
+    cursor.execute(f"""
+    CREATE CLUSTERED INDEX cix_fuel_transactions_date
+    ON fuel_transactions(date, id)
+    WITH (DATA_COMPRESSION = {TABLE_COMPRESSION}) ON {PARTITION_SCHEME}(date)
+    """)
+    cursor.execute(f"""
+    CREATE UNIQUE INDEX ux_fuel_transactions_id
+    ON fuel_transactions(id, date)
+    WITH (DATA_COMPRESSION = {TABLE_COMPRESSION}) ON {PARTITION_SCHEME}(date)
+    """)
+    
+    for idx_name, col in TRANSACTION_INDEXES:
+        cursor.execute(f"""
+        IF EXISTS (
+            SELECT * FROM sys.indexes
+            WHERE name=? AND object_id = OBJECT_ID('fuel_transactions')
+        )
+        CREATE INDEX {idx_name} ON fuel_transactions({col})
+        WITH (DROP_EXISTING = ON, DATA_COMPRESSION = {TABLE_COMPRESSION}) ON {PARTITION_SCHEME}(date)
+        """, idx_name)
+    
+    conn.commit()
+    print("✅ fuel_transactions is now partitioned by month")
+
+def switch_out_month(cursor, conn, month):
+    """Move one month out of fuel_transactions into the switch table.
+
+    Switching is a metadata-only operation, so archiving or dropping an old
+    month does not scan or log its rows. Returns the number of rows moved.
+    """
+    month = month.replace(day=1)
+    if month not in get_partition_boundaries(cursor):
+        raise ValueError(f"No partition starts at {month.isoformat()}")
+    
+    cursor.execute(f"""
+    IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='{SWITCH_TABLE}' AND xtype='U')
+    BEGIN
+        CREATE TABLE {SWITCH_TABLE} (
+            id INT NOT NULL,
+            date DATE,
+            time TIME,
+            vehicle_registration NVARCHAR(255),
+            department_id INT,
+            truck_model_id SMALLINT,
+            service_provider_id SMALLINT,
+            service_station_id INT,
+            product_id SMALLINT,
+            quantity DECIMAL(10,2),
+            full_tank_capacity DECIMAL(10,2),
+            terminal_price DECIMAL(10,2),
+            customer_amount DECIMAL(12,2)
+        );
+        CREATE CLUSTERED INDEX cix_{SWITCH_TABLE}_date ON {SWITCH_TABLE}(date, id)
+        WITH (DATA_COMPRESSION = {TABLE_COMPRESSION});
+        CREATE UNIQUE INDEX ux_{SWITCH_TABLE}_id ON {SWITCH_TABLE}(id, date)
+        WITH (DATA_COMPRESSION = {TABLE_COMPRESSION});
+    END
+    """)
+    for idx_name, col in TRANSACTION_INDEXES:
+        cursor.execute(f"""
+        IF NOT EXISTS (
+            SELECT * FROM sys.indexes
+            WHERE name=? AND object_id = OBJECT_ID('{SWITCH_TABLE}')
+        )
+        CREATE INDEX {idx_name} ON {SWITCH_TABLE}({col})
+        WITH (DATA_COMPRESSION = {TABLE_COMPRESSION})
+        """, idx_name)
+    
+    cursor.execute(f"SELECT COUNT(*) FROM {SWITCH_TABLE}")
+    if cursor.fetchone()[0] > 0:
+        raise RuntimeError(f"{SWITCH_TABLE} is not empty; archive or truncate it first")
+    
+    cursor.execute(
+        f"SELECT COUNT(*) FROM fuel_transactions WHERE $PARTITION.{PARTITION_FUNCTION}(date) = $PARTITION.{PARTITION_FUNCTION}(?)",
+        month
+    )
+    rows = cursor.fetchone()[0]
+    cursor.execute(f"""
+    ALTER TABLE fuel_transactions
+    SWITCH PARTITION $PARTITION.{PARTITION_FUNCTION}('{month.isoformat()}') TO {SWITCH_TABLE}
+    """)
+    conn.commit()
+    print(f"✅ Switched {rows} rows for {month:%Y-%m} out to {SWITCH_TABLE}")
+    return rows
+
+def archive_cold_transactions(cursor, conn, months=ARCHIVE_AFTER_MONTHS):
+    """Move transactions dated before the horizon into the columnstore archive.
+
+    The horizon is the first day of the month ``months`` months ago. Rows
+    move in id ranges of one rowgroup, each copied and deleted in a single
+    transaction, so readers of the view never see a row twice or not at
+    all and a stopped run can be repeated. Returns the number of rows moved.
+    """
+    cutoff = add_months(date.today(), -months)
+    cursor.execute("SELECT MIN(id), MAX(id) FROM fuel_transactions WHERE date < ?", cutoff)
+    low, high = cursor.fetchone()
+    moved = 0
+    if low is not None:
+        print(f"⏳ Archiving transactions dated before {cutoff.isoformat()}...")
+        columns = ', '.join(TRANSACTION_COLUMNS)
+        for start in range(low, high + 1, ARCHIVE_BATCH_ROWS):
+            end = start + ARCHIVE_BATCH_ROWS - 1
+            cursor.execute(f"""
+            INSERT INTO {ARCHIVE_TABLE} WITH (TABLOCK) ({columns})
+            SELECT {columns} FROM fuel_transactions WHERE date < ? AND id BETWEEN ? AND ?
+            """, cutoff, start, end)
+            cursor.execute("DELETE FROM fuel_transactions WHERE date < ? AND id BETWEEN ? AND ?", cutoff, start, end)
+            moved += cursor.rowcount
+            conn.commit()
+            print(f"  moved {moved} rows (ids up to {min(end, high)})")
+
+    # The cutoff is recorded even when nothing moved: from that date on the
+    # dashboard reads the hot table alone
+    cursor.execute("INSERT INTO archive_runs (cutoff, rows_moved) VALUES (?, ?)", cutoff, moved)
+    conn.commit()
+    print(f"✅ Archived {moved} transactions dated before {cutoff.isoformat()} to {ARCHIVE_TABLE}")
+    return moved
+
 def normalize_name(name):
     """Normalize a name by removing extra spaces and special characters."""
     if pd.isna(name) or name is None:
@@ -209,8 +721,8 @@ def get_or_create_name_ids_bulk(cursor, names, table, region_map=None):
     print(f"Sample names (original): {list(name_mapping.values())[:5]}")
     print(f"Sample names (normalized): {list(name_mapping.keys())[:5]}")
     
-    # Check existing records using original names
-    params = [name_mapping[norm_name] for norm_name in name_mapping]
+    # Check existing records under every original spelling
+    params = list(original_names)
     placeholders = ','.join(['?'] * len(params))
     existing = {}
     if params:
@@ -219,13 +731,13 @@ def get_or_create_name_ids_bulk(cursor, names, table, region_map=None):
                 f"SELECT id, name FROM {table} WHERE name IN ({placeholders})",
                 params
             )
-            existing = {name: id_ for id_, name in cursor.fetchall()}
+            existing = {normalize_name(name): id_ for id_, name in cursor.fetchall()}
             print(f"Found {len(existing)} existing {table} records")
         except pyodbc.Error as e:
             print(f"Error checking existing {table} records: {e}")
             raise
     
-    new_names = [norm_name for norm_name in name_mapping if name_mapping[norm_name] not in existing]
+    new_names = [norm_name for norm_name in name_mapping if norm_name not in existing]
     print(f"Found {len(new_names)} new {table} names to insert: {[name_mapping[n] for n in new_names[:10]]}")
     
     if new_names:
@@ -261,17 +773,18 @@ def get_or_create_name_ids_bulk(cursor, names, table, region_map=None):
                 f"SELECT id, name FROM {table} WHERE name IN ({placeholders})",
                 params
             )
-            existing = {name: id_ for id_, name in cursor.fetchall()}
+            existing = {normalize_name(name): id_ for id_, name in cursor.fetchall()}
             print(f"Retrieved IDs for {len(existing)} {table} records after insertion")
         except pyodbc.Error as e:
             print(f"Error retrieving {table} IDs after insertion: {e}")
             raise
     
+    # Every spelling takes the id of its normalized name, not only the one stored
     result = {}
     unmapped = []
-    for orig_name in original_names:
-        if orig_name in existing:
-            result[orig_name] = existing[orig_name]
+    for orig_name, norm_name in original_names.items():
+        if norm_name in existing:
+            result[orig_name] = existing[norm_name]
         else:
             unmapped.append(orig_name)
     
@@ -281,6 +794,76 @@ def get_or_create_name_ids_bulk(cursor, names, table, region_map=None):
     print(f"Returning {len(result)} {table} ID mappings")
     return result
 
+def resolve_name_ids(cursor, names, table, region_map=None):
+    """Map incoming names to canonical ids, creating entities only for genuinely new names.
+
+    Exact names and known aliases resolve directly. Other names are matched
+    against the canonical names by key and edit distance, and the rest are
+    clustered so variants within one workbook create a single row. Every
+    name that resolved to a differently spelled entity is saved as an alias.
+    Names and aliases compare case-insensitively, like the database collation
+    that keys name_aliases, so case variants never become duplicate aliases.
+    """
+    incoming = {str(name).strip() for name in names if name is not None and not pd.isna(name) and str(name).strip()}
+    if not incoming:
+        return {}
+    
+    cursor.execute(f"SELECT id, name FROM {table} ORDER BY id")
+    canonical = cursor.fetchall()
+    exact = {name.casefold(): id_ for id_, name in canonical}
+    cursor.execute("SELECT alias, canonical_id FROM name_aliases WHERE entity_table = ?", table)
+    aliases = {alias.casefold(): id_ for alias, id_ in cursor.fetchall()}
+    
+    result = {}
+    new_aliases = []
+    unresolved = []
+    index = resolution.NameIndex()
+    for id_, name in canonical:
+        index.add(id_, name)
+    
+    for name in incoming:
+        folded = name.casefold()
+        if folded in exact:
+            result[name] = exact[folded]
+        elif folded in aliases:
+            result[name] = aliases[folded]
+        else:
+            match, score = index.match(name)
+            if match is None:
+                unresolved.append(name)
+            else:
+                result[name] = match
+                new_aliases.append((table, name, match, score))
+    
+    print(f"Resolved {len(incoming) - len(unresolved)} of {len(incoming)} {table} names to existing entities")
+    
+    if unresolved:
+        representatives = resolution.cluster_names(unresolved)
+        created = get_or_create_name_ids_bulk(cursor, sorted(set(representatives.values())), table, region_map)
+        for name, representative in representatives.items():
+            if representative in created:
+                result[name] = created[representative]
+                if name.casefold() != representative.casefold():
+                    new_aliases.append((table, name, created[representative], None))
+    
+    # One alias per case-insensitive spelling
+    unique = {}
+    for alias in new_aliases:
+        unique.setdefault(alias[1].casefold(), alias)
+    new_aliases = list(unique.values())
+    
+    if new_aliases:
+        cursor.executemany(
+            "INSERT INTO name_aliases (entity_table, alias, canonical_id, score) VALUES (?, ?, ?, ?)",
+            new_aliases
+        )
+        cursor.connection.commit()
+        print(f"✅ Recorded {len(new_aliases)} {table} aliases")
+        for _, alias, canonical_id, score in new_aliases[:10]:
+            print(f"  - '{alias}' -> {canonical_id}" + (f" (score {score:.2f})" if score else ""))
+    
+    return result
+
 def verify_database_state(cursor):
     """Verify what's actually in the database"""
     try:
@@ -321,12 +904,12 @@ def insert_reference_data(df):
         print(f"\nUnique service stations to process ({len(service_stations)}): {service_stations}")
         
         print(f"\n⏳ Inserting {len(departments)} departments...")
-        dept_ids = get_or_create_name_ids_bulk(cursor, departments, "departments")
+        dept_ids = resolve_name_ids(cursor, departments, "departments")
         print(f"✅ Inserted {len(dept_ids)} departments")
         print(f"Department ID mappings: {dept_ids}")
         
         print(f"\n⏳ Inserting {len(service_stations)} service stations...")
-        station_ids = get_or_create_name_ids_bulk(
+        station_ids = resolve_name_ids(
             cursor, 
             service_stations, 
             "service_stations",
@@ -335,10 +918,18 @@ def insert_reference_data(df):
         print(f"✅ Inserted {len(station_ids)} service stations")
         print(f"Service station ID mappings: {station_ids}")
         
+        code_ids = {}
+        for column, table in DICTIONARY_COLUMNS.items():
+            if column not in df.columns:
+                continue
+            names = df[column].dropna().unique().tolist()
+            print(f"\n⏳ Inserting {len(names)} {table}...")
+            code_ids[column] = get_or_create_name_ids_bulk(cursor, names, table)
+        
         print("\nVerifying database state:")
         verify_database_state(cursor)
         
-        return dept_ids, station_ids
+        return dept_ids, station_ids, code_ids
         
     except Exception as e:
         print(f"❌ Error inserting reference data: {e}")
@@ -350,51 +941,240 @@ def insert_reference_data(df):
             conn.close()
         print("Reference data connection closed")
 
-def enrich_with_foreign_keys(df, dept_ids, station_ids):
-    df = df.copy()
+def map_names_to_ids(names, ids):
+    """Map a column of names to nullable Int32 ids, looking up each distinct name once.
+
+    The names are made categorical, the categories are mapped through
+    ``ids`` and the ids are gathered by category code. Returns the ids and
+    a Series counting the rows of every name that has no id.
+    """
+    categorical = names.astype('category')
+    categories = categorical.cat.categories
+    category_ids = pd.array([ids.get(str(name).strip()) for name in categories], dtype='Int32')
+    codes = categorical.cat.codes.to_numpy()
+    
+    # Code -1 is a missing name and becomes <NA> as well
+    mapped = pd.Series(category_ids.take(codes, allow_fill=True), index=names.index, name=names.name)
     
+    unmapped = category_ids.isna()
+    counts = np.bincount(codes[codes >= 0], minlength=len(categories))
+    report = pd.Series(counts[unmapped], index=categories[unmapped], name=names.name)
+    return mapped, report.sort_values(ascending=False)
+
+def report_unmapped(report, label):
+    if report.empty:
+        return
+    print(f"⚠️ Warning: {len(report)} unmapped {label} ({report.sum()} rows):")
+    for name, rows in report.head(10).items():
+        print(f"  - '{name}' (normalized: '{normalize_name(name)}'): {rows} rows")
+
+def enrich_with_foreign_keys(df, dept_ids, station_ids, code_ids=None):
+    """Add department_id, service_station_id and the dictionary keys to ``df`` in place and return it"""
     if "department" not in df.columns:
         raise ValueError("Required column 'department' not found in DataFrame")
     if "service_station" not in df.columns:
         raise ValueError("Required column 'service_station' not found in DataFrame")
     
-    # Debug: Print sample department and service station names
-    print(f"Sample department names in DataFrame: {df['department'].dropna().unique()[:5]}")
-    print(f"Sample service station names in DataFrame: {df['service_station'].dropna().unique()[:5]}")
-    print(f"Available department IDs: {dept_ids}")
-    print(f"Available service station IDs: {station_ids}")
+    print(f"Available department IDs: {len(dept_ids)}")
+    print(f"Available service station IDs: {len(station_ids)}")
     
-    # Map department IDs using original names
-    df["department_id"] = df["department"].apply(
-        lambda x: dept_ids.get(str(x).strip() if pd.notna(x) else None, None)
-    )
-    unmapped_depts = df[df["department_id"].isna() & df["department"].notna()]["department"].unique()
-    if len(unmapped_depts) > 0:
-        print(f"⚠️ Warning: {len(unmapped_depts)} unmapped departments: {unmapped_depts[:10]}...")
-        for dept in unmapped_depts:
-            norm_dept = normalize_name(dept)
-            print(f"  - '{dept}' (normalized: '{norm_dept}')")
-        df["department_id"] = df["department_id"].fillna(-1).astype(int).replace(-1, None)
-    
-    # Map service station IDs using original names
-    df["service_station_id"] = df["service_station"].apply(
-        lambda x: station_ids.get(str(x).strip() if pd.notna(x) else None, None)
-    )
-    unmapped_stations = df[df["service_station_id"].isna() & df["service_station"].notna()]["service_station"].unique()
-    if len(unmapped_stations) > 0:
-        print(f"⚠️ Warning: {len(unmapped_stations)} unmapped service stations: {unmapped_stations[:10]}...")
-        for station in unmapped_stations:
-            norm_station = normalize_name(station)
-            print(f"  - '{station}' (normalized: '{norm_station}')")
-        df["service_station_id"] = df["service_station_id"].fillna(-1).astype(int).replace(-1, None)
+    df["department_id"], unmapped_depts = map_names_to_ids(df["department"], dept_ids)
+    report_unmapped(unmapped_depts, "departments")
+    
+    df["service_station_id"], unmapped_stations = map_names_to_ids(df["service_station"], station_ids)
+    report_unmapped(unmapped_stations, "service stations")
+    
+    for column, ids in (code_ids or {}).items():
+        df[f"{column}_id"], unmapped = map_names_to_ids(df[column], ids)
+        report_unmapped(unmapped, DICTIONARY_COLUMNS[column].replace('_', ' '))
     
     return df
 
-def insert_fuel_transactions(cursor, df):
+def file_checksum(path):
+    """SHA-256 of a source file, identifying it across load attempts"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def unfinished_load(cursor, checksum):
+    """(id, total_rows, chunk_size, accepted_rows, accepted_hash, reference_date) of the
+    latest load of this file that did not complete, or None"""
+    cursor.execute(
+        """
+        SELECT TOP 1 id, total_rows, chunk_size, accepted_rows, accepted_hash, reference_date
+        FROM ingest_loads
+        WHERE checksum = ? AND status <> 'complete'
+        ORDER BY id DESC
+        """,
+        checksum
+    )
+    return cursor.fetchone()
+
+def positions_hash(positions):
+    """SHA-256 of the row positions a load inserts, which decide what each chunk holds"""
+    return hashlib.sha256(np.ascontiguousarray(positions, dtype=np.int64).tobytes()).hexdigest()
+
+def start_load(cursor, source, checksum, total_rows, accepted, reference_date, unfinished=None, resume=False,
+               source_range=(None, None)):
+    """Open a load journal entry, or reopen the unfinished one for this file.
+
+    ``accepted`` are the positions that passed the quality rules judged
+    against ``reference_date``. Chunks are cut over them, so a load is only
+    resumed when this run accepted exactly the journaled rows; rules or
+    QUALITY_* settings that changed since would otherwise shift rows between
+    chunks and skip or repeat them. Returns the load id and the set of chunk
+    indexes already committed. ``source_range`` is the (first, end) slice of
+    the workbook's rows the load covers.
+    """
+    accepted_hash = positions_hash(accepted)
+    
+    if resume and unfinished:
+        load_id, journal_rows, journal_chunk_size, journal_accepted, journal_hash = unfinished[:5]
+        if (journal_rows, journal_chunk_size) != (total_rows, CHUNK_SIZE):
+            raise RuntimeError(
+                f"Load {load_id} was journaled with {journal_rows} rows in chunks of {journal_chunk_size}; "
+                f"this run has {total_rows} rows in chunks of {CHUNK_SIZE}"
+            )
+        if journal_hash is None:
+            raise RuntimeError(
+                f"Load {load_id} was journaled without its accepted rows, so a resume cannot be checked; "
+                f"run without --resume to start a new load"
+            )
+        if (journal_accepted, journal_hash) != (len(accepted), accepted_hash):
+            accepts = (f"other rows than load {load_id}" if journal_accepted == len(accepted)
+                       else f"{len(accepted)} rows where load {load_id} accepted {journal_accepted}")
+            raise RuntimeError(
+                f"This run accepts {accepts}; the quality rules or QUALITY_* settings changed, "
+                f"so resuming would skip or repeat rows. Run without --resume to start a new load"
+            )
+        cursor.execute("SELECT chunk_index FROM ingest_load_chunks WHERE load_id = ?", load_id)
+        done = {row[0] for row in cursor.fetchall()}
+        cursor.execute("UPDATE ingest_loads SET status = 'running' WHERE id = ?", load_id)
+        cursor.connection.commit()
+        print(f"⏳ Resuming load {load_id}: {len(done)} chunks already committed")
+        return load_id, done
+    
+    if resume:
+        print("No unfinished load of this file to resume, starting a new one")
+    elif unfinished:
+        print(f"⚠️ Load {unfinished[0]} of this file did not finish; rerun with --resume to continue it instead")
+    
+    cursor.execute(
+        """
+        INSERT INTO ingest_loads (
+            source, checksum, total_rows, chunk_size, accepted_rows, accepted_hash, reference_date,
+            first_source_row, source_rows
+        )
+        OUTPUT INSERTED.id
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        source, checksum, total_rows, CHUNK_SIZE, len(accepted), accepted_hash, reference_date, *source_range
+    )
+    load_id = cursor.fetchone()[0]
+    cursor.connection.commit()
+    return load_id, set()
+
+def finish_load(cursor, load_id, status='complete'):
+    cursor.execute(
+        "UPDATE ingest_loads SET status = ?, finished_at = SYSUTCDATETIME() WHERE id = ?",
+        status, load_id
+    )
+    cursor.connection.commit()
+
+def is_retryable_chunk_error(error):
+    """Failures a chunk can be retried after on the same, still open connection.
+
+    Deadlock victims (SQLSTATE 40001, native error 1205), lock timeouts (1222)
+    and query timeouts (HYT00) roll back the chunk and leave the connection
+    usable. A lost link (08S01 and other OperationalErrors) is not retried:
+    the cursor is dead, so the load fails and ``--resume`` continues it from
+    the last journaled chunk.
+    """
+    if not isinstance(error, pyodbc.Error):
+        return False
+    state = error.args[0] if error.args else None
+    message = str(error)
+    return (
+        state in ('40001', 'HYT00')
+        or f"({DEADLOCK_ERROR})" in message
+        or f"({LOCK_TIMEOUT_ERROR})" in message
+    )
+
+@retry(
+    stop=stop_after_attempt(RETRY_ATTEMPTS),
+    wait=wait_exponential(multiplier=1, min=1, max=30),
+    retry=retry_if_exception(is_retryable_chunk_error),
+    reraise=True
+)
+def commit_chunk(cursor, insert_sql, rows, load_id, chunk_index, first_row):
+    """Insert one chunk and journal it in the same transaction"""
+    try:
+        cursor.executemany(insert_sql, rows)
+        cursor.execute(
+            """
+            INSERT INTO ingest_load_chunks (load_id, chunk_index, first_row, last_row, rows_committed)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            load_id, chunk_index, first_row, first_row + len(rows) - 1, len(rows)
+        )
+        cursor.connection.commit()
+    except pyodbc.Error:
+        try:
+            cursor.connection.rollback()
+        except pyodbc.Error:
+            pass  # the connection is gone and the server rolls the chunk back; keep the original error
+        raise
+
+def load_chunks(cursor, insert_sql, rows, chunk_indexes, load_id, label=""):
+    """Commit the given chunks of ``rows`` in order on one cursor; returns rows inserted"""
+    inserted = 0
+    for chunk_index in chunk_indexes:
+        first_row = chunk_index * CHUNK_SIZE
+        chunk = rows[first_row:first_row + CHUNK_SIZE]
+        try:
+            commit_chunk(cursor, insert_sql, chunk, load_id, chunk_index, first_row)
+        except pyodbc.Error as e:
+            print(f"❌ {label}Error inserting chunk {chunk_index + 1}: {e}")
+            raise
+        inserted += len(chunk)
+        print(f"{label}Inserted chunk {chunk_index + 1} with {len(chunk)} records")
+    return inserted
+
+def load_chunks_on_new_connection(insert_sql, rows, chunk_indexes, load_id, worker):
+    """One parallel writer: its own connection, and a transaction per chunk"""
+    conn = connect_to_sql()
+    cursor = conn.cursor()
+    try:
+        return load_chunks(cursor, insert_sql, rows, chunk_indexes, load_id, f"[writer {worker}] ")
+    finally:
+        cursor.close()
+        conn.close()
+
+def split_contiguous(items, parts):
+    """Split items into at most ``parts`` contiguous runs of near-equal length"""
+    parts = max(min(parts, len(items)), 1)
+    size, extra = divmod(len(items), parts)
+    runs, start = [], 0
+    for part in range(parts):
+        end = start + size + (1 if part < extra else 0)
+        runs.append(items[start:end])
+        start = end
+    return [run for run in runs if run]
+
+def insert_fuel_transactions(cursor, df, load_id, done_chunks=frozenset(), connections=LOAD_CONNECTIONS, positions=None):
+    """Insert the frame chunk by chunk, skipping chunks the journal marks as committed.
+
+    With several connections the date-ordered chunks are split into
+    contiguous runs, so each writer works on its own date range and the
+    writers do not contend for the same pages. ``positions`` limits the
+    load to those rows. Returns the number of rows inserted by this call.
+    """
     insert_cols = [
-        'date', 'time', 'vehicle_registration', 'department_id', 'truck_model', 
-        'service_provider', 'service_station_id', 'product', 'quantity', 
-        'full_tank_capacity', 'terminal_price', 'customer_amount', 'region'
+        'date', 'time', 'vehicle_registration', 'department_id', 'truck_model_id',
+        'service_provider_id', 'service_station_id', 'product_id', 'quantity',
+        'full_tank_capacity', 'terminal_price', 'customer_amount'
     ]
 
     placeholders = ','.join(['?'] * len(insert_cols))
@@ -403,34 +1183,246 @@ def insert_fuel_transactions(cursor, df):
     VALUES ({placeholders})
     """
 
-    rows = []
-    for _, row in df.iterrows():
-        values = [row.get(col) if pd.notna(row.get(col)) else None for col in insert_cols]
-        rows.append(values)
+    # Date order keeps each chunk within one or two monthly partitions.
+    # The sort is stable so a resumed load cuts the same chunks, and it
+    # reorders the column values rather than copying the frame.
+    if positions is None:
+        positions = np.arange(len(df))
+    dates = df['date'].take(positions)
+    order = np.argsort(dates.to_numpy(), kind='stable')
+    missing_dates = dates.isna().to_numpy()[order]
+    order = positions[np.concatenate([order[missing_dates], order[~missing_dates]])]
+    columns = [
+        column_values(df[col].take(order)) if col in df.columns else [None] * len(order)
+        for col in insert_cols
+    ]
+    rows = list(zip(*columns))
+    del columns
 
-    for i in range(0, len(rows), CHUNK_SIZE):
-        chunk = rows[i:i+CHUNK_SIZE]
-        try:
-            cursor.executemany(insert_sql, chunk)
-            cursor.connection.commit()
-            print(f"Inserted chunk {i // CHUNK_SIZE + 1} with {len(chunk)} records")
-        except pyodbc.Error as e:
-            print(f"❌ Error inserting chunk {i // CHUNK_SIZE + 1}: {e}")
-            cursor.connection.rollback()
-            raise
+    pending = [i for i in range(0, (len(rows) + CHUNK_SIZE - 1) // CHUNK_SIZE) if i not in done_chunks]
+    runs = split_contiguous(pending, connections)
+    started = time()
+    
+    if len(runs) <= 1:
+        inserted = load_chunks(cursor, insert_sql, rows, pending, load_id)
+    else:
+        print(f"⏳ Loading {len(pending)} chunks over {len(runs)} connections")
+        with ThreadPoolExecutor(max_workers=len(runs)) as executor:
+            futures = [
+                executor.submit(load_chunks_on_new_connection, insert_sql, rows, run, load_id, worker)
+                for worker, run in enumerate(runs, start=1)
+            ]
+        # Every writer has finished; committed chunks are journaled even if one failed
+        inserted = sum(future.result() for future in futures)
+    
+    elapsed = max(time() - started, 1e-9)
+    print(f"✅ Inserted {inserted} rows in {elapsed:.1f}s ({inserted / elapsed:,.0f} rows/sec)")
+    return inserted
+
+QUARANTINE_COLUMNS = [
+    'date', 'time', 'vehicle_registration', 'department', 'truck_model', 'service_provider',
+    'service_station', 'product', 'quantity', 'full_tank_capacity', 'terminal_price',
+    'customer_amount', 'region'
+]
 
-def insert_transaction_data(df, dept_ids, station_ids):
+def quarantine_rows(cursor, df, positions, reasons, load_id):
+    """Load rejected rows into fuel_transactions_rejected with their reason codes.
+
+    All rejected rows go in one transaction journaled as chunk -1, so a
+    resumed load does not quarantine them twice.
+    """
+    if not len(positions):
+        return
+    columns = [
+        column_values(df[col].take(positions)) if col in df.columns else [None] * len(positions)
+        for col in QUARANTINE_COLUMNS
+    ]
+    rows = [(load_id, reason) + values for reason, values in zip(reasons, zip(*columns))]
+    insert_sql = f"""
+    INSERT INTO fuel_transactions_rejected (load_id, reason_codes, {', '.join(QUARANTINE_COLUMNS)})
+    VALUES ({','.join(['?'] * (len(QUARANTINE_COLUMNS) + 2))})
+    """
+    commit_chunk(cursor, insert_sql, rows, load_id, -1, 0)
+    print(f"✅ Quarantined {len(rows)} rows in fuel_transactions_rejected")
+
+def update_vehicle_sketches(cursor, df, positions=None):
+    """Merge the vehicles of a load into the per day, department and station sketches"""
+    columns = ('date', 'department_id', 'service_station_id', 'vehicle_registration')
+    loaded = sketches.build_sketches(zip(*(
+        column_values(df[col] if positions is None else df[col].take(positions)) for col in columns
+    )))
+    if not loaded:
+        return
+    
+    keys = list(loaded)
+    days = [key[0] for key in keys]
+    cursor.execute(
+        "SELECT date, department_id, service_station_id, registers FROM vehicle_sketches WHERE date BETWEEN ? AND ?",
+        min(days), max(days)
+    )
+    existing = {(day, dept, station): registers for day, dept, station, registers in cursor.fetchall()}
+    
+    updates, inserts = [], []
+    for key, registers in loaded.items():
+        day, dept, station = key
+        if key in existing:
+            sketches.merge_into(registers, sketches.decode(existing[key]))
+            updates.append((sketches.encode(registers), day, dept, station))
+        else:
+            inserts.append((day, dept, station, sketches.encode(registers)))
+    
+    for i in range(0, len(updates), CHUNK_SIZE):
+        cursor.executemany(
+            "UPDATE vehicle_sketches SET registers = ? WHERE date = ? AND department_id = ? AND service_station_id = ?",
+            updates[i:i+CHUNK_SIZE]
+        )
+    for i in range(0, len(inserts), CHUNK_SIZE):
+        cursor.executemany(
+            "INSERT INTO vehicle_sketches (date, department_id, service_station_id, registers) VALUES (?, ?, ?, ?)",
+            inserts[i:i+CHUNK_SIZE]
+        )
+    cursor.connection.commit()
+    print(f"✅ Updated {len(updates)} and added {len(inserts)} vehicle sketches")
+
+def rebuild_vehicle_sketches(cursor, conn):
+    """Recreate every vehicle sketch from hot and archived transactions, one month at a time"""
+    cursor.execute(f"SELECT MIN(date), MAX(date) FROM {ALL_TRANSACTIONS_VIEW}")
+    first, last = cursor.fetchone()
+    cursor.execute("DELETE FROM vehicle_sketches")
+    conn.commit()
+    if not first:
+        return
+    
+    for month in month_starts(first, last):
+        cursor.execute(
+            f"""
+            SELECT date, department_id, service_station_id, vehicle_registration
+            FROM {ALL_TRANSACTIONS_VIEW} WHERE date >= ? AND date < ?
+            """,
+            month, add_months(month, 1)
+        )
+        rows = cursor.fetchall()
+        if rows:
+            df = pd.DataFrame.from_records(
+                [tuple(row) for row in rows],
+                columns=['date', 'department_id', 'service_station_id', 'vehicle_registration']
+            )
+            update_vehicle_sketches(cursor, df)
+            print(f"Sketched {len(rows)} transactions for {month:%Y-%m}")
+
+def record_ingest_watermark(cursor, source, rows_loaded):
+    """Record the highest committed transaction id once a load completes"""
+    cursor.execute(
+        """
+        INSERT INTO ingest_watermarks (source, max_transaction_id, rows_loaded)
+        SELECT ?, MAX(id), ? FROM fuel_transactions
+        """,
+        source, rows_loaded
+    )
+    cursor.connection.commit()
+    print(f"✅ Recorded ingest watermark for {rows_loaded} rows from {source}")
+
+def refresh_analytics_snapshot():
+    """Bring the DuckDB snapshot up to the latest ingest watermark"""
+    if not snapshot.is_enabled():
+        return
+    conn = connect_to_sql()
+    try:
+        snapshot.refresh_snapshot(conn)
+    finally:
+        conn.close()
+
+def publish_data_version():
+    """Announce the transactions loaded since the last version to open dashboards.
+
+    Runs once the snapshot and caches are up to date, so a dashboard that
+    refreshes on the announcement reads the new rows. The row records the
+    date range and departments of the new transactions (see events.py).
+    Returns the new version, or None when nothing was loaded.
+    """
+    conn = connect_to_sql()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COALESCE(MAX(max_transaction_id), 0) FROM data_versions")
+        since = cursor.fetchone()[0]
+        cursor.execute("SELECT MAX(id) FROM fuel_transactions")
+        high = cursor.fetchone()[0]
+        if high is None or high <= since:
+            return None
+        cursor.execute(
+            """
+            SELECT department_id, MIN(date), MAX(date) FROM fuel_transactions
+            WHERE id > ? AND id <= ?
+            GROUP BY department_id
+            """,
+            since, high
+        )
+        changed = cursor.fetchall()
+        departments = sorted(row[0] for row in changed if row[0] is not None)
+        cursor.execute(
+            """
+            INSERT INTO data_versions (max_transaction_id, first_date, last_date, department_ids)
+            OUTPUT INSERTED.id
+            VALUES (?, ?, ?, ?)
+            """,
+            high, min(row[1] for row in changed), max(row[2] for row in changed), json.dumps(departments)
+        )
+        version = cursor.fetchone()[0]
+        conn.commit()
+        print(f"✅ Published data version {version} for transactions up to id {high}")
+        return version
+    finally:
+        conn.close()
+
+def warm_dashboard_caches():
+    """Replay popular dashboard views into a fresh result cache generation"""
+    try:
+        from warm import warm_caches
+        warm_caches()
+    except Exception as e:
+        # The data is loaded; a cold cache only costs the first viewers
+        print(f"⚠️ Cache warming failed: {e}")
+
+def insert_transaction_data(df, dept_ids, station_ids, code_ids=None, source=SOURCE_FILE, checksum=None, resume=False,
+                            source_range=(None, None)):
     try:
         conn = connect_to_sql()
         cursor = conn.cursor()
         
         print("DataFrame columns before enrichment:", df.columns.tolist())
-        df_fk = enrich_with_foreign_keys(df, dept_ids, station_ids)
+        df_fk = enrich_with_foreign_keys(df, dept_ids, station_ids, code_ids)
+        
+        if is_partitioned(cursor):
+            dates = df_fk['date'].dropna()
+            if not dates.empty:
+                ensure_partitions(cursor, dates.min().date(), dates.max().date())
+        
+        # A resumed load judges dates against the day it started, so it accepts the same rows
+        checksum = checksum or file_checksum(source)
+        unfinished = unfinished_load(cursor, checksum)
+        reference_date = unfinished[5] if resume and unfinished and unfinished[5] else date.today()
+        
+        rejected, reasons, counts = quality.evaluate(df_fk, reference_date)
+        quality.print_report(rejected, counts)
+        accepted = np.flatnonzero(~rejected)
         
-        insert_fuel_transactions(cursor, df_fk)
+        load_id, done_chunks = start_load(
+            cursor, source, checksum, len(df_fk), accepted, reference_date, unfinished, resume, source_range
+        )
+        if -1 not in done_chunks:
+            quarantine_rows(cursor, df_fk, np.flatnonzero(rejected), reasons, load_id)
+        inserted = insert_fuel_transactions(cursor, df_fk, load_id, done_chunks, positions=accepted)
+        update_vehicle_sketches(cursor, df_fk, accepted)
+        record_ingest_watermark(cursor, source, inserted)
+        finish_load(cursor, load_id)
         
     except Exception as e:
         print(f"❌ Error inserting transaction data: {e}")
+        if 'load_id' in locals():
+            try:
+                finish_load(cursor, load_id, status='failed')
+            except pyodbc.Error:
+                pass  # the connection is gone; the load stays 'running' and can still be resumed
         raise
     finally:
         if 'cursor' in locals():
@@ -439,37 +1431,171 @@ def insert_transaction_data(df, dept_ids, station_ids):
             conn.close()
         print("Transaction data connection closed")
 
-def main():
+def unloaded_row_ranges(source, source_rows, checksum):
+    """Row ranges of the workbook at ``source`` not loaded yet, as (first, end, checksum).
+
+    A workbook is appended to in place, so the rows below the furthest
+    completed load of the same path are already in the database. An
+    unfinished load of the path is finished first over its journaled range
+    and under its own checksum, so it resumes from its committed chunks; the
+    rows after it follow under this file's checksum.
+    """
+    conn = connect_to_sql()
     try:
-        df = pd.read_excel("main.xlsx")
-        print(f"Loaded {len(df)} rows")
-        print(f"Input DataFrame columns: {df.columns.tolist()}")
+        cursor = conn.cursor()
+        if 'source_rows' not in table_columns(cursor, 'ingest_loads'):
+            return [(0, source_rows, checksum)]  # first load, or a journal the loader has not migrated yet
+        cursor.execute(
+            "SELECT MAX(source_rows) FROM ingest_loads WHERE source = ? AND status = 'complete'", source
+        )
+        loaded = cursor.fetchone()[0] or 0
+        cursor.execute(
+            """
+            SELECT TOP 1 checksum, first_source_row, source_rows FROM ingest_loads
+            WHERE source = ? AND status <> 'complete' AND first_source_row >= ?
+            ORDER BY id DESC
+            """,
+            source, loaded
+        )
+        ranges = []
+        unfinished = cursor.fetchone()
+        if unfinished:
+            unfinished_checksum, first, end = unfinished
+            ranges.append((first, end, unfinished_checksum))
+            loaded = end
+    finally:
+        conn.close()
     
-        print("\nPreparing data...")
+    if source_rows < loaded:
+        raise RuntimeError(
+            f"{source} has {source_rows} rows but {loaded} were already loaded from it; "
+            f"a rewritten workbook has to be dropped under a new name"
+        )
+    if source_rows > loaded:
+        ranges.append((loaded, source_rows, checksum))
+    return ranges
+
+def load_workbook(path, checksum=None, resume=False, memory=None, incremental=False):
+    """Read, prepare and load one workbook: the reference and transaction phases.
+
+    ``checksum`` identifies the file in the load journal and is computed
+    when not given; with ``resume`` an unfinished load of the same file
+    continues from its last committed chunk. With ``incremental`` only the
+    rows appended since the last load of the same path are loaded (see
+    ``unloaded_row_ranges``). Returns the number of workbook rows loaded.
+    """
+    memory = [] if memory is None else memory
+    checksum = checksum or file_checksum(path)
+    with memory_phase(memory, "read workbook"):
+        df = pd.read_excel(path)
+    print(f"Loaded {len(df)} rows from {path}")
+    print(f"Input DataFrame columns: {df.columns.tolist()}")
+
+    ranges = unloaded_row_ranges(path, len(df), checksum) if incremental else [(0, len(df), checksum)]
+    if not ranges:
+        print(f"No new rows in {path} since its last load")
+        return 0
+    start = ranges[0][0]
+    if start or ranges[-1][1] != len(df):
+        print(f"Loading rows {start + 1} to {ranges[-1][1]} of {path}")
+        df = df.iloc[start:ranges[-1][1]].reset_index(drop=True)
+
+    print("\nPreparing data...")
+    with memory_phase(memory, "prepare data"):
         df_clean = prepare_data(df)
-        print("✅ Data preparation completed")
-    
-        print("\nData Quality Check:")
-        print(f"Total rows: {len(df_clean)}")
-        if 'department' in df_clean.columns:
-            unique_depts = df_clean['department'].nunique()
-            print(f"Unique departments found: {unique_depts}")
-            print("Sample departments:", df_clean['department'].dropna().unique()[:10])
-        if 'service_station' in df_clean.columns:
-            unique_stations = df_clean['service_station'].nunique()
-            print(f"Unique service stations found: {unique_stations}")
-            print("Sample service stations:", df_clean['service_station'].dropna().unique()[:10])
-    
-        print("\n=== PHASE 1: Inserting Reference Data ===")
-        dept_ids, station_ids = insert_reference_data(df_clean)
+        del df
+    print("✅ Data preparation completed")
+
+    print("\nData Quality Check:")
+    print(f"Total rows: {len(df_clean)}")
+    if 'department' in df_clean.columns:
+        unique_depts = df_clean['department'].nunique()
+        print(f"Unique departments found: {unique_depts}")
+        print("Sample departments:", df_clean['department'].dropna().unique()[:10])
+    if 'service_station' in df_clean.columns:
+        unique_stations = df_clean['service_station'].nunique()
+        print(f"Unique service stations found: {unique_stations}")
+        print("Sample service stations:", df_clean['service_station'].dropna().unique()[:10])
+
+    print("\n=== PHASE 1: Inserting Reference Data ===")
+    with memory_phase(memory, "reference data"):
+        dept_ids, station_ids, code_ids = insert_reference_data(df_clean)
+
+    print("\n=== PHASE 2: Inserting Transaction Data ===")
+    with memory_phase(memory, "transaction data"):
+        for first, end, range_checksum in ranges:
+            part = df_clean if len(ranges) == 1 else df_clean.iloc[first - start:end - start].reset_index(drop=True)
+            insert_transaction_data(
+                part, dept_ids, station_ids, code_ids, source=path, checksum=range_checksum, resume=resume,
+                source_range=(first, end)
+            )
+    return ranges[-1][1] - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Load fuel transactions from an Excel workbook")
+    parser.add_argument('--switch-out', metavar='YYYY-MM',
+                        help="Switch one month out of fuel_transactions instead of loading")
+    parser.add_argument('--resume', action='store_true',
+                        help="Continue the unfinished load of the source file from its last committed chunk")
+    parser.add_argument('--archive', nargs='?', type=int, const=ARCHIVE_AFTER_MONTHS, metavar='MONTHS',
+                        help="Move transactions older than MONTHS months (default ARCHIVE_AFTER_MONTHS) "
+                             "to the columnstore archive instead of loading; meant to run on a schedule")
+    parser.add_argument('--rebuild-sketches', action='store_true',
+                        help="Rebuild the distinct-vehicle sketches from fuel_transactions instead of loading")
+    parser.add_argument('--memory-report', action='store_true',
+                        help="Trace allocations and print retained and peak memory per phase")
+    args = parser.parse_args()
+    
+    if args.rebuild_sketches:
+        conn = connect_to_sql()
+        try:
+            cursor = conn.cursor()
+            create_tables(cursor, conn)
+            rebuild_vehicle_sketches(cursor, conn)
+        finally:
+            conn.close()
+        return
+    
+    if args.archive is not None:
+        conn = connect_to_sql()
+        try:
+            cursor = conn.cursor()
+            create_tables(cursor, conn)
+            archive_cold_transactions(cursor, conn, args.archive)
+        finally:
+            conn.close()
+        return
+
+    if args.switch_out:
+        conn = connect_to_sql()
+        try:
+            switch_out_month(conn.cursor(), conn, date.fromisoformat(f"{args.switch_out}-01"))
+        finally:
+            conn.close()
+        return
+    
+    memory = []
+    if args.memory_report:
+        tracemalloc.start()
+    
+    try:
+        load_workbook(SOURCE_FILE, resume=args.resume, memory=memory)
         
-        print("\n=== PHASE 2: Inserting Transaction Data ===")
-        insert_transaction_data(df_clean, dept_ids, station_ids)
+        print("\n=== PHASE 3: Refreshing Analytics Snapshot ===")
+        with memory_phase(memory, "analytics snapshot"):
+            refresh_analytics_snapshot()
+        
+        print("\n=== PHASE 4: Warming Dashboard Caches ===")
+        with memory_phase(memory, "cache warming"):
+            warm_dashboard_caches()
+        publish_data_version()
         
         print("\n✅ All data inserted successfully!")
     except Exception as e:
         print(f"\n❌ Failed to complete data insertion: {e}")
         raise
+    finally:
+        print_memory_report(memory)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
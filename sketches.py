@@ -0,0 +1,99 @@
+"""HyperLogLog sketches of distinct vehicles per day, department and station.
+
+Distinct counts cannot be summed across days or stations, but sketches can
+be merged: the register-wise maximum of two sketches is the sketch of the
+union. ``script.py`` keeps one sketch per (date, department, station) in
+``vehicle_sketches`` as vehicles are loaded, and the dashboard merges the
+rows matching a filter to estimate how many distinct vehicles it covers.
+With 2048 registers the standard error is about 2.3%.
+"""
+import zlib
+import hashlib
+from math import log
+
+SKETCH_PRECISION = 11
+SKETCH_REGISTERS = 1 << SKETCH_PRECISION
+HASH_BITS = 64
+UNKNOWN_ID = 0  # department or station id used for rows without one
+
+_VALUE_BITS = HASH_BITS - SKETCH_PRECISION
+_VALUE_MASK = (1 << _VALUE_BITS) - 1
+
+
+def new_sketch():
+    return bytearray(SKETCH_REGISTERS)
+
+
+def vehicle_hash(registration):
+    """Stable 64-bit hash of a normalized registration, the same in every process"""
+    key = ''.join(str(registration).split()).upper().encode()
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'big')
+
+
+def add(registers, registration):
+    h = vehicle_hash(registration)
+    index = h >> _VALUE_BITS
+    rank = _VALUE_BITS - (h & _VALUE_MASK).bit_length() + 1
+    if rank > registers[index]:
+        registers[index] = rank
+
+
+def encode(registers):
+    """Compressed register bytes; sketches of a few vehicles are mostly zeros"""
+    return zlib.compress(bytes(registers))
+
+
+def decode(blob):
+    return bytearray(zlib.decompress(blob))
+
+
+def merge_into(registers, other):
+    """Fold ``other`` into ``registers`` in place"""
+    for i, rank in enumerate(other):
+        if rank > registers[i]:
+            registers[i] = rank
+    return registers
+
+
+def merge_encoded(blobs):
+    """Register-wise maximum of many encoded sketches"""
+    import numpy as np
+
+    merged = np.zeros(SKETCH_REGISTERS, dtype=np.uint8)
+    for blob in blobs:
+        np.maximum(merged, np.frombuffer(zlib.decompress(blob), dtype=np.uint8), out=merged)
+    return merged
+
+
+def estimate(registers):
+    """Distinct count estimate with the small-range correction"""
+    m = SKETCH_REGISTERS
+    alpha = 0.7213 / (1 + 1.079 / m)
+    harmonic = sum(2.0 ** -int(rank) for rank in registers)
+    raw = alpha * m * m / harmonic
+    zeros = m - sum(1 for rank in registers if rank)
+    if raw <= 2.5 * m and zeros:
+        return round(m * log(m / zeros))
+    return round(raw)
+
+
+def _key_id(value):
+    # Missing ids arrive as None, NaN or pandas' <NA>
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return UNKNOWN_ID
+
+
+def build_sketches(records):
+    """Sketch (date, department_id, station_id, registration) records by their key"""
+    sketches = {}
+    for day, department_id, station_id, registration in records:
+        if day is None or registration is None:
+            continue
+        key = (day, _key_id(department_id), _key_id(station_id))
+        registers = sketches.get(key)
+        if registers is None:
+            registers = sketches[key] = new_sketch()
+        add(registers, registration)
+    return sketches
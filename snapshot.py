@@ -0,0 +1,204 @@
+"""Columnar Parquet snapshot of fuel transactions, queried through DuckDB.
+
+The snapshot is optional: it is only used when ``ANALYTICS_SNAPSHOT_DIR`` is
+set. Refreshes are incremental and bounded by the ingest watermark, so only
+transactions from completed loads are ever copied into the snapshot.
+Rows are read through the view over the hot table and the columnstore
+archive (see script.py), which keeps ids, so a snapshot built after cold
+rows were archived still has the full history.
+"""
+import os
+import json
+import time
+import fcntl
+import argparse
+import threading
+from dotenv import load_dotenv
+import admission
+
+load_dotenv()
+
+SNAPSHOT_DIR = os.getenv("ANALYTICS_SNAPSHOT_DIR")
+SNAPSHOT_BATCH_ROWS = int(os.getenv("ANALYTICS_SNAPSHOT_BATCH_ROWS", 500000))
+SNAPSHOT_MAX_PARTS = int(os.getenv("ANALYTICS_SNAPSHOT_MAX_PARTS", 24))
+STATE_FILE = "_state.json"
+LOCK_FILE = "_refresh.lock"
+
+SNAPSHOT_QUERY = """
+SELECT TOP ({limit})
+    ft.id, ft.date, ft.vehicle_registration,
+    ft.department_id, d.name AS department,
+    ft.service_station_id, s.name AS service_station, s.region,
+    p.name AS product,
+    CAST(ft.quantity AS FLOAT) AS quantity,
+    CAST(ft.customer_amount AS FLOAT) AS customer_amount,
+    CAST(ft.terminal_price AS FLOAT) AS terminal_price
+FROM fuel_transactions_all ft
+LEFT JOIN departments d ON ft.department_id = d.id
+LEFT JOIN service_stations s ON ft.service_station_id = s.id
+LEFT JOIN products p ON ft.product_id = p.id
+WHERE ft.id > {low} AND ft.id <= {high}
+ORDER BY ft.id
+"""
+
+WATERMARK_QUERY = "SELECT COALESCE(MAX(max_transaction_id), 0) AS watermark FROM ingest_watermarks"
+
+_local = threading.local()
+
+
+def is_enabled():
+    return bool(SNAPSHOT_DIR)
+
+
+def read_state(snapshot_dir=None):
+    """Return the snapshot state, or an empty state if none was written yet"""
+    path = os.path.join(snapshot_dir or SNAPSHOT_DIR, STATE_FILE)
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'watermark': 0, 'parts': [], 'retired': [], 'refreshed_at': None}
+
+
+def write_state(state, snapshot_dir=None):
+    snapshot_dir = snapshot_dir or SNAPSHOT_DIR
+    tmp_path = os.path.join(snapshot_dir, STATE_FILE + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, os.path.join(snapshot_dir, STATE_FILE))
+
+
+def is_available():
+    return is_enabled() and bool(read_state()['parts'])
+
+
+def _duckdb():
+    import duckdb
+    if not hasattr(_local, 'conn'):
+        _local.conn = duckdb.connect()
+    return _local.conn
+
+
+def _copy_to_parquet(con, source_sql, path):
+    tmp_path = path + '.tmp'
+    con.execute(f"COPY ({source_sql}) TO '{tmp_path}' (FORMAT PARQUET, COMPRESSION ZSTD)")
+    os.replace(tmp_path, path)
+
+
+def _compact(con, state, snapshot_dir):
+    """Merge all parts into one date-ordered file so row groups prune well"""
+    parts = [os.path.join(snapshot_dir, p) for p in state['parts']]
+    name = f"compact-{state['watermark']:012d}.parquet"
+    _copy_to_parquet(
+        con,
+        f"SELECT * FROM read_parquet({parts!r}) ORDER BY date, id",
+        os.path.join(snapshot_dir, name)
+    )
+    state['retired'].extend(p for p in state['parts'] if p != name)
+    state['parts'] = [name]
+    print(f"✅ Compacted snapshot into {name}")
+
+
+def refresh_snapshot(conn, snapshot_dir=None):
+    """Copy transactions above the snapshot watermark into new Parquet parts.
+
+    ``conn`` is anything ``pd.read_sql`` accepts (a SQLAlchemy connection or a
+    DBAPI connection). Returns the number of rows appended.
+    """
+    import pandas as pd
+
+    snapshot_dir = snapshot_dir or SNAPSHOT_DIR
+    if not snapshot_dir:
+        return 0
+    os.makedirs(snapshot_dir, exist_ok=True)
+
+    with open(os.path.join(snapshot_dir, LOCK_FILE), 'w') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            print("⚠️ Snapshot refresh already running, skipping")
+            return 0
+
+        state = read_state(snapshot_dir)
+
+        # Files retired by the previous refresh are no longer referenced by
+        # any reader that started after that refresh published its state.
+        for name in state['retired']:
+            try:
+                os.remove(os.path.join(snapshot_dir, name))
+            except FileNotFoundError:
+                pass
+        state['retired'] = []
+
+        high = int(pd.read_sql(WATERMARK_QUERY, conn).iloc[0]['watermark'])
+        low = state['watermark']
+        if high <= low:
+            print(f"Snapshot is current at watermark {low}")
+            write_state(state, snapshot_dir)
+            return 0
+
+        con = _duckdb()
+        appended = 0
+        while low < high:
+            batch = pd.read_sql(
+                SNAPSHOT_QUERY.format(limit=SNAPSHOT_BATCH_ROWS, low=low, high=high),
+                conn
+            )
+            if batch.empty:
+                break
+            batch['date'] = pd.to_datetime(batch['date'])
+            batch_high = int(batch['id'].iloc[-1])
+            name = f"part-{low + 1:012d}-{batch_high:012d}.parquet"
+            con.register('snapshot_batch', batch)
+            try:
+                _copy_to_parquet(con, "SELECT * FROM snapshot_batch", os.path.join(snapshot_dir, name))
+            finally:
+                con.unregister('snapshot_batch')
+            state['parts'].append(name)
+            appended += len(batch)
+            low = batch_high
+            print(f"Snapshot part {name} with {len(batch)} rows")
+
+        # Advance to the ingest watermark even if the tail had no rows
+        state['watermark'] = high
+        if len(state['parts']) > SNAPSHOT_MAX_PARTS:
+            _compact(con, state, snapshot_dir)
+        state['refreshed_at'] = time.time()
+        write_state(state, snapshot_dir)
+        print(f"✅ Snapshot refreshed with {appended} rows up to watermark {high}")
+        return appended
+
+
+def query(sql, params=()):
+    """Run ``sql`` against the snapshot, exposed as the ``fuel`` relation, and return tuples"""
+    state = read_state()
+    parts = [os.path.join(SNAPSHOT_DIR, p) for p in state['parts']]
+    con = _duckdb().cursor()
+    try:
+        con.execute(f"CREATE TEMP VIEW fuel AS SELECT * FROM read_parquet({parts!r})")
+        with admission.guard(con.interrupt):
+            return con.execute(sql, list(params)).fetchall()
+    finally:
+        con.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Refresh the analytics Parquet snapshot")
+    parser.add_argument('--every', type=int, default=0,
+                        help="Keep running and refresh every N seconds")
+    args = parser.parse_args()
+
+    if not is_enabled():
+        raise SystemExit("ANALYTICS_SNAPSHOT_DIR is not set")
+
+    from app import get_engine
+    while True:
+        with get_engine().connect() as conn:
+            refresh_snapshot(conn)
+        if not args.every:
+            break
+        time.sleep(args.every)
+
+
+if __name__ == "__main__":
+    main()
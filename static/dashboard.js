@@ -0,0 +1,259 @@
+document.addEventListener('DOMContentLoaded', function () {
+    // Update hidden input when switching tabs
+    const tabs = document.querySelectorAll('#dashboardTabs .nav-link');
+    tabs.forEach(tab => {
+        tab.addEventListener('click', function () {
+            const tabId = this.id.replace('-tab', '');
+            document.getElementById('activeTab').value = tabId;
+        });
+    });
+
+    const panels = [setupVirtualGrid(), setupTrends(), setupPagedTable()];
+    setupDataEvents(panels.filter(Boolean));
+});
+
+function setupDataEvents(panels) {
+    const source = document.getElementById('dataEvents');
+    if (!source || !window.EventSource) return;
+    const filters = JSON.parse(source.dataset.filters);
+    let version = source.dataset.version;
+
+    // Whether rows with these dates and departments can show under the current filters
+    function affects(change) {
+        if (!change.first_date) return true;
+        if (filters.start_date && filters.start_date > change.last_date) return false;
+        if (filters.end_date && filters.end_date < change.first_date) return false;
+        if (filters.department && change.departments &&
+            !change.departments.includes(parseInt(filters.department, 10))) return false;
+        return true;
+    }
+
+    function refreshSummary() {
+        fetch(source.dataset.aggregatesUrl).then(r => r.json()).then(result => {
+            Object.entries(result.summary).forEach(([key, value]) => {
+                const el = document.querySelector('[data-summary="' + key + '"]');
+                if (el) el.textContent = value;
+            });
+            Object.entries(result.charts || {}).forEach(([name, src]) => {
+                const img = document.querySelector('img[data-chart="' + name + '"]');
+                if (img) img.src = src;
+            });
+        });
+    }
+
+    function connect() {
+        const url = new URL(source.dataset.eventsUrl, window.location.origin);
+        url.searchParams.set('since', version);
+        const events = new EventSource(url);
+        events.addEventListener('data-change', function (e) {
+            const change = JSON.parse(e.data);
+            version = change.version;
+            if (!affects(change)) return;
+            refreshSummary();
+            panels.forEach(panel => panel.refresh());
+        });
+        // EventSource reconnects after a dropped stream itself, but not after an error response
+        events.onerror = function () {
+            if (events.readyState === EventSource.CLOSED) setTimeout(connect, 30000);
+        };
+    }
+    connect();
+}
+
+function setupPagedTable() {
+    const body = document.getElementById('pagedBody');
+    if (!body) return null;
+
+    function cell(text) {
+        const td = document.createElement('td');
+        td.textContent = text;
+        return td;
+    }
+
+    return {
+        refresh: function () {
+            fetch(body.dataset.rowsUrl).then(r => r.json()).then(data => {
+                if (!data.rows.length) return;
+                const fragment = document.createDocumentFragment();
+                data.rows.forEach(row => {
+                    const tr = document.createElement('tr');
+                    row.slice(0, 6).forEach(value => tr.appendChild(cell(value === null ? '' : value)));
+                    tr.appendChild(cell((row[6] || 0).toFixed(2)));
+                    tr.appendChild(cell((row[7] || 0).toFixed(2)));
+                    fragment.appendChild(tr);
+                });
+                body.replaceChildren(fragment);
+            });
+        }
+    };
+}
+
+function setupTrends() {
+    const panel = document.getElementById('trendPanel');
+    const tab = document.getElementById('trends-tab');
+    if (!panel || !tab) return null;
+
+    const svg = document.getElementById('trendChart');
+    const bucketSelect = document.getElementById('trendBucket');
+    const SVG_NS = 'http://www.w3.org/2000/svg';
+    const WIDTH = 1000, HEIGHT = 360, PAD = 50;
+    let data = null;
+
+    function svgElement(name, attrs, text) {
+        const el = document.createElementNS(SVG_NS, name);
+        Object.entries(attrs).forEach(([k, v]) => el.setAttribute(k, v));
+        if (text !== undefined) el.textContent = text;
+        return el;
+    }
+
+    function draw() {
+        const measure = document.querySelector('input[name="trendMeasure"]:checked').value;
+        const points = data ? data.series[measure] : [];
+        document.getElementById('trendEmpty').classList.toggle('d-none', points.length > 0);
+        svg.classList.toggle('d-none', points.length === 0);
+        svg.replaceChildren();
+        if (!points.length) return;
+
+        const xs = points.map(p => Date.parse(p[0]));
+        const ys = points.map(p => p[1]);
+        const minX = xs[0], spanX = (xs[xs.length - 1] - minX) || 1;
+        const maxY = Math.max(...ys) || 1;
+        const x = v => PAD + (v - minX) / spanX * (WIDTH - 2 * PAD);
+        const y = v => HEIGHT - PAD - v / maxY * (HEIGHT - 2 * PAD);
+
+        svg.appendChild(svgElement('polyline', {
+            'class': 'trend-line',
+            'points': xs.map((v, i) => x(v).toFixed(1) + ',' + y(ys[i]).toFixed(1)).join(' ')
+        }));
+        svg.appendChild(svgElement('text', {'class': 'trend-axis', x: PAD, y: HEIGHT - 20}, points[0][0]));
+        svg.appendChild(svgElement('text', {'class': 'trend-axis', x: WIDTH - PAD, y: HEIGHT - 20, 'text-anchor': 'end'}, points[points.length - 1][0]));
+        svg.appendChild(svgElement('text', {'class': 'trend-axis', x: PAD, y: PAD - 10}, maxY.toLocaleString()));
+    }
+
+    function load() {
+        const url = new URL(panel.dataset.trendsUrl, window.location.origin);
+        if (bucketSelect.value) url.searchParams.set('bucket', bucketSelect.value);
+        // About one point per two pixels of chart width
+        url.searchParams.set('points', Math.max(50, Math.min(1000, Math.round(svg.clientWidth / 2) || 400)));
+        fetch(url).then(r => r.json()).then(result => {
+            data = result;
+            document.getElementById('trendBucketLabel').textContent = 'Per ' + result.bucket;
+            draw();
+        });
+    }
+
+    tab.addEventListener('shown.bs.tab', function () {
+        if (!data) load();
+    });
+    if (tab.classList.contains('active')) load();
+    bucketSelect.addEventListener('change', load);
+    document.querySelectorAll('input[name="trendMeasure"]').forEach(input => input.addEventListener('change', draw));
+
+    // Series not fetched yet load fresh when the tab is first shown
+    return {refresh: function () { if (data) load(); }};
+}
+
+function setupVirtualGrid() {
+    const grid = document.getElementById('virtualGrid');
+    const toggle = document.getElementById('scrollToggle');
+    if (!grid || !toggle) return null;
+
+    const ROW_HEIGHT = 33;
+    const BLOCK_SIZE = 200;
+    const OVERSCAN = 10;
+    const MAX_BLOCKS = 20;
+    // Browsers cap element heights (Firefox near 17.9M px), so past
+    // this height the scroll position is scaled to a row position
+    const MAX_SPACER_HEIGHT = 1000000;
+    const body = document.getElementById('virtualBody');
+    const table = body.parentElement;
+    const spacer = document.getElementById('virtualSpacer');
+    let total = parseInt(grid.dataset.total, 10) || 0;
+    const blocks = new Map();
+    const pending = new Set();
+
+    function setHeight() {
+        spacer.style.height = Math.min(total * ROW_HEIGHT, MAX_SPACER_HEIGHT) + 'px';
+    }
+
+    // Fractional index of the row at the top of the viewport; equals
+    // scrollTop / ROW_HEIGHT while the spacer is not capped
+    function topRow() {
+        const scrollable = spacer.offsetHeight - grid.clientHeight;
+        const rows = total - grid.clientHeight / ROW_HEIGHT;
+        if (scrollable <= 0 || rows <= 0) return 0;
+        return Math.min(grid.scrollTop / scrollable, 1) * rows;
+    }
+
+    setHeight();
+
+    function fetchBlock(index) {
+        if (blocks.has(index) || pending.has(index)) return;
+        pending.add(index);
+        const url = new URL(grid.dataset.rowsUrl, window.location.origin);
+        url.searchParams.set('offset', index * BLOCK_SIZE);
+        url.searchParams.set('limit', BLOCK_SIZE);
+        fetch(url).then(r => r.json()).then(data => {
+            blocks.set(index, data.rows);
+            // Keep memory bounded while scrolling through huge result sets
+            if (blocks.size > MAX_BLOCKS) blocks.delete(blocks.keys().next().value);
+            render();
+        }).finally(() => pending.delete(index));
+    }
+
+    function cell(value, numeric) {
+        const td = document.createElement('td');
+        if (numeric) {
+            td.textContent = (value || 0).toFixed(2);
+        } else {
+            td.textContent = value === null ? '' : value;
+        }
+        return td;
+    }
+
+    function render() {
+        const position = topRow();
+        const first = Math.max(0, Math.floor(position) - OVERSCAN);
+        const last = Math.min(total, Math.ceil(position + grid.clientHeight / ROW_HEIGHT) + OVERSCAN);
+        const fragment = document.createDocumentFragment();
+        for (let i = first; i < last; i++) {
+            const block = blocks.get(Math.floor(i / BLOCK_SIZE));
+            if (!block) {
+                fetchBlock(Math.floor(i / BLOCK_SIZE));
+                continue;
+            }
+            const row = block[i % BLOCK_SIZE];
+            if (!row) continue;
+            const tr = document.createElement('tr');
+            row.slice(0, 6).forEach(value => tr.appendChild(cell(value, false)));
+            tr.appendChild(cell(row[6], true));
+            tr.appendChild(cell(row[7], true));
+            fragment.appendChild(tr);
+        }
+        body.replaceChildren(fragment);
+        table.style.top = (grid.scrollTop - (position - first) * ROW_HEIGHT) + 'px';
+    }
+
+    toggle.addEventListener('change', function () {
+        grid.classList.toggle('d-none', !this.checked);
+        document.getElementById('pagedTable').classList.toggle('d-none', this.checked);
+        const pager = document.getElementById('pager');
+        if (pager) pager.classList.toggle('d-none', this.checked);
+        if (this.checked) render();
+    });
+    grid.addEventListener('scroll', () => window.requestAnimationFrame(render));
+
+    return {
+        refresh: function () {
+            const url = new URL(grid.dataset.rowsUrl, window.location.origin);
+            url.searchParams.set('limit', 1);
+            url.searchParams.set('total', 1);
+            fetch(url).then(r => r.json()).then(data => {
+                total = data.total;
+                setHeight();
+                blocks.clear();
+                if (toggle.checked) render();
+            });
+        }
+    };
+}
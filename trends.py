@@ -0,0 +1,90 @@
+"""Time buckets and downsampling for the consumption trend lines.
+
+Transactions are summed per day, week or month in SQL, picking the finest
+bucket that keeps the series under ``TREND_MAX_BUCKETS``. The series is then
+reduced to a fixed point budget with Largest-Triangle-Three-Buckets, which
+keeps peaks and dips that plain averaging would flatten.
+"""
+import os
+from datetime import date, datetime
+
+TREND_POINTS = int(os.getenv("TREND_POINTS", 400))
+TREND_MAX_BUCKETS = 2000
+TREND_MEASURES = ('quantity', 'customer_amount')
+
+# Bucket name, approximate width in days, and its start date in T-SQL and DuckDB.
+# Weeks start on Monday like DuckDB's ISO weeks: day 0 (1900-01-01) is a Monday,
+# whereas DATEDIFF(week, ...) counts Sunday boundaries.
+BUCKETS = (
+    ('day', 1, "CAST(ft.date AS DATE)", "CAST(date AS DATE)"),
+    ('week', 7, "CAST(DATEADD(day, -(DATEDIFF(day, 0, ft.date) % 7), ft.date) AS DATE)", "CAST(date_trunc('week', date) AS DATE)"),
+    ('month', 30, "DATEFROMPARTS(YEAR(ft.date), MONTH(ft.date), 1)", "CAST(date_trunc('month', date) AS DATE)"),
+)
+
+
+def choose_bucket(start, end, requested=None):
+    """Finest bucket that keeps ``start``..``end`` under TREND_MAX_BUCKETS"""
+    for bucket in BUCKETS:
+        if bucket[0] == requested:
+            return bucket
+    span = (end - start).days + 1 if start and end else 0
+    for bucket in BUCKETS:
+        if span / bucket[1] <= TREND_MAX_BUCKETS:
+            return bucket
+    return BUCKETS[-1]
+
+
+def parse_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    try:
+        return date.fromisoformat(value[:10]) if value else None
+    except ValueError:
+        return None
+
+
+def lttb(points, threshold):
+    """Downsample (x, y) points to ``threshold`` with Largest-Triangle-Three-Buckets.
+
+    Always keeps the first and last point; ``x`` must be increasing.
+    """
+    n = len(points)
+    if threshold >= n or threshold < 3:
+        return list(points)
+
+    sampled = [points[0]]
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # Average of the next bucket is the third corner of the triangle
+        next_start = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        span = next_end - next_start
+        avg_x = sum(p[0] for p in points[next_start:next_end]) / span
+        avg_y = sum(p[1] for p in points[next_start:next_end]) / span
+
+        ax, ay = points[a]
+        best_area = -1.0
+        best = start = int(i * every) + 1
+        for j in range(start, int((i + 1) * every) + 1):
+            x, y = points[j]
+            area = abs((ax - avg_x) * (y - ay) - (ax - x) * (avg_y - ay))
+            if area > best_area:
+                best_area, best = area, j
+        sampled.append(points[best])
+        a = best
+    sampled.append(points[-1])
+    return sampled
+
+
+def build_series(rows, points=TREND_POINTS):
+    """Turn (bucket_date, quantity, amount) rows into downsampled [[iso_date, value], ...] series"""
+    rows = sorted((day, quantity or 0.0, amount or 0.0) for day, quantity, amount in rows if day is not None)
+    series = {}
+    for index, measure in enumerate(TREND_MEASURES, start=1):
+        sampled = lttb([(row[0].toordinal(), row[index]) for row in rows], points)
+        series[measure] = [[date.fromordinal(x).isoformat(), round(y, 2)] for x, y in sampled]
+    return series
+
@@ -0,0 +1,86 @@
+"""Warm the dashboard caches after an ingest.
+
+Replays the default view, the filter sets listed in ``WARM_VIEWS_FILE`` and
+the most viewed filter sets recorded by the dashboard into a fresh cache
+generation, then publishes it in one step. Until the publish, requests keep
+reading the previous generation.
+"""
+import os
+import json
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dotenv import load_dotenv
+
+from cache import RESULT_CACHE_DIR, popular_views, view_key
+
+load_dotenv()
+
+WARM_VIEWS_FILE = os.getenv("WARM_VIEWS_FILE")
+WARM_TOP_N = int(os.getenv("WARM_TOP_N", 20))
+WARM_WORKERS = int(os.getenv("WARM_WORKERS", 4))
+
+
+def configured_views(path=WARM_VIEWS_FILE):
+    """Filter sets from a JSON list of filter objects"""
+    if not path:
+        return []
+    with open(path) as f:
+        return [dict(view) for view in json.load(f)]
+
+
+def views_to_warm(top_n=WARM_TOP_N):
+    views = [{}] + configured_views() + popular_views(RESULT_CACHE_DIR, top_n)
+    unique = {}
+    for view in views:
+        unique.setdefault(view_key(view), view)
+    return list(unique.values())
+
+
+def warm_caches(top_n=WARM_TOP_N, workers=WARM_WORKERS):
+    """Fill and publish a new cache generation; returns the number of views warmed"""
+    if not RESULT_CACHE_DIR:
+        print("RESULT_CACHE_DIR is not set, nothing to warm")
+        return 0
+
+    import charts
+    from app import create_app, result_cache, load_dashboard_view
+
+    app = create_app()
+    views = views_to_warm(top_n)
+    staging = result_cache.begin_generation()
+
+    def warm(filters):
+        with app.test_request_context():
+            load_dashboard_view(filters, generation=staging)
+
+    warmed = 0
+    try:
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            futures = {executor.submit(warm, view): view for view in views}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                    warmed += 1
+                except Exception as e:
+                    print(f"⚠️ Could not warm view {futures[future]}: {e}")
+    finally:
+        # Publish even a partly warmed generation: old results must not outlive the ingest
+        generation = result_cache.publish(staging)
+        charts.shutdown()
+
+    print(f"✅ Warmed {warmed}/{len(views)} dashboard views into cache generation {generation}")
+    return warmed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Warm the dashboard result cache")
+    parser.add_argument('--top', type=int, default=WARM_TOP_N,
+                        help="Number of most viewed filter sets to replay")
+    parser.add_argument('--workers', type=int, default=WARM_WORKERS,
+                        help="Views warmed in parallel")
+    args = parser.parse_args()
+    warm_caches(args.top, args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -1 +1,3 @@
-from _app import app as application
\ No newline at end of file
+from app import create_app
+
+app = create_app()